@@ -0,0 +1,163 @@
+"""
+benchmark suite of proxypool, runs without network against fakeredis or a local redis-server
+
+usage:
+    python -m benchmarks --output result.json
+    python -m benchmarks --redis redis://127.0.0.1:6379/15 --only storage,tester
+    python -m benchmarks --output new.json --compare result.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+SUITES = ('proxy', 'storage', 'shards', 'contract', 'api', 'tester', 'stream', 'getter', 'imports')
+# origin server of the proxy simulator, answers TEST_URL and TEST_ANONYMOUS_URL
+ORIGIN_PORT = 29999
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='ProxyPool benchmarks')
+    parser.add_argument('--redis', type=str, default=None,
+                        help='redis connection string, the database will be flushed, use fakeredis if not set, '
+                             'comma separated connection strings are shards')
+    parser.add_argument('--shards', type=int, default=1, help='number of fakeredis shards if redis is not set')
+    parser.add_argument('--storage', type=str, default='redis', choices=('redis', 'embedded'),
+                        help='storage used by storage, tester and getter benchmarks, embedded runs in memory')
+    parser.add_argument('--only', type=str, default=','.join(SUITES), help=f'suites to run, {",".join(SUITES)}')
+    parser.add_argument('--sizes', type=str, default='1000,10000,50000', help='pool sizes of storage benchmark')
+    parser.add_argument('--api-size', type=int, default=10000, help='pool size of api benchmark')
+    parser.add_argument('--api-requests', type=int, default=2000)
+    parser.add_argument('--api-concurrency', type=int, default=20)
+    parser.add_argument('--fleet-size', type=int, default=1000, help='number of simulated proxies of tester benchmark')
+    parser.add_argument('--mix', type=str, default='alive=0.6,dead=0.2,slow=0.05,transparent=0.1,flapping=0.05',
+                        help='ratios of simulated proxy behaviours')
+    parser.add_argument('--latency', type=float, default=0.05, help='latency of simulated proxies in seconds')
+    parser.add_argument('--test-batch', type=int, default=None, help='override TEST_BATCH')
+    parser.add_argument('--test-timeout', type=int, default=2, help='override TEST_TIMEOUT')
+    parser.add_argument('--output', type=str, default=None, help='write json result to file')
+    parser.add_argument('--compare', type=str, default=None, help='json result to compare with')
+    return parser.parse_args()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(data, prefix=''):
+    """
+    flatten nested result to {path: number}
+    """
+    items = {}
+    for key, value in data.items():
+        path = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            items.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[path] = value
+    return items
+
+
+def compare(old, new):
+    """
+    print changes of every metric between two results
+    """
+    old, new = flatten(old['results']), flatten(new['results'])
+    for path in sorted(set(old) & set(new)):
+        if old[path] == new[path]:
+            continue
+        change = f'{(new[path] - old[path]) / old[path] * 100:+.1f}%' if old[path] else 'n/a'
+        print(f'{path:<60} {old[path]:>14} {new[path]:>14} {change:>9}')
+
+
+def main():
+    args = parse_args()
+    # settings are read from environment on import, so set them before importing proxypool,
+    # the tester requests the origin server of the proxy simulator instead of the internet
+    os.environ['TEST_URL'] = f'http://127.0.0.1:{ORIGIN_PORT}/'
+    os.environ['TEST_ANONYMOUS_URL'] = f'http://127.0.0.1:{ORIGIN_PORT}/ip'
+    os.environ['TEST_TIMEOUT'] = str(args.test_timeout)
+    if args.test_batch:
+        os.environ['TEST_BATCH'] = str(args.test_batch)
+    # entries of the tester killed by stream check are claimed again within seconds
+    os.environ.setdefault('INGEST_CLAIM_IDLE', '2')
+    # file sinks of setting write into a temporary directory instead of logs of the repo,
+    # disabling them with ENABLE_LOG_FILE would remove LOG_DIR
+    os.environ.setdefault('LOG_DIR', tempfile.mkdtemp(prefix='proxypool-benchmarks-'))
+    print(f'logs are written to {os.environ["LOG_DIR"]}', file=sys.stderr)
+    from loguru import logger
+    # keep file sinks of setting, only drop console output
+    logger.remove(0)
+
+    suites = [suite.strip() for suite in args.only.split(',') if suite.strip()]
+    results = {}
+    for suite in suites:
+        if suite not in SUITES:
+            sys.exit(f'unknown suite {suite}')
+        print(f'running {suite} benchmark...', file=sys.stderr)
+        if suite == 'proxy':
+            from benchmarks import proxy
+            results[suite] = proxy.run()
+        elif suite == 'storage':
+            from benchmarks import storage
+            results[suite] = storage.run(args.redis, sizes=[int(size) for size in args.sizes.split(',')],
+                                           shards=args.shards, storage=args.storage)
+        elif suite == 'shards':
+            from benchmarks import shards
+            results[suite] = shards.run(args.redis, shards=args.shards)
+        elif suite == 'contract':
+            from benchmarks import contract
+            results[suite] = contract.run(args.redis, shards=args.shards)
+        elif suite == 'api':
+            from benchmarks import api
+            results[suite] = api.run(args.redis, size=args.api_size, requests=args.api_requests,
+                                     concurrency=args.api_concurrency)
+        elif suite == 'tester':
+            from benchmarks import tester
+            results[suite] = tester.run(args.redis, size=args.fleet_size, mix=args.mix, latency=args.latency,
+                                        origin_port=ORIGIN_PORT, shards=args.shards,
+                                        storage=args.storage)
+        elif suite == 'stream':
+            from benchmarks import stream
+            results[suite] = stream.run(args.redis, size=min(args.fleet_size, 500), mix=args.mix,
+                                        latency=args.latency, origin_port=ORIGIN_PORT)
+        elif suite == 'getter':
+            from benchmarks import getter
+            results[suite] = getter.run(args.redis, shards=args.shards, storage=args.storage)
+        elif suite == 'imports':
+            from benchmarks import imports
+            results[suite] = imports.run()
+
+    output = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage': args.storage,
+            'redis': 'redis' if args.redis else 'fakeredis',
+            'shards': len(args.redis.split(',')) if args.redis else args.shards,
+        },
+        'results': results,
+    }
+    text = json.dumps(output, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+benchmark of `/random` and `/all` throughput under every APP_PROD_METHOD,
+every method is served by `Scheduler.run_server` in a child process
+
+usage: python -m benchmarks --only api
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import aiohttp
+from benchmarks.utils import summarize
+
+# `dev` is the flask development server used when APP_ENV is not prod
+METHODS = ('dev', 'gevent', 'tornado', 'meinheld')
+
+
+async def _load(url, total, concurrency):
+    """
+    request url total times with concurrency workers
+    """
+    latencies, errors = [], 0
+    counter = iter(range(total))
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        async def worker():
+            nonlocal errors
+            for _ in counter:
+                begin = time.perf_counter()
+                try:
+                    async with session.get(url) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                            continue
+                except aiohttp.ClientError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - begin)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    result = summarize(latencies, elapsed)
+    result['errors'] = errors
+    return result
+
+
+def load(url, total, concurrency):
+    return asyncio.new_event_loop().run_until_complete(_load(url, total, concurrency))
+
+
+def wait_ready(process, url, timeout=30):
+    """
+    wait until server answers, return False if server exits or timeouts
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        if not load(url, 1, 1)['errors']:
+            return True
+        time.sleep(.2)
+    return False
+
+
+def serve(size, redis_url=None):
+    """
+    seed the pool and run server, called in the child process
+    with settings of the method passed by environment
+    """
+    from loguru import logger
+    from proxypool import scheduler
+    from proxypool.processors import server
+    from benchmarks.utils import create_redis, generate_proxies, flush
+    logger.remove(0)
+    client = create_redis(redis_url)
+    flush(client)
+    for proxy in generate_proxies(size):
+        client.add(proxy)
+    # fakeredis lives in this process only, so every request and the heartbeat of server share the seeded client,
+    # both modules bind create_client on import
+    server.create_client = lambda: client
+    scheduler.create_client = lambda: client
+    scheduler.Scheduler().run_server()
+
+
+def run(redis_url=None, size=10000, requests=2000, concurrency=20, port=5600, methods=METHODS):
+    """
+    run benchmark
+    :param redis_url: redis connection string, use fakeredis if not set
+    :param size: pool size
+    :param requests: number of `/random` requests, `/all` is requested a tenth as much
+    :param concurrency: concurrent connections
+    :param port: port of server
+    :param methods: APP_PROD_METHOD list
+    :return: dict of result
+    """
+    results = {}
+    for method in methods:
+        command = [sys.executable, '-m', 'benchmarks.api', '--size', str(size)]
+        if redis_url:
+            command += ['--redis', redis_url]
+        env = dict(os.environ, APP_ENV='test' if method == 'dev' else 'prod', APP_PROD_METHOD=method,
+                   API_HOST='127.0.0.1', API_PORT=str(port))
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f'http://127.0.0.1:{port}'
+        try:
+            if not wait_ready(process, f'{base_url}/count'):
+                results[method] = {'error': 'server failed to start, is it installed?'}
+                continue
+            results[method] = {
+                'random': load(f'{base_url}/random', requests, concurrency),
+                'all': load(f'{base_url}/all', max(requests // 10, 1), concurrency),
+            }
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='API benchmark server')
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--redis', type=str, default=None)
+    args = parser.parse_args()
+    serve(args.size, args.redis)
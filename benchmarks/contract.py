@@ -0,0 +1,203 @@
+"""
+the same checks against every storage, EmbeddedClient, RedisClient and ShardedRedisClient,
+one group of checks per interface of proxypool.storages.base, every check reports number of mismatches,
+so the embedded storage is a drop-in fixture for redis ones
+
+the ingest stream is only checked on embedded storage and real redis-server, fakeredis has no streams
+
+usage: python -m benchmarks --only contract
+       python -m benchmarks --only contract --redis redis://127.0.0.1:6379/15,redis://127.0.0.1:6380/15
+"""
+import time
+from proxypool.exceptions import PoolEmptyException
+from proxypool.setting import PROXY_SCORE_MAX, PROXY_SCORE_MIN, PROXY_SCORE_INIT, EVICTION_POLICY_LOWEST_SCORE
+from proxypool.storages.base import protocol_key
+from benchmarks.utils import create_redis, generate_proxies, flush
+
+# proxies of pool checked
+SIZE = 20
+
+# key of metrics checked
+METRICS_KEY = 'proxies:contract:metrics'
+
+
+def check_pool(client):
+    """
+    checks of BaseStorage
+    :return: dict of check to number of mismatches
+    """
+    mismatches = {}
+    proxies = generate_proxies(SIZE)
+    missing = generate_proxies(SIZE + 1, seed=1)[-1:]
+    mismatches['add_many'] = int(client.add_many(proxies) != SIZE) + int(client.add_many(proxies[:5]) != 0)
+    mismatches['add'] = int(not client.add(missing[0])) + int(bool(client.add(missing[0])))
+    client.remove(missing)
+    mismatches['exists'] = int(not client.exists(proxies[0])) + int(client.exists(missing[0]))
+    mismatches['exists_many'] = int(client.exists_many(proxies[:2] + missing) != [True, True, False])
+    mismatches['count'] = int(client.count() != SIZE)
+    mismatches['scores'] = int(client.scores(proxies[:2] + missing) != [PROXY_SCORE_INIT, PROXY_SCORE_INIT, None])
+    client.max(proxies[0])
+    mismatches['max'] = int(client.scores(proxies[:1]) != [PROXY_SCORE_MAX])
+    # increase is capped and never adds proxies
+    client.increase(proxies[1], proxy_score_max=PROXY_SCORE_INIT + 1)
+    client.increase(proxies[1], proxy_score_max=PROXY_SCORE_INIT + 1)
+    mismatches['increase'] = int(client.scores(proxies[1:2]) != [PROXY_SCORE_INIT + 1]) + \
+        int(client.increase(missing[0]) is not None) + int(client.exists(missing[0]))
+    client.decrease(proxies[2])
+    mismatches['decrease'] = int(client.scores(proxies[2:3]) != [PROXY_SCORE_INIT - 1])
+    client.decrease(proxies[3], proxy_score_min=PROXY_SCORE_INIT)
+    mismatches['decrease_removes'] = int(client.exists(proxies[3]))
+    mismatches['random'] = int(client.random().string() != proxies[0].string())
+    ranked = client.ranked(0, -1)
+    scores = [score for _, score in ranked]
+    mismatches['ranked'] = int(scores != sorted(scores, reverse=True)) + int(client.ranked(0, 2) != ranked[:2]) + \
+        int(ranked[0][0] != proxies[0].string())
+    mismatches['count_bands'] = int(client.count_bands([(PROXY_SCORE_MAX, PROXY_SCORE_MAX),
+                                                        (PROXY_SCORE_MIN, f'({PROXY_SCORE_MAX}')]) != [1, SIZE - 2])
+    mismatches['all'] = int(sorted(proxy.string() for proxy in client.all()) != sorted(member for member, _ in ranked))
+    cursor, members = 0, []
+    while True:
+        cursor, batch = client.batch(cursor, count=7)
+        members += [proxy.string() for proxy in batch or []]
+        if not cursor:
+            break
+    mismatches['batch'] = int(sorted(members) != sorted(member for member, _ in ranked))
+    evicted = client.evict(2, policy=EVICTION_POLICY_LOWEST_SCORE)
+    mismatches['evict'] = int([proxy.string() for proxy in evicted] != [ranked[-1][0], ranked[-2][0]]) + \
+        int(client.count() != SIZE - 3)
+    mismatches['remove'] = int(client.remove(proxies[:1]) != 1) + int(client.exists(proxies[0]))
+    return mismatches
+
+
+def check_leases(client):
+    """
+    checks of leases of BaseStorage, every proxy is leased once before any is shared
+    """
+    mismatches = {}
+    proxies = generate_proxies(SIZE)
+    client.add_many(proxies)
+    leases = [client.lease(60) for _ in range(SIZE)]
+    mismatches['lease_unique'] = int(len({str(proxy) for proxy, _ in leases}) != SIZE) + \
+        sum(shared for _, shared in leases)
+    mismatches['lease_shared'] = int(not client.lease(60)[1])
+    mismatches['count_leased'] = int(client.count_leased() != SIZE)
+    proxy = leases[0][0]
+    mismatches['release'] = int(not client.release(proxy)) + int(client.release(proxy))
+    mismatches['lease_released'] = int(str(client.lease(60)[0]) != str(proxy)) + int(client.count_leased() != SIZE)
+    return mismatches
+
+
+def check_metas(client):
+    """
+    checks of metadata and indexes of BaseStorage
+    """
+    mismatches = {}
+    proxies = generate_proxies(SIZE)
+    client.add_many(proxies, sources=['contract'] * SIZE)
+    mismatches['metas'] = sum(meta is None or meta.source != 'contract' for meta in client.metas(proxies))
+    key = protocol_key('https')
+    client.update_metas({proxy.string(): (True, 100, 'http,https' if index < 5 else 'http')
+                         for index, proxy in enumerate(proxies)})
+    metas = client.metas(proxies)
+    mismatches['update_metas'] = sum(meta.success != 1 or meta.latency != 100 for meta in metas)
+    indexed = {proxy.string() for proxy in proxies[:5]}
+    picked = {client.random_in_index(key).string() for _ in range(50)}
+    mismatches['random_in_index'] = len(picked - indexed) + int(not picked)
+    # proxies leave indexes of protocols they no longer support
+    client.update_metas({member: (True, 100, 'http') for member in indexed})
+    try:
+        client.random_in_index(key)
+        mismatches['index_removed'] = 1
+    except PoolEmptyException:
+        mismatches['index_removed'] = 0
+    mismatches['random_by_meta'] = int(client.random_by_meta(lambda meta: meta.source == 'contract') is None)
+    return mismatches
+
+
+def check_ingest_stream(client, streams=True):
+    """
+    checks of IngestStream
+    :param streams: if stream is checked, fakeredis has no streams
+    """
+    mismatches = {}
+    # subscribe first, events are only received once subscribed
+    client.wait_ingested(0)
+    client.notify_ingested(3)
+    client.notify_ingested(2)
+    mismatches['wait_ingested'] = int(client.wait_ingested(1) != 5)
+    if not streams:
+        return mismatches
+    members = [proxy.string() for proxy in generate_proxies(5)]
+    client.enqueue_ingested(members)
+    entries = client.claim_ingested('contract', 10)
+    mismatches['claim_ingested'] = int([member for _, member in entries] != members)
+    client.ack_ingested([entry_id for entry_id, _ in entries])
+    mismatches['ack_ingested'] = int(client.claim_ingested('contract', 10) != [])
+    return mismatches
+
+
+def check_verdict_cache(client):
+    """
+    checks of VerdictCache
+    """
+    client.cache_verdicts({'a|target': '1|1|10', 'b|target': '0|0|10'}, 60)
+    client.cache_verdicts({'c|target': '1|1|10'}, 1)
+    mismatches = {'verdicts': int(client.verdicts(['a|target', 'b|target', 'd|target']) != ['1|1|10', '0|0|10', None])}
+    time.sleep(1.1)
+    mismatches['verdicts_expired'] = int(client.verdicts(['c|target', 'a|target']) != [None, '1|1|10'])
+    return mismatches
+
+
+def check_process_status(client):
+    """
+    checks of ProcessStatus
+    """
+    status = {'pid': 1, 'at': 1.5, 'proxies': 10}
+    client.beat('tester', status)
+    client.beat('getter', status)
+    client.set_crawlers(['daili66', 'ihuan'])
+    heartbeats = client.heartbeats()
+    return {'heartbeats': int(heartbeats != {'tester': status, 'getter': status})}
+
+
+def check_metrics_store(client):
+    """
+    checks of MetricsStore
+    """
+    client.flush_metrics(METRICS_KEY, {'a': 1, 'b': 0.5})
+    client.flush_metrics(METRICS_KEY, {'a': 2})
+    samples = {sample: float(value) for sample, value in client.read_metrics(METRICS_KEY).items()}
+    return {'metrics': int(samples != {'a': 3.0, 'b': 0.5})}
+
+
+def check(client, streams=True):
+    """
+    run every check on empty storage
+    :return: dict of check to number of mismatches
+    """
+    mismatches = {}
+    for func in (check_pool, check_leases, check_metas, check_verdict_cache, check_process_status,
+                 check_metrics_store):
+        flush(client)
+        mismatches.update(func(client))
+    flush(client)
+    mismatches.update(check_ingest_stream(client, streams))
+    flush(client)
+    return mismatches
+
+
+def run(redis_url=None, shards=2):
+    """
+    run checks against every storage
+    :param redis_url: redis connection string, fakeredis if not set, comma separated ones are used for the sharded
+        client and the first one for the single one, the databases will be flushed
+    :param shards: number of fakeredis shards if redis_url is not set, at least 2
+    :return: dict of storage to dict of check to number of mismatches
+    """
+    urls = redis_url.split(',') if redis_url else []
+    clients = {
+        'embedded': create_redis(storage='embedded'),
+        'redis': create_redis(urls[0] if urls else None),
+        'sharded': create_redis(redis_url if len(urls) > 1 else None, max(shards, 2)),
+    }
+    return {name: check(client, streams=name == 'embedded' or bool(urls)) for name, client in clients.items()}
@@ -0,0 +1,272 @@
+"""
+simulated http proxy fleet on localhost, every proxy answers the request itself like a proxy would,
+so the tester can be load-tested end to end without network
+
+behaviours of proxies:
+- alive: answers after latency
+- dead: nothing listens on the port, connection is refused
+- slow: answers after slow latency, which is longer than TEST_TIMEOUT
+- transparent: answers, but leaks the origin ip to the anonymous check like httpbin does with X-Forwarded-For
+- flapping: alive and dropping connections in turn every flap period
+
+every proxy is an http proxy which also tunnels CONNECT requests, socks handshakes are refused
+
+proxies are spread over 127.1.x.y hosts, so the anonymous check can tell the proxy ip from the origin ip 127.0.0.1,
+point TEST_URL and TEST_ANONYMOUS_URL at the origin server, like http://127.0.0.1:29999/ip
+
+usage: python -m benchmarks.fleet --size 10000 --mix alive=0.6,dead=0.2,slow=0.05,transparent=0.1,flapping=0.05
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import time
+from proxypool.schemas.proxy import Proxy
+from proxypool.setting import PROXY_SCORE_INIT, PROXY_SCORE_MAX, PROXY_SCORE_MIN, TEST_ANONYMOUS, TEST_TIMEOUT, \
+    TEST_DONT_SET_MAX_SCORE, REDIS_KEY
+from benchmarks.utils import raise_nofile_limit
+
+ALIVE, DEAD, SLOW, TRANSPARENT, FLAPPING = 'alive', 'dead', 'slow', 'transparent', 'flapping'
+BEHAVIOURS = (ALIVE, DEAD, SLOW, TRANSPARENT, FLAPPING)
+DEFAULT_MIX = 'alive=0.6,dead=0.2,slow=0.05,transparent=0.1,flapping=0.05'
+ORIGIN_HOST = '127.0.0.1'
+
+
+def parse_mix(mix):
+    """
+    parse mix like alive=0.6,dead=0.4 to dict
+    """
+    ratios = {}
+    for item in mix.split(','):
+        behaviour, _, ratio = item.partition('=')
+        if behaviour.strip() not in BEHAVIOURS:
+            raise ValueError(f'unknown behaviour {behaviour}')
+        ratios[behaviour.strip()] = float(ratio)
+    return ratios
+
+
+def _response(body, content_type='text/plain'):
+    body = body.encode()
+    return (f'HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n').encode() + body
+
+
+class ProxySimulator(object):
+    """
+    simulator of a proxy fleet with controlled behaviours
+    """
+
+    def __init__(self, behaviours, latency=0.0, slow_latency=None, flap_period=1.0, base_port=30000,
+                 ports_per_host=500, origin_port=29999):
+        """
+        init simulator
+        :param behaviours: list of behaviour, one per proxy
+        :param latency: seconds to wait before answering
+        :param slow_latency: seconds slow proxies wait, TEST_TIMEOUT + 1 by default
+        :param flap_period: seconds flapping proxies stay alive or dead
+        :param base_port: first port of every host
+        :param ports_per_host: proxies listening on one host
+        :param origin_port: port of origin server, which answers direct requests
+        """
+        self.behaviours = {}
+        for index, behaviour in enumerate(behaviours):
+            host_index = index // ports_per_host
+            host = f'127.1.{host_index // 254}.{host_index % 254 + 1}'
+            self.behaviours[(host, base_port + index % ports_per_host)] = behaviour
+        self.latency = latency
+        self.slow_latency = TEST_TIMEOUT + 1 if slow_latency is None else slow_latency
+        self.flap_period = flap_period
+        self.origin_port = origin_port
+        self.process = None
+
+    @classmethod
+    def from_mix(cls, size, mix=DEFAULT_MIX, seed=0, **kwargs):
+        """
+        create simulator with ratios of behaviours
+        :param size: number of proxies
+        :param mix: dict or str of ratios, like alive=0.6,dead=0.4
+        :param seed: random seed used to shuffle behaviours
+        """
+        ratios = parse_mix(mix) if isinstance(mix, str) else mix
+        total = sum(ratios.values())
+        behaviours = []
+        for behaviour, ratio in ratios.items():
+            behaviours += [behaviour] * int(round(size * ratio / total))
+        behaviours = (behaviours + [ALIVE] * size)[:size]
+        random.Random(seed).shuffle(behaviours)
+        return cls(behaviours, **kwargs)
+
+    @property
+    def origin_url(self):
+        return f'http://{ORIGIN_HOST}:{self.origin_port}'
+
+    @property
+    def proxies(self):
+        """
+        proxies of the fleet
+        :return: list of Proxy
+        """
+        return [Proxy(host=host, port=port) for host, port in self.behaviours]
+
+    def count(self):
+        """
+        number of proxies of every behaviour
+        """
+        counts = dict.fromkeys(BEHAVIOURS, 0)
+        for behaviour in self.behaviours.values():
+            counts[behaviour] += 1
+        return counts
+
+    def is_flapping_alive(self):
+        return int(time.time() / self.flap_period) % 2 == 0
+
+    async def handle_origin(self, reader, writer):
+        """
+        answer direct request like httpbin, `/ip` returns ip of client
+        """
+        try:
+            request_line = await reader.readuntil(b'\r\n\r\n')
+            if b' /ip ' in request_line.split(b'\r\n', 1)[0]:
+                writer.write(_response(json.dumps({'origin': writer.get_extra_info('peername')[0]}),
+                                       'application/json'))
+            else:
+                writer.write(_response('ok'))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_proxy(self, reader, writer, host, behaviour):
+        """
+        answer one proxied request as if it was fetched from the target
+        """
+        try:
+            # socks handshakes start with version byte, http proxies close them
+            first = await reader.readexactly(1)
+            if first in (b'\x04', b'\x05'):
+                return
+            head = first + await reader.readuntil(b'\r\n\r\n')
+            if behaviour == SLOW:
+                await asyncio.sleep(self.slow_latency)
+            elif self.latency:
+                await asyncio.sleep(self.latency)
+            if behaviour == FLAPPING and not self.is_flapping_alive():
+                return
+            # request line of proxy is like GET http://127.0.0.1:29999/ip HTTP/1.1
+            method, url = head.split(b'\r\n', 1)[0].split(b' ')[:2]
+            if method == b'CONNECT':
+                writer.write(b'HTTP/1.1 200 Connection established\r\n\r\n')
+            elif url.rstrip(b'/').endswith(b'/ip'):
+                origin = host
+                if behaviour == TRANSPARENT:
+                    origin = f'{writer.get_extra_info("peername")[0]}, {host}'
+                writer.write(_response(json.dumps({'origin': origin}), 'application/json'))
+            else:
+                writer.write(_response('ok'))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, ready):
+        """
+        start origin server and a server for every proxy which is not dead, then serve forever
+        """
+        servers = [await asyncio.start_server(self.handle_origin, ORIGIN_HOST, self.origin_port, backlog=1024)]
+        for (host, port), behaviour in self.behaviours.items():
+            if behaviour == DEAD:
+                continue
+            servers.append(await asyncio.start_server(
+                lambda reader, writer, host=host, behaviour=behaviour: self.handle_proxy(reader, writer, host,
+                                                                                         behaviour),
+                host, port, backlog=1024))
+        ready.set()
+        await asyncio.gather(*[server.serve_forever() for server in servers])
+
+    def _run(self, ready):
+        raise_nofile_limit()
+        asyncio.new_event_loop().run_until_complete(self.serve(ready))
+
+    def start(self, timeout=120):
+        """
+        run simulator in a child process, so it doesn't compete with the tester for the gil,
+        every proxy which is not dead costs a listening socket
+        """
+        ready = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=self._run, args=(ready,), daemon=True)
+        self.process.start()
+        if not ready.wait(timeout):
+            self.stop()
+            raise RuntimeError('proxy simulator failed to start')
+        return self
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def seed(self, client, redis_key=REDIS_KEY):
+        """
+        add all proxies to the pool with init score
+        :param client: storage
+        """
+        client.add_many(self.proxies, PROXY_SCORE_INIT, redis_key)
+
+    @staticmethod
+    def expected_scores(behaviour):
+        """
+        scores a proxy of behaviour may have after one sweep from init score,
+        None means the proxy was removed
+        """
+        decreased = PROXY_SCORE_INIT - 1 if PROXY_SCORE_INIT - 1 > PROXY_SCORE_MIN else None
+        valid = PROXY_SCORE_INIT if TEST_DONT_SET_MAX_SCORE else PROXY_SCORE_MAX
+        # score follows the http check, which transparent proxies fail by leaking the origin ip
+        if behaviour == ALIVE or (behaviour == TRANSPARENT and not TEST_ANONYMOUS):
+            return {valid}
+        if behaviour == FLAPPING:
+            return {valid, decreased}
+        return {decreased}
+
+    def verify(self, client, redis_key=REDIS_KEY, skip=()):
+        """
+        check scores after one sweep against the expected transitions
+        :param client: storage
+        :param skip: proxy strings left out, like those never tested
+        :return: dict of behaviour to number of proxies with unexpected score
+        """
+        scores = dict(client.ranked(0, -1, redis_key=redis_key))
+        mismatches = dict.fromkeys(BEHAVIOURS, 0)
+        for behaviour, proxy in zip(self.behaviours.values(), self.proxies):
+            if proxy.string() in skip:
+                continue
+            score = scores.get(proxy.string())
+            if (None if score is None else int(score)) not in self.expected_scores(behaviour):
+                mismatches[behaviour] += 1
+        return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Proxy fleet simulator')
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--mix', type=str, default=DEFAULT_MIX)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--origin-port', type=int, default=29999)
+    parser.add_argument('--redis', type=str, default=None, help='seed proxies into this redis')
+    args = parser.parse_args()
+    simulator = ProxySimulator.from_mix(args.size, args.mix, latency=args.latency, origin_port=args.origin_port)
+    if args.redis:
+        from benchmarks.utils import create_redis
+        simulator.seed(create_redis(args.redis))
+    print(f'{simulator.count()}\nexport TEST_URL={simulator.origin_url}/ TEST_ANONYMOUS_URL={simulator.origin_url}/ip')
+    raise_nofile_limit()
+    asyncio.new_event_loop().run_until_complete(simulator.serve(multiprocessing.Event()))
@@ -0,0 +1,126 @@
+"""
+benchmark of Getter ingest rate from canned crawler pages, no network involved
+
+usage: python -m benchmarks --only getter
+"""
+import json
+import time
+from proxypool.crawlers import __all__ as crawlers_cls
+from proxypool.processors.getter import Getter
+from proxypool.setting import PARSER_POOL_SIZE
+from benchmarks.utils import create_redis, generate_proxies, flush
+
+
+def render_daili66(proxies):
+    rows = ''.join(f'<tr><td>{proxy.host}</td><td>{proxy.port}</td><td>-</td></tr>' for proxy in proxies)
+    return f'<div class="containerbox"><table><tr><td>ip</td><td>port</td></tr>{rows}</table></div>'
+
+
+def render_ip3366(proxies):
+    return ''.join(f'<tr>\n<td>{proxy.host}</td>\n<td>{proxy.port}</td>\n</tr>' for proxy in proxies)
+
+
+def render_ip89(proxies):
+    return ''.join(f'{proxy.host}:{proxy.port}<br>' for proxy in proxies)
+
+
+def render_kuaidaili(proxies):
+    rows = ''.join(f'<tr><td data-title="IP">{proxy.host}</td><td data-title="PORT">{proxy.port}</td></tr>'
+                   for proxy in proxies)
+    return f'<table>{rows}</table>'
+
+
+def render_geonode(proxies):
+    return json.dumps({'data': [{'ip': proxy.host, 'port': str(proxy.port)} for proxy in proxies]})
+
+
+RENDERERS = {
+    'Daili66Crawler': render_daili66,
+    'IP3366Crawler': render_ip3366,
+    'Ip89Crawler': render_ip89,
+    'KuaidailiCrawler': render_kuaidaili,
+    'GeonodeCrawler': render_geonode,
+}
+
+
+# canned pages of crawlers by url, only needed by the process fetching them
+CANNED = {}
+
+
+def canned_fetch(self, url, **kwargs):
+    return CANNED[url]
+
+
+# crawler classes fetching canned pages instead of requesting the source, defined on import,
+# so workers of parser pool started by forkserver or spawn can unpickle crawlers
+for crawler_cls in crawlers_cls:
+    if crawler_cls.__name__ in RENDERERS:
+        globals()[f'Canned{crawler_cls.__name__}'] = type(
+            f'Canned{crawler_cls.__name__}', (crawler_cls,),
+            {'urls': [], 'page_urls': [], '__module__': __name__, 'fetch': canned_fetch})
+
+
+def canned_crawlers(pages, per_page):
+    """
+    create crawlers which fetch canned pages instead of requesting the source
+    :param pages: pages of each crawler
+    :param per_page: proxies of each page
+    :return: list of crawler
+    """
+    CANNED.clear()
+    crawlers = []
+    proxies = iter(generate_proxies(len(RENDERERS) * pages * per_page, seed=1))
+    for crawler_cls in crawlers_cls:
+        render = RENDERERS.get(crawler_cls.__name__)
+        if not render:
+            continue
+        crawler = globals()[f'Canned{crawler_cls.__name__}']()
+        crawler.urls = [f'canned://{crawler_cls.__name__}/{page}' for page in range(1, pages + 1)]
+        for url in crawler.urls:
+            CANNED[url] = render([next(proxies) for _ in range(per_page)])
+        crawlers.append(crawler)
+    return crawlers
+
+
+class CannedGetter(Getter):
+    """
+    getter running canned crawlers
+    """
+
+    def __init__(self, redis, crawlers):
+        super().__init__()
+        self.redis = redis
+        self.crawlers = crawlers
+
+    def _load_crawlers(self):
+        return self.crawlers
+
+
+def run(redis_url=None, pages=2, per_page=500, shards=1, storage='redis'):
+    """
+    run benchmark
+    :param redis_url: redis connection string, use fakeredis if not set
+    :param shards: number of fakeredis shards
+    :param storage: redis, or embedded to use embedded storage in memory
+    :param pages: pages of each crawler
+    :param per_page: proxies of each page
+    :return: dict of result
+    """
+    client = create_redis(redis_url, shards, storage)
+    flush(client)
+    crawlers = canned_crawlers(pages, per_page)
+    getter = CannedGetter(client, crawlers)
+    start = time.perf_counter()
+    getter.run()
+    elapsed = time.perf_counter() - start
+    count = client.count()
+    flush(client)
+    return {
+        'crawlers': len(crawlers),
+        'pages': pages,
+        'per_page': per_page,
+        'parser_pool_size': PARSER_POOL_SIZE,
+        'ingested': count,
+        'elapsed_sec': round(elapsed, 3),
+        'proxies_per_sec': round(count / elapsed, 1),
+    }
@@ -0,0 +1,123 @@
+"""
+benchmark of import time and memory of every role, each measured in a fresh interpreter,
+and which heavy dependencies the role pulls in, and memory of children forked by scheduler
+with and without preloading, by their rss, pss and private memory
+
+usage: python -m benchmarks --only imports
+"""
+import json
+import subprocess
+import sys
+
+SCHEDULER = 'from proxypool.scheduler import Scheduler'
+
+# statements importing what the process of every role imports, on top of scheduler it's started by
+ROLES = {
+    'scheduler': SCHEDULER,
+    'server': f'{SCHEDULER}; from proxypool.processors.server import app',
+    'tester': f'{SCHEDULER}; from proxypool.processors.tester import Tester',
+    'getter': f'{SCHEDULER}; from proxypool.processors.getter import Getter; import proxypool.crawlers; '
+              f'proxypool.crawlers.discover()',
+}
+
+# dependencies worth knowing whether a role imports them
+HEAVY = ('flask', 'aiohttp', 'requests', 'pyquery', 'lxml', 'fake_headers')
+
+PROBE = '''
+import json, sys, time
+def rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+before, modules = rss(), len(sys.modules)
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'import_ms': round(elapsed * 1000, 1), 'rss_mb': round(rss(), 1),
+                  'rss_delta_mb': round(rss() - before, 1), 'modules': len(sys.modules) - modules,
+                  'heavy': sorted(name for name in {heavy} if name in sys.modules)}}))
+'''
+
+
+def measure(statement, repeat=3):
+    """
+    measure import in fresh interpreters, best of repeat
+    :return: dict of result
+    """
+    results = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', PROBE.format(statement=statement, heavy=HEAVY)],
+                                         stderr=subprocess.DEVNULL)
+        results.append(json.loads(output.decode().strip().splitlines()[-1]))
+    return min(results, key=lambda result: result['import_ms'])
+
+
+def run(repeat=3):
+    """
+    run benchmark
+    :param repeat: interpreters per role, fastest is reported
+    :return: dict of role to result
+    """
+    result = {role: measure(statement, repeat) for role, statement in ROLES.items()}
+    if sys.platform.startswith('linux'):
+        result['forked'] = {'preload': forked(True), 'no_preload': forked(False)}
+    return result
+
+
+FORKED = '''
+import gc, json, multiprocessing, os
+os.environ['ENABLE_PRELOAD'] = '{preload}'
+from proxypool.scheduler import Scheduler, Child
+ROLES = {roles}
+
+def memory(pid):
+    values = {{}}
+    with open(f'/proc/{{pid}}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                values[name] = int(value.split()[0]) / 1024
+    return {{'rss_mb': round(values['Rss'], 1), 'pss_mb': round(values['Pss'], 1),
+            'private_mb': round(values['Private_Clean'] + values['Private_Dirty'], 1)}}
+
+def child(statement, ready, done):
+    exec(statement)
+    gc.collect()
+    ready.set()
+    done.wait()
+
+context = multiprocessing.get_context('fork')
+children = [Child(role, None) for role in ('tester', 'getter', 'server')]
+Scheduler.preload(children)
+gc.freeze()
+done = context.Event()
+processes = {{}}
+for role in ('tester', 'getter', 'server'):
+    ready = context.Event()
+    process = context.Process(target=child, args=(ROLES[role], ready, done))
+    process.start()
+    processes[role] = (process, ready)
+for process, ready in processes.values():
+    ready.wait()
+result = {{role: memory(process.pid) for role, (process, _) in processes.items()}}
+result['scheduler'] = memory(os.getpid())
+result['total_pss_mb'] = round(sum(item['pss_mb'] for item in result.values()), 1)
+done.set()
+print(json.dumps(result))
+'''
+
+
+def forked(preload):
+    """
+    measure memory of children forked by scheduler once they imported their role
+    :param preload: if scheduler preloads modules before forking
+    :return: dict of role to memory, and total pss
+    """
+    output = subprocess.check_output([sys.executable, '-c', FORKED.format(preload=preload, roles=ROLES)],
+                                     stderr=subprocess.DEVNULL)
+    return json.loads(output.decode().strip().splitlines()[-1])
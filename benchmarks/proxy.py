@@ -0,0 +1,66 @@
+"""
+benchmark of converting redis members to Proxy objects,
+both `/all` and tester pay this cost for every member of the pool
+
+usage: python -m benchmarks.proxy [--size 50000] [--repeat 5]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from proxypool.utils.proxy import convert_proxy_or_proxies
+
+
+def generate_members(size, seed=0):
+    """
+    generate fake redis members, mostly ipv4 with some auth and ipv6 proxies
+    :param size: number of members
+    :param seed: random seed
+    :return: list of str
+    """
+    rand = random.Random(seed)
+    members = []
+    for i in range(size):
+        port = rand.randint(1, 65535)
+        if i % 50 == 0:
+            members.append(f'[2001:db8::{rand.randint(1, 0xffff):x}]:{port}')
+        elif i % 20 == 0:
+            members.append(f'user{i}:pwd@10.{rand.randint(0, 255)}.{rand.randint(0, 255)}.{rand.randint(1, 254)}:{port}')
+        else:
+            members.append(f'{rand.randint(1, 223)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}.{rand.randint(1, 254)}:{port}')
+    return members
+
+
+def run(size=50000, repeat=5):
+    """
+    run benchmark
+    :param size: number of members
+    :param repeat: repeat times, the best one is taken
+    :return: dict of result
+    """
+    members = generate_members(size)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        convert_proxy_or_proxies(members)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    proxies = convert_proxy_or_proxies(members)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(proxies) == size
+    return {
+        'size': size,
+        'total_ms': round(best * 1000, 3),
+        'per_item_us': round(best / size * 1e6, 3),
+        'per_item_bytes': round(memory / size, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Proxy convert benchmark')
+    parser.add_argument('--size', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print(run(args.size, args.repeat))
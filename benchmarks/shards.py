@@ -0,0 +1,145 @@
+"""
+check of ShardedRedisClient against a single redis node holding the same pool, routing of proxies to their shards,
+counts, ranked pages merged from shards, batch cursors across shards, eviction split by shard size,
+random proxies of indexes, proxies added by getters at the same time, and latency of the same operations on both,
+every check reports number of mismatches
+
+shards are fakeredis by default, pass connection strings of several redis-server nodes to check real ones,
+the single node is fakeredis always
+
+usage: python -m benchmarks --only shards --shards 3
+       python -m benchmarks --only shards --redis redis://127.0.0.1:6379/14,redis://127.0.0.1:6380/14
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+from proxypool.setting import REDIS_KEY, PROXY_SCORE_MIN, PROXY_SCORE_MAX, EVICTION_POLICY_LOWEST_SCORE
+from proxypool.storages.base import protocol_key
+from proxypool.storages.sharded import ShardedRedisClient, shard_of
+from benchmarks.utils import create_redis, generate_proxies, measure, flush
+
+# index of every tenth proxy
+INDEX_KEY = protocol_key('https')
+
+
+def seed(client, proxies, rand):
+    """
+    add proxies with random scores, the same ones on every client for the same seed of rand,
+    every tenth proxy is put in INDEX_KEY
+    """
+    client.add_many(proxies)
+    for position, proxy in enumerate(proxies):
+        db = client.shard(proxy).db if isinstance(client, ShardedRedisClient) else client.db
+        db.zadd(REDIS_KEY, {proxy.string(): rand.randint(PROXY_SCORE_MIN + 1, PROXY_SCORE_MAX)})
+        if position % 10 == 0:
+            db.sadd(INDEX_KEY, proxy.string())
+
+
+def sweep(client, count):
+    """
+    scan the whole pool batch by batch like the tester does
+    :return: list of proxy string
+    """
+    cursor, members = 0, []
+    while True:
+        cursor, proxies = client.batch(cursor, count=count)
+        members += [proxy.string() for proxy in proxies or []]
+        if not cursor:
+            return members
+
+
+def check(sharded, single, proxies, rand):
+    """
+    compare sharded client with single node
+    :return: dict of check to number of mismatches
+    """
+    mismatches = {}
+    shards = len(sharded.shards)
+    # every proxy lives on its shard only
+    mismatches['routing'] = sum(
+        [shard.exists(proxy) for shard in sharded.shards] != [index == shard_of(proxy.string(), shards)
+                                                             for index in range(shards)]
+        for proxy in proxies)
+    mismatches['count'] = int(sharded.count() != single.count())
+    mismatches['exists_many'] = sum(a != b for a, b in zip(sharded.exists_many(proxies), single.exists_many(proxies)))
+    # scores are ordered alike, members of equal score may be in another order
+    full = single.ranked(0, -1)
+    mismatches['ranked_all'] = int(sorted(sharded.ranked(0, -1)) != sorted(full))
+    for offset, limit in ((0, 10), (25, 50), (len(full) - 5, 10)):
+        page = sharded.ranked(offset, limit)
+        mismatches['ranked_pages'] = mismatches.get('ranked_pages', 0) + int(
+            [score for _, score in page] != [score for _, score in full[offset:offset + limit]])
+    # batch cursors visit every proxy exactly once across shards
+    members = sweep(sharded, 37)
+    mismatches['batch'] = int(len(members) != len(set(members)) or set(members) != {item for item, _ in full})
+    # random proxies of index come from every shard holding some
+    index = single.db.smembers(INDEX_KEY)
+    picked = {sharded.random_in_index(INDEX_KEY).string() for _ in range(200)}
+    mismatches['random_in_index'] = len(picked - index) + sum(
+        bool(shard.db.scard(INDEX_KEY)) and not any(shard.db.sismember(INDEX_KEY, member) for member in picked)
+        for shard in sharded.shards)
+    # eviction takes count from shards in proportion to their sizes, lowest scores of each shard
+    sizes = [shard.count() for shard in sharded.shards]
+    count = len(proxies) // 10
+    evicted = sharded.evict(count, policy=EVICTION_POLICY_LOWEST_SCORE)
+    expected = [count * size // sum(sizes) for size in sizes]
+    taken = [sum(shard_of(proxy.string(), shards) == index for proxy in evicted) for index in range(shards)]
+    mismatches['evict_count'] = int(len(evicted) != count or sharded.count() != sum(sizes) - count)
+    mismatches['evict_split'] = sum(not 0 <= got - want <= 1 for got, want in zip(taken, expected))
+    mismatches['evict_removed'] = sum(sharded.exists_many(evicted))
+    # max and decrease are applied on the shard of proxy only
+    sample = rand.sample([proxy for proxy in proxies if sharded.exists(proxy)], 20)
+    for proxy in sample:
+        sharded.max(proxy)
+    mismatches['max'] = sum(sharded.shard(proxy).db.zscore(REDIS_KEY, proxy.string()) != PROXY_SCORE_MAX
+                            for proxy in sample)
+    for proxy in sample:
+        sharded.decrease(proxy, proxy_score_min=PROXY_SCORE_MAX)
+    mismatches['decrease'] = sum(sharded.exists_many(sample)) + sum(
+        shard.exists(proxy) for proxy in sample for shard in sharded.shards)
+    # getters adding overlapping proxies at the same time, every new proxy is told added to one of them only
+    fresh = [proxy for proxy in generate_proxies(200, seed=7) if not sharded.exists(proxy)]
+    existing = rand.sample([proxy for proxy in proxies if sharded.exists(proxy)], 200)
+    batches = [rand.sample(fresh + existing, 300) for _ in range(8)]
+    with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+        added = [member for members in executor.map(sharded.add_new, batches) for member in members]
+    mismatches['add_new'] = int(len(added) != len(set(added)) or set(added) != {proxy.string() for proxy in fresh})
+    return mismatches
+
+
+def run(redis_url=None, size=5000, shards=3, ops=500):
+    """
+    run check
+    :param redis_url: comma separated connection strings of shards, fakeredis if not set,
+        the databases will be flushed
+    :param size: number of proxies
+    :param shards: number of fakeredis shards if redis_url is not set, at least 2
+    :param ops: number of operations measured
+    :return: dict of result
+    """
+    sharded = create_redis(redis_url if redis_url and ',' in redis_url else None, max(shards, 2))
+    single = create_redis()
+    flush(sharded)
+    flush(single)
+    proxies = generate_proxies(size)
+    for client in (sharded, single):
+        seed(client, proxies, random.Random(0))
+    rand = random.Random(1)
+    latency = {}
+    for name, client in (('sharded', sharded), ('single', single)):
+        latency[name] = {
+            'random': measure(client.random, [()] * ops),
+            'exists_many': measure(client.exists_many, [(rand.sample(proxies, 100),) for _ in range(ops // 10)]),
+            'ranked': measure(client.ranked, [(0, 100)] * (ops // 10)),
+            'random_in_index': measure(client.random_in_index, [(INDEX_KEY,)] * ops),
+        }
+    mismatches = check(sharded, single, proxies, rand)
+    result = {
+        'shards': len(sharded.shards),
+        'size': size,
+        'sizes': [shard.count() for shard in sharded.shards],
+        'mismatches': mismatches,
+        'latency': latency,
+    }
+    flush(sharded)
+    flush(single)
+    return result
@@ -0,0 +1,56 @@
+"""
+benchmark of RedisClient operations at different pool sizes
+
+usage: python -m benchmarks --only storage
+"""
+import random
+import time
+from proxypool.setting import PROXY_SCORE_MAX, TEST_BATCH
+from benchmarks.utils import create_redis, generate_proxies, measure, summarize, flush
+
+
+def sweep(client, count=TEST_BATCH):
+    """
+    scan the whole pool batch by batch like the tester does
+    :return: number of proxies
+    """
+    cursor, total = 0, 0
+    while True:
+        cursor, proxies = client.batch(cursor, count=count)
+        total += len(proxies or [])
+        if not cursor:
+            return total
+
+
+def run(redis_url=None, sizes=(1000, 10000, 50000), ops=1000, shards=1, storage='redis'):
+    """
+    run benchmark
+    :param redis_url: redis connection string, use fakeredis if not set
+    :param shards: number of fakeredis shards
+    :param storage: redis, or embedded to use embedded storage in memory
+    :param sizes: pool sizes
+    :param ops: number of operations of random and decrease
+    :return: dict of result
+    """
+    client = create_redis(redis_url, shards, storage)
+    rand = random.Random(0)
+    results = {}
+    for size in sizes:
+        flush(client)
+        proxies = generate_proxies(size)
+        result = {'add': measure(client.add, [(proxy,) for proxy in proxies])}
+        # make a part of the pool valid, so random hits both branches
+        for proxy in proxies[::10]:
+            client.max(proxy, proxy_score_max=PROXY_SCORE_MAX)
+        result['random'] = measure(client.random, [()] * ops)
+        result['decrease'] = measure(client.decrease, [(rand.choice(proxies),) for _ in range(ops)])
+        latencies = []
+        for _ in range(3):
+            start = time.perf_counter()
+            sweep(client)
+            latencies.append(time.perf_counter() - start)
+        result['batch_sweep'] = summarize(latencies)
+        result['all'] = measure(client.all, [()] * 5)
+        results[str(size)] = result
+    flush(client)
+    return results
@@ -0,0 +1,112 @@
+"""
+check of ingest stream against a real redis-server, fakeredis has no streams,
+proxies ingested with ENABLE_INGEST_STREAM must be tested at least once by testers of the consumer group:
+a tester process claims entries and is killed before acking them, entries it held are claimed again by XAUTOCLAIM
+once idle for INGEST_CLAIM_IDLE seconds and tested from the simulated fleet by Tester.consume,
+entries deleted from the stream while pending, like trimmed ones, are acked without being delivered,
+replies of XAUTOCLAIM of redis 6.2 and 7 differ in that case
+
+usage: python -m benchmarks --only stream --redis redis://127.0.0.1:6379/15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from proxypool.processors.tester import Tester
+from proxypool.setting import PROXY_SCORE_INIT, INGEST_STREAM_KEY, INGEST_STREAM_GROUP, INGEST_CLAIM_IDLE
+from benchmarks.fleet import ProxySimulator, DEFAULT_MIX
+from benchmarks.utils import create_redis, raise_nofile_limit, flush
+
+
+def version_of(client):
+    """
+    version of redis-server as tuple of int
+    """
+    return tuple(int(part) for part in client.db.info('server')['redis_version'].split('.'))
+
+
+def crash(redis_url, count):
+    """
+    claim entries like a tester and die before acking them, called in the child process,
+    claimed entries are printed as json
+    """
+    client = create_redis(redis_url)
+    entries = client.claim_ingested(f'crashed-{os.getpid()}', count)
+    print(json.dumps(entries), flush=True)
+    os._exit(1)
+
+
+def run(redis_url=None, size=500, mix=DEFAULT_MIX, latency=0.05, origin_port=29999):
+    """
+    run check, TEST_URL and TEST_ANONYMOUS_URL must point at the origin server of the simulator
+    :param redis_url: redis connection string, the database will be flushed, skipped if not set
+    :param size: number of proxies in fleet
+    :param mix: ratios of behaviours
+    :param latency: latency of every proxy in seconds
+    :param origin_port: port of origin server
+    :return: dict of result
+    """
+    if not redis_url:
+        return {'skipped': 'needs --redis, fakeredis has no streams'}
+    client = create_redis(redis_url)
+    version = version_of(client)
+    if version < (6, 2):
+        return {'skipped': f'needs redis 6.2 or later for XAUTOCLAIM, got {".".join(map(str, version))}'}
+    raise_nofile_limit()
+    flush(client)
+    simulator = ProxySimulator.from_mix(size, mix, latency=latency, origin_port=origin_port)
+    with simulator:
+        client.add_many(simulator.proxies, PROXY_SCORE_INIT, enqueue=True)
+        enqueued = client.db.xlen(INGEST_STREAM_KEY)
+        # proxies in pool already are not enqueued again
+        client.add_many(simulator.proxies, PROXY_SCORE_INIT, enqueue=True)
+        enqueued_again = client.db.xlen(INGEST_STREAM_KEY) - enqueued
+        # a tester claims half of the stream and is killed
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.stream', '--redis', redis_url,
+                                 '--count', str(size // 2)], stdout=subprocess.PIPE, check=False).stdout
+        claimed = json.loads(output.decode().strip().splitlines()[-1])
+        # some entries it held are trimmed from stream, their proxies are left to full sweeps
+        deleted = claimed[:len(claimed) // 10]
+        if deleted:
+            client.db.xdel(INGEST_STREAM_KEY, *[entry_id for entry_id, _ in deleted])
+        skip = {member for _, member in deleted}
+        tester = Tester()
+        tester.redis = client
+        tested, start = 0, time.perf_counter()
+        deadline = time.time() + INGEST_CLAIM_IDLE * 2 + 30
+        while time.time() < deadline:
+            tested += tester.consume(1)
+            if not client.db.xpending(INGEST_STREAM_KEY, INGEST_STREAM_GROUP)['pending'] and \
+                    tested >= enqueued - len(deleted):
+                break
+        elapsed = time.perf_counter() - start
+        mismatches = simulator.verify(client, skip=skip)
+        # trimmed entries are never delivered, so their proxies keep init score
+        scores = dict(client.ranked(0, -1))
+        deleted_delivered = sum(scores.get(member) != PROXY_SCORE_INIT for member in skip)
+    pending = client.db.xpending(INGEST_STREAM_KEY, INGEST_STREAM_GROUP)['pending']
+    flush(client)
+    return {
+        'redis_version': '.'.join(map(str, version)),
+        'size': size,
+        'ingest_claim_idle': INGEST_CLAIM_IDLE,
+        'enqueued': enqueued,
+        'enqueued_again': enqueued_again,
+        'claimed_by_killed_tester': len(claimed),
+        'deleted_while_pending': len(deleted),
+        'deleted_delivered': deleted_delivered,
+        'tested': tested,
+        'pending_after': pending,
+        'mismatches': mismatches,
+        'delivered_sec': round(elapsed, 3),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='tester killed before acking ingest stream')
+    parser.add_argument('--redis', type=str, required=True)
+    parser.add_argument('--count', type=int, required=True)
+    args = parser.parse_args()
+    crash(args.redis, args.count)
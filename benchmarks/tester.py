@@ -0,0 +1,63 @@
+"""
+benchmark of Tester.run sweeping a simulated proxy fleet,
+scores after the sweep are checked against the expected transitions of every behaviour,
+then the fleet is swept again reusing cached verdicts, which only hit if the first sweep took less than
+TEST_CACHE_TTL seconds, and must leave every score as it is
+
+usage: python -m benchmarks --only tester --fleet-size 10000 --test-batch 500
+"""
+import time
+from proxypool.processors.tester import Tester
+from proxypool.setting import TEST_BATCH, TEST_TIMEOUT, TEST_ANONYMOUS, TEST_CACHE_TTL
+from benchmarks.fleet import ProxySimulator, DEFAULT_MIX
+from benchmarks.utils import create_redis, raise_nofile_limit, flush
+
+
+def run(redis_url=None, size=1000, mix=DEFAULT_MIX, latency=0.05, origin_port=29999, shards=1, storage='redis'):
+    """
+    run benchmark, TEST_URL and TEST_ANONYMOUS_URL must point at the origin server of the simulator
+    :param redis_url: redis connection string, use fakeredis if not set
+    :param shards: number of fakeredis shards
+    :param storage: redis, or embedded to use embedded storage in memory
+    :param size: number of proxies in fleet
+    :param mix: ratios of behaviours
+    :param latency: latency of every proxy in seconds
+    :param origin_port: port of origin server
+    :return: dict of result
+    """
+    raise_nofile_limit()
+    client = create_redis(redis_url, shards, storage)
+    flush(client)
+    simulator = ProxySimulator.from_mix(size, mix, latency=latency, origin_port=origin_port)
+    with simulator:
+        simulator.seed(client)
+        tester = Tester()
+        tester.redis = client
+        start = time.perf_counter()
+        tester.run()
+        elapsed = time.perf_counter() - start
+        mismatches = simulator.verify(client)
+        scores = dict(client.ranked(0, -1))
+        start = time.perf_counter()
+        tester.run()
+        cached_elapsed = time.perf_counter() - start
+        # a reused verdict never costs another point
+        rescored = sum(score != scores.get(member) for member, score in client.ranked(0, -1)) + \
+            len(set(scores) - {member for member, _ in client.ranked(0, -1)})
+    flush(client)
+    return {
+        'size': size,
+        'behaviours': simulator.count(),
+        'latency': latency,
+        'test_batch': TEST_BATCH,
+        'test_timeout': TEST_TIMEOUT,
+        'test_anonymous': TEST_ANONYMOUS,
+        'sweep_sec': round(elapsed, 3),
+        'checks_per_sec': round(size / elapsed, 1),
+        'mismatches': mismatches,
+        'test_cache_ttl': TEST_CACHE_TTL,
+        'cached_sweep_sec': round(cached_elapsed, 3),
+        'cache_hit_rate': round(tester.hit_rate(), 3),
+        'cached_sweep_rescored': rescored,
+        'sweep_within_cache_ttl': elapsed < TEST_CACHE_TTL,
+    }
@@ -0,0 +1,114 @@
+"""
+shared helpers of benchmarks
+"""
+import random
+import statistics
+import time
+import redis
+from proxypool.schemas.proxy import Proxy
+from proxypool.storages.redis import RedisClient
+from proxypool.storages.sharded import ShardedRedisClient
+from proxypool.storages.embedded import EmbeddedClient
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+
+def create_redis(url=None, shards=1, storage='redis'):
+    """
+    create storage client for benchmark
+    :param url: redis connection string, use fakeredis if not set,
+                the database will be flushed, so never point it at a production one,
+                comma separated connection strings are shards
+    :param shards: number of fakeredis shards if url is not set
+    :param storage: redis, or embedded to use embedded storage in memory
+    :return: storage implementing BaseStorage, IngestStream, VerdictCache, ProcessStatus and MetricsStore
+    """
+    if storage == 'embedded':
+        return EmbeddedClient(path=None)
+    if url and ',' in url:
+        return ShardedRedisClient(url.split(','))
+    if not url and shards > 1:
+        return ShardedRedisClient(shards=[create_redis() for _ in range(shards)])
+    if url:
+        return RedisClient(connection_string=url)
+    import fakeredis
+    pool = redis.ConnectionPool(connection_class=fakeredis.FakeConnection, server=fakeredis.FakeServer(),
+                                decode_responses=True)
+    return RedisClient(connection_pool=pool)
+
+
+def flush(client):
+    """
+    flush databases of client and of all its shards
+    """
+    if isinstance(client, EmbeddedClient):
+        client.clear()
+        return
+    for shard in getattr(client, 'shards', [client]):
+        shard.db.flushdb()
+
+
+def generate_proxies(size, seed=0):
+    """
+    generate unique fake proxies
+    :param size: number of proxies
+    :param seed: random seed
+    :return: list of Proxy
+    """
+    rand = random.Random(seed)
+    proxies = set()
+    while len(proxies) < size:
+        proxies.add((f'{rand.randint(1, 223)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}.{rand.randint(1, 254)}',
+                     rand.randint(1, 65535)))
+    return [Proxy(host=host, port=port) for host, port in sorted(proxies)]
+
+
+def summarize(latencies, elapsed=None):
+    """
+    summarize latencies of operations
+    :param latencies: list of seconds
+    :param elapsed: wall time in seconds, sum of latencies if not set
+    :return: dict of result
+    """
+    if not latencies:
+        return {'ops': 0}
+    elapsed = sum(latencies) if elapsed is None else elapsed
+    latencies = sorted(latencies)
+    return {
+        'ops': len(latencies),
+        'ops_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_us': round(statistics.mean(latencies) * 1e6, 1),
+        'p50_us': round(latencies[len(latencies) // 2] * 1e6, 1),
+        'p99_us': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6, 1),
+    }
+
+
+def measure(func, args_list):
+    """
+    call func once per args and measure latency of each call
+    :param func: function to call
+    :param args_list: list of tuple of arguments
+    :return: dict of result
+    """
+    latencies = []
+    start = time.perf_counter()
+    for args in args_list:
+        begin = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def raise_nofile_limit():
+    """
+    raise soft limit of open files to the hard limit, fleets and load generators need lots of sockets
+    """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
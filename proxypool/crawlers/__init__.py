@@ -1,16 +1,63 @@
-import pkgutil
-from .base import BaseCrawler
+import importlib
 import inspect
+import os
+import pkgutil
+from loguru import logger
+
+
+# classes subclass of BaseCrawler, discovered on first access of __all__,
+# so processes which don't crawl never import crawler modules and their dependencies
+_classes = None
+# modification time of source of crawler modules when they were imported, name: mtime
+_mtimes = {}
+
+
+def _mtime(module):
+    try:
+        return os.path.getmtime(module.__file__)
+    except (OSError, TypeError):
+        return None
+
 
+def discover(reload=False):
+    """
+    import crawler modules of public and private packages and find their crawler classes
+    :param reload: reload imported modules to pick up changed crawlers, like getter does every cycle,
+        only modules whose source changed since they were imported are reloaded, so modules preloaded by
+        scheduler and shared with forked getter are not executed again and their pages stay shared
+    :return: list of crawler classes
+    """
+    global _classes
+    from .base import BaseCrawler
+    classes = []
+    for _, name, is_pkg in pkgutil.walk_packages(__path__, prefix=f'{__name__}.'):
+        if is_pkg or name == BaseCrawler.__module__:
+            continue
+        try:
+            module = importlib.import_module(name)
+            mtime = _mtime(module)
+            if reload and name in _mtimes and mtime != _mtimes[name]:
+                module = importlib.reload(module)
+            _mtimes[name] = mtime
+        except Exception as e:
+            logger.error(f'加载爬虫模块 {name} 失败: {e}')
+            continue
+        for _, value in inspect.getmembers(module, inspect.isclass):
+            if issubclass(value, BaseCrawler) and value is not BaseCrawler and value.__module__ == name \
+                    and not getattr(value, 'ignore', False):
+                classes.append(value)
+    _classes = classes
+    return classes
 
-# load classes subclass of BaseCrawler
-classes = []
-for loader, name, is_pkg in pkgutil.walk_packages(__path__):
-    module = loader.find_module(name).load_module(name)
-    for name, value in inspect.getmembers(module):
-        globals()[name] = value
-        if inspect.isclass(value) and issubclass(value, BaseCrawler) and value is not BaseCrawler \
-                and not getattr(value, 'ignore', False):
-            classes.append(value)
-__all__ = __ALL__ = classes
 
+def __getattr__(name):
+    """
+    discover crawlers lazily, `from proxypool.crawlers import __all__` and crawler classes by name still work
+    """
+    if name in ('__all__', '__ALL__'):
+        return _classes if _classes is not None else discover()
+    if not name.startswith('__'):
+        for cls in __getattr__('__all__'):
+            if cls.__name__ == name:
+                return cls
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,49 +1,415 @@
-from retrying import RetryError, retry
 import requests
+import hashlib
+import itertools
+import pickle
+import random
+import threading
+from concurrent.futures import Future
 from loguru import logger
-from proxypool.setting import GET_TIMEOUT
+from proxypool.setting import GET_TIMEOUT, LOG_PER_PROXY, ENABLE_FETCH_CACHE, FETCH_CACHE_MAX_AGE, \
+    ENABLE_INCREMENTAL_CRAWL, HEADER_POOL_SIZE, FETCH_RETRIES, FETCH_BACKOFF_BASE, FETCH_BACKOFF_MAX, \
+    FETCH_BREAKER_THRESHOLD, CRAWL_DELAY
+from proxypool.utils.metrics import metrics
 from fake_headers import Headers
 import time
+from urllib.parse import urlsplit
+
+
+class FetchCache(object):
+    """
+    etag, last-modified and body hash of fetched urls, crawler modules are reloaded every cycle
+    but this module is not, so the cache lives as long as the getter process,
+    entries of pages fetched in a cycle are pending until getter commits them once their proxies are written,
+    so pages whose proxies were dropped, like when pool got full, are not skipped as not modified next cycle
+    """
+
+    def __init__(self, max_age=FETCH_CACHE_MAX_AGE):
+        """
+        init cache
+        :param max_age: seconds after which a url is fetched and ingested unconditionally again
+        """
+        self.max_age = max_age
+        # url: (etag, last_modified, digest, cached_at)
+        self.entries = {}
+        # entries of current cycle, url: entry
+        self.pending = {}
+
+    def get(self, url):
+        entry = self.entries.get(url)
+        if entry and time.time() - entry[3] < self.max_age:
+            return entry
+
+    def conditions(self, url):
+        """
+        conditional request headers of url
+        :return: dict
+        """
+        entry = self.get(url)
+        if not entry:
+            return {}
+        etag, last_modified = entry[:2]
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def is_modified(self, url, response):
+        """
+        check response against the cache, keep it as pending entry if modified
+        :param url: url
+        :param response: response of conditional request
+        :return: False if not modified since last fetch
+        """
+        entry = self.get(url)
+        if response.status_code == 304:
+            return not entry
+        if response.status_code != 200:
+            return True
+        digest = hashlib.sha1(response.content).hexdigest()
+        if entry and entry[2] == digest:
+            return False
+        self.pending[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'), digest,
+                             time.time())
+        return True
+
+    def commit(self):
+        """
+        keep entries of current cycle
+        """
+        self.entries.update(self.pending)
+        self.pending = {}
+
+    def rollback(self):
+        """
+        drop entries of current cycle, their pages are fetched and ingested in full next cycle
+        """
+        self.pending = {}
+
+
+# fetch cache of current process
+fetch_cache = FetchCache()
+
+
+class HeaderPool(object):
+    """
+    header sets generated by fake_headers, built on first use and rotated round-robin,
+    instead of generating a set for every request
+    """
+
+    def __init__(self, size=HEADER_POOL_SIZE):
+        self.size = size
+        self.cycle = None
+        self.lock = threading.Lock()
+
+    def next(self):
+        """
+        next header set, shared by requests, copy it before changing it
+        :return: dict
+        """
+        if self.cycle is None:
+            with self.lock:
+                if self.cycle is None:
+                    headers = [Headers(headers=True).generate() for _ in range(max(self.size, 1))]
+                    # processes start at different positions
+                    offset = random.randrange(len(headers))
+                    self.cycle = itertools.cycle(headers[offset:] + headers[:offset])
+        return next(self.cycle)
+
+
+class SessionPool(object):
+    """
+    persistent sessions by host, so cookies and keep-alive connections survive across pages of a source
+    and across cycles, every session keeps one header set like a browser does
+    """
+
+    def __init__(self):
+        # host: session
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        """
+        session of host of url, crawlers run in threads, sources of the same host share it
+        :return: requests.Session
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = self.sessions[host] = requests.Session()
+                session.headers.update(header_pool.next())
+        return session
+
+
+class CircuitBreaker(object):
+    """
+    circuit breaker by host, host failing threshold fetches in a row is open, and skipped until reset,
+    getter resets it every cycle
+    """
+
+    def __init__(self, threshold=FETCH_BREAKER_THRESHOLD):
+        self.threshold = threshold
+        # host: consecutive failures
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def is_open(self, host):
+        return self.failures.get(host, 0) >= self.threshold
+
+    def succeed(self, host):
+        self.failures.pop(host, None)
+
+    def fail(self, host):
+        """
+        count failure of host
+        :return: True if breaker of host opened by this failure
+        """
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            return self.failures[host] == self.threshold
+
+    def reset(self):
+        with self.lock:
+            opened = [host for host, failures in self.failures.items() if failures >= self.threshold]
+            self.failures = {}
+        return opened
+
+
+class Throttle(object):
+    """
+    space requests to the same host by delay, a request waits only for what is left of it since the last one
+    """
+
+    def __init__(self, delay=CRAWL_DELAY):
+        self.delay = delay
+        # host: time of next allowed request
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        with self.lock:
+            now = time.time()
+            slot = max(self.slots.get(host, 0), now)
+            self.slots[host] = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def backoff(attempt, base=FETCH_BACKOFF_BASE, cap=FETCH_BACKOFF_MAX):
+    """
+    seconds to wait before retry, exponential backoff with full jitter, so retries of sources don't align
+    :param attempt: number of failed attempts before, from 0
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# header sets, sessions, circuit breaker and throttle of current process
+header_pool = HeaderPool()
+sessions = SessionPool()
+breaker = CircuitBreaker()
+throttle = Throttle()
+
+
+def parse_page(crawler, html):
+    """
+    parse page, called in a process of parser pool
+    :param crawler: crawler
+    :param html: html of page
+    :return: list of proxy, seconds parsing took
+    """
+    start = time.perf_counter()
+    proxies = list(crawler.parse(html))
+    return proxies, time.perf_counter() - start
 
 
 class BaseCrawler(object):
     urls = []
+    # url templates with {page} of paginated sources, crawled from page 1 following next_page,
+    # crawled instead of urls if set
+    page_urls = []
+    # max page to crawl of every page url
+    max_page = 1
+    # callable to check which proxies exist in pool, returns list of bool, set by getter
+    exists = None
+    # process pool executor to parse pages in, set by getter, parse in current process if None
+    pool = None
+    # fetch with a persistent session of the host, keeping its cookies, connections and headers
+    persistent_session = False
+
+    def __getstate__(self):
+        """
+        crawler is pickled to be parsed in parser pool, without redis and the pool itself
+        """
+        state = self.__dict__.copy()
+        state.pop('exists', None)
+        state.pop('pool', None)
+        return state
+
+    def is_picklable(self):
+        """
+        if crawler can be sent to parser pool, checked once per crawler class
+        """
+        cls = self.__class__
+        if '_picklable' not in cls.__dict__:
+            try:
+                pickle.dumps(self)
+                cls._picklable = True
+            except (pickle.PicklingError, AttributeError, TypeError) as e:
+                logger.warning('crawler {} can not be pickled, parse it in getter process: {}', cls.__name__, e)
+                cls._picklable = False
+        return cls._picklable
 
-    @retry(stop_max_attempt_number=3, retry_on_result=lambda x: x is None, wait_fixed=2000)
-    def fetch(self, url, **kwargs):
+    def fetch(self, url, conditional=False, **kwargs):
+        """
+        fetch url, retried FETCH_RETRIES times after backoff, hosts whose circuit breaker is open are skipped
+        :param url: url
+        :param conditional: send conditional request, return empty string if page is not modified since last fetch
+        :return: text of page, None if failed
+        """
+        host = urlsplit(url).netloc
+        name = self.__class__.__name__
+        for attempt in range(FETCH_RETRIES + 1):
+            if breaker.is_open(host):
+                logger.debug('circuit breaker of {} is open, skip {}', host, url)
+                metrics.inc('proxypool_getter_fetch_failures_total', crawler=name, result='skipped')
+                return
+            # retries are spaced by backoff instead of throttle
+            if attempt:
+                time.sleep(backoff(attempt - 1))
+            else:
+                throttle.wait(host)
+            html = self.request(url, conditional, **kwargs)
+            if html is not None:
+                breaker.succeed(host)
+                return html
+            metrics.inc('proxypool_getter_fetch_failures_total', crawler=name, result='failed')
+            if breaker.fail(host):
+                logger.warning('{} failed {} times in a row, skip it for the rest of the cycle',
+                               host, breaker.threshold)
+        logger.error('failed to fetch {} after {} attempts', url, FETCH_RETRIES + 1)
+
+    def request(self, url, conditional=False, **kwargs):
+        """
+        request url once
+        :param url: url
+        :param conditional: send conditional request, return empty string if page is not modified since last fetch
+        :return: text of page, None if failed
+        """
         try:
-            headers = Headers(headers=True).generate()
             kwargs.setdefault('timeout', GET_TIMEOUT)
             kwargs.setdefault('verify', False)
-            kwargs.setdefault('headers', headers)
-            response = requests.get(url, **kwargs)
+            if self.persistent_session:
+                # headers of session are merged into those of request
+                get = sessions.get(url).get
+            else:
+                get = requests.get
+                kwargs.setdefault('headers', header_pool.next())
+            conditional = conditional and ENABLE_FETCH_CACHE
+            if conditional:
+                kwargs['headers'] = dict(kwargs.get('headers') or {})
+                kwargs['headers'].update(fetch_cache.conditions(url))
+            with metrics.timer('proxypool_getter_fetch_seconds', crawler=self.__class__.__name__):
+                response = get(url, **kwargs)
+                if conditional and response.status_code == 304 and not fetch_cache.get(url):
+                    # entry expired since the request was sent, so the page is fetched in full
+                    kwargs['headers'] = {key: value for key, value in kwargs['headers'].items()
+                                         if key not in ('If-None-Match', 'If-Modified-Since')}
+                    response = get(url, **kwargs)
+            if conditional and not fetch_cache.is_modified(url, response):
+                logger.debug('{} not modified since last fetch, skip it', url)
+                metrics.inc('proxypool_getter_unmodified_total', crawler=self.__class__.__name__)
+                return ''
             if response.status_code == 200:
                 response.encoding = 'utf-8'
                 return response.text
-        except (requests.ConnectionError, requests.ReadTimeout):
+        except requests.RequestException as e:
+            logger.debug('failed to fetch {}: {}', url, e)
             return
 
-    def process(self, html, url):
+    def submit(self, html):
+        """
+        parse html in parser pool, so parsing doesn't hold the gil of fetching
+        :param html: html of page
+        :return: future of proxies and parse seconds
+        """
+        if self.pool is not None and self.is_picklable():
+            return self.pool.submit(parse_page, self, html)
+        future = Future()
+        future.set_result(parse_page(self, html))
+        return future
+
+    def process(self, future, url):
         """
         used for parse html
+        :param future: future returned by submit
+        :param url: url of page
         """
-        for proxy in self.parse(html):
-            logger.info(f'fetched proxy {proxy.string()} from {url}')
+        proxies, elapsed = future.result()
+        metrics.observe('proxypool_getter_parse_seconds', elapsed, crawler=self.__class__.__name__)
+        for proxy in proxies:
+            if LOG_PER_PROXY:
+                logger.debug('fetched proxy {} from {}', proxy, url)
             yield proxy
+        logger.info('fetched {} proxies from {} in {:.3f}s', len(proxies), url, elapsed)
+
+    def next_page(self, html, page):
+        """
+        number of the page after page, override to follow page count or next link of the source
+        :param html: html of page
+        :param page: current page
+        :return: next page, None if page is the last one
+        """
+        return page + 1 if page < self.max_page else None
+
+    def count_new(self, proxies):
+        """
+        count proxies not in pool yet
+        """
+        if self.exists is None:
+            return len(proxies)
+        return self.exists(proxies).count(False)
+
+    def crawl_pages(self, page_url):
+        """
+        crawl pages of page url one by one, sources sort their lists by last checked time,
+        so crawling stops once a page contributes no proxy new to pool or is not modified since last fetch
+        :param page_url: url template with {page}
+        """
+        page = 1
+        while page:
+            url = page_url.format(page=page)
+            logger.debug('fetching {}', url)
+            html = self.fetch(url, conditional=True)
+            if not html:
+                return
+            proxies = list(self.process(self.submit(html), url))
+            if not proxies:
+                return
+            new = self.count_new(proxies)
+            yield from proxies
+            if ENABLE_INCREMENTAL_CRAWL and not new:
+                logger.info('no new proxies in {}, stop crawling', url)
+                return
+            page = self.next_page(html, page)
 
     def crawl(self):
         """
-        crawl main method
+        crawl main method, requests to the same host are spaced by CRAWL_DELAY
         """
-        try:
-            for url in self.urls:
-                logger.info(f'fetching {url}')
-                html = self.fetch(url)
-                if not html:
-                    continue
-                time.sleep(.5)
-                yield from self.process(html, url)
-        except RetryError:
-            logger.error(
-                f'crawler {self} crawled proxy unsuccessfully, '
-                'please check if target url is valid or network issue')
+        for page_url in self.page_urls:
+            yield from self.crawl_pages(page_url)
+        # page is parsed in parser pool while the next one is fetched
+        pending = None
+        for url in self.urls:
+            logger.debug('fetching {}', url)
+            html = self.fetch(url, conditional=True)
+            if not html:
+                continue
+            future = self.submit(html)
+            if pending:
+                yield from self.process(*pending)
+            pending = future, url
+        if pending:
+            yield from self.process(*pending)
@@ -11,7 +11,9 @@ class Daili66Crawler(BaseCrawler):
     """
     daili66 crawler, http://www.66ip.cn/1.html
     """
-    urls = [BASE_URL.format(page=page) for page in range(1, MAX_PAGE + 1)]
+    page_urls = [BASE_URL]
+    max_page = MAX_PAGE
+    persistent_session = True
     
     def parse(self, html):
         """
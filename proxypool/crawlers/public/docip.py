@@ -1,5 +1,4 @@
 import time
-from retrying import RetryError
 from loguru import logger
 from proxypool.schemas.proxy import Proxy
 from proxypool.crawlers.base import BaseCrawler
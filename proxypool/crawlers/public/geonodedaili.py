@@ -1,19 +1,41 @@
-import time
-from retrying import RetryError
-from loguru import logger
+import math
 from proxypool.schemas.proxy import Proxy
 from proxypool.crawlers.base import BaseCrawler
 import json
 
 BASE_URL = 'https://proxylist.geonode.com/api/proxy-list?limit=500&page={page}&sort_by=lastChecked&sort_type=desc'
 MAX_PAGE = 18
+HEADERS = {
+    'authority': 'proxylist.geonode.com',
+    'sec-ch-ua': '" Not A;Brand";v="99", "Chromium";v="99", "Google Chrome";v="99"',
+    'accept': 'application/json, text/plain, */*',
+    'sec-ch-ua-mobile': '?0',
+    'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.4844.83 Safari/537.36',
+    'sec-ch-ua-platform': '"macOS"',
+    'origin': 'https://geonode.com',
+    'sec-fetch-site': 'same-site',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-dest': 'empty',
+    'referer': 'https://geonode.com/',
+    'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8,ja;q=0.7',
+}
 
 
 class GeonodeCrawler(BaseCrawler):
     """
     Geonode crawler, https://proxylist.geonode.com/
     """
-    urls = [BASE_URL.format(page=page) for page in range(1, MAX_PAGE + 1)]
+    page_urls = [BASE_URL]
+    max_page = MAX_PAGE
+    persistent_session = True
+
+    def fetch(self, url, **kwargs):
+        """
+        override fetch method
+        add headers
+        """
+        kwargs.setdefault('headers', HEADERS)
+        return super().fetch(url, **kwargs)
 
     def parse(self, html):
         """
@@ -31,38 +53,16 @@ class GeonodeCrawler(BaseCrawler):
             print("json.JSONDecodeError")
             return
 
-    def crawl(self):
+    def next_page(self, html, page):
         """
-        override crawl main method
-        add headers
+        follow total and limit of the api
         """
-        headers = {
-            'authority': 'proxylist.geonode.com',
-            'sec-ch-ua': '" Not A;Brand";v="99", "Chromium";v="99", "Google Chrome";v="99"',
-            'accept': 'application/json, text/plain, */*',
-            'sec-ch-ua-mobile': '?0',
-            'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.4844.83 Safari/537.36',
-            'sec-ch-ua-platform': '"macOS"',
-            'origin': 'https://geonode.com',
-            'sec-fetch-site': 'same-site',
-            'sec-fetch-mode': 'cors',
-            'sec-fetch-dest': 'empty',
-            'referer': 'https://geonode.com/',
-            'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8,ja;q=0.7',
-            'if-none-match': 'W/"c25d-BXjLTmP+/yYXtIz4OEcmdOWSv88"',
-        }
         try:
-            for url in self.urls:
-                logger.info(f'fetching {url}')
-                html = self.fetch(url, headers=headers)
-                if not html:
-                    continue
-                time.sleep(.5)
-                yield from self.process(html, url)
-        except RetryError:
-            logger.error(
-                f'crawler {self} crawled proxy unsuccessfully, '
-                'please check if target url is valid or network issue')
+            result = json.loads(html)
+            pages = math.ceil(int(result['total']) / int(result['limit']))
+        except (ValueError, KeyError, TypeError, ZeroDivisionError):
+            return super().next_page(html, page)
+        return page + 1 if page < min(pages, self.max_page) else None
 
 
 if __name__ == '__main__':
@@ -5,7 +5,7 @@ import json
 
 BASE_URL = 'https://ip.jiangxianli.com/api/proxy_ips?page={page}'
 
-MAX_PAGE = 3
+MAX_PAGE = 10
 
 
 class JiangxianliCrawler(BaseCrawler):
@@ -13,7 +13,9 @@ class JiangxianliCrawler(BaseCrawler):
     jiangxianli crawler,https://ip.jiangxianli.com/
     """
 
-    urls = [BASE_URL.format(page=page) for page in range(1, MAX_PAGE + 1)]
+    page_urls = [BASE_URL]
+    max_page = MAX_PAGE
+    persistent_session = True
 
     def parse(self, html):
         """
@@ -24,7 +26,6 @@ class JiangxianliCrawler(BaseCrawler):
         result = json.loads(html)
         if result['code'] != 0:
             return
-        MAX_PAGE = int(result['data']['last_page'])
         hosts_ports = result['data']['data']
         for ip_address in hosts_ports:
             if(ip_address):
@@ -32,6 +33,16 @@ class JiangxianliCrawler(BaseCrawler):
                 port = ip_address['port']
                 yield Proxy(host=host, port=port)
 
+    def next_page(self, html, page):
+        """
+        follow last_page of the api
+        """
+        try:
+            last_page = int(json.loads(html)['data']['last_page'])
+        except (ValueError, KeyError, TypeError):
+            return super().next_page(html, page)
+        return page + 1 if page < min(last_page, self.max_page) else None
+
 
 if __name__ == '__main__':
     crawler = JiangxianliCrawler()
@@ -12,7 +12,9 @@ class KuaidailiCrawler(BaseCrawler):
     """
     kuaidaili crawler, https://www.kuaidaili.com/
     """
-    urls = [BASE_URL.format(type=type,page=page)  for type in ('intr','inha') for page in range(1, MAX_PAGE + 1)]
+    page_urls = [BASE_URL.format(type=type, page='{page}') for type in ('intr', 'inha')]
+    max_page = MAX_PAGE
+    persistent_session = True
     
     def parse(self, html):
         """
@@ -1,14 +1,34 @@
 from loguru import logger
-from proxypool.storages.redis import RedisClient
-from proxypool.setting import PROXY_NUMBER_MAX
+from proxypool.storages import create_client
+from proxypool.setting import PROXY_NUMBER_MAX, PARSER_POOL_SIZE, GETTER_WORKERS, INGEST_QUEUE_SIZE, \
+    INGEST_BATCH_SIZE, INGEST_SLOW_SECONDS, EVICTION_POLICY, EVICTION_POLICY_NONE, CYCLE_GETTER, CYCLE_GETTER_MIN, \
+    ENABLE_INGEST_STREAM
 from proxypool.testers import __all__ as testers_cls
 # new imports for hot reload
-import importlib
-import pkgutil
-import inspect
 import json
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from queue import Queue, Empty, Full
 import proxypool.crawlers
-from proxypool.crawlers.base import BaseCrawler
+from proxypool.crawlers.base import breaker, fetch_cache
+from proxypool.utils.metrics import metrics
+from proxypool.utils.shutdown import busy, stopping
+
+
+def parser_context():
+    """
+    context of parser pool, workers are forked from a single-threaded forkserver instead of getter,
+    whose crawler, writer and heartbeat threads may hold locks a forked child would inherit held,
+    spawned where there is no forkserver
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    # imported once by forkserver, crawlers themselves are imported by workers, so they get reloaded ones
+    context.set_forkserver_preload(['proxypool.crawlers.base'])
+    return context
 
 
 class Getter(object):
@@ -20,9 +40,11 @@ class Getter(object):
         """
         init db and crawlers
         """
-        self.redis = RedisClient()
+        self.redis = create_client()
         self.testers_cls = testers_cls
         self.testers = [tester_cls() for tester_cls in self.testers_cls]
+        # called as crawled proxies are written, set to Heartbeat.progress by scheduler, so a hung loop is told
+        self.progress = lambda: None
 
     def _load_crawlers(self):
         """
@@ -31,55 +53,162 @@ class Getter(object):
         crawlers = []
         crawler_names = []
 
-        for loader, name, is_pkg in pkgutil.walk_packages(proxypool.crawlers.__path__):
-            # 构造完整的模块名称，例如 proxypool.crawlers.public.daili66
-            module_name = f'proxypool.crawlers.{name}'
+        # 重新加载模块，发现 BaseCrawler 的子类
+        for crawler_cls in proxypool.crawlers.discover(reload=True):
+            # 判断爬虫类型
+            crawler_type = '公共' if '.public.' in crawler_cls.__module__ else '私有'
+            logger.debug(f"发现爬虫: {crawler_cls.__name__}")
             try:
-                # 导入或重新加载模块
-                module = importlib.import_module(module_name)
-                importlib.reload(module)
-
-                # 判断爬虫类型
-                crawler_type = '公共' if 'public' in module_name else '私有'
-
-                # 在重新加载的模块中查找 BaseCrawler 的子类
-                for member_name, member_obj in inspect.getmembers(module):
-                    if (inspect.isclass(member_obj) and
-                            issubclass(member_obj, BaseCrawler) and
-                            member_obj is not BaseCrawler and
-                            not getattr(member_obj, 'ignore', False)):
-                        logger.debug(f"发现爬虫: {member_obj.__name__}")
-                        try:
-                            crawlers.append(member_obj())
-                            # 存储为 JSON 字符串
-                            crawler_info = {
-                                'name': member_obj.__name__,
-                                'type': crawler_type
-                            }
-                            crawler_names.append(json.dumps(crawler_info, ensure_ascii=False))
-                        except Exception as init_error:
-                            logger.error(f"爬虫 {member_obj.__name__} 初始化失败，跳过该爬虫: {init_error}")
-                            continue
-            except Exception as e:
-                logger.error(f"加载或重新加载爬虫 '{name}' 失败: {e}")
+                crawlers.append(crawler_cls())
+                # 存储为 JSON 字符串
+                crawler_info = {
+                    'name': crawler_cls.__name__,
+                    'type': crawler_type
+                }
+                crawler_names.append(json.dumps(crawler_info, ensure_ascii=False))
+            except Exception as init_error:
+                logger.error(f"爬虫 {crawler_cls.__name__} 初始化失败，跳过该爬虫: {init_error}")
+                continue
 
         logger.info(f"成功加载 {len(crawlers)} 个爬虫。")
-        
-        # 使用 Redis 事务来更新爬虫列表
-        pipe = self.redis.db.pipeline()
-        pipe.delete('crawlers')
-        if crawler_names:
-            pipe.sadd('crawlers', *crawler_names)
-        pipe.execute()
-        
+
+        # 在存储中更新爬虫列表
+        self.redis.set_crawlers(crawler_names)
+
         return crawlers
 
     def is_full(self):
         """
-        if proxypool if full
+        if proxypool if full, never full if proxies can be evicted
         return: bool
         """
-        return self.redis.count() >= PROXY_NUMBER_MAX
+        return EVICTION_POLICY == EVICTION_POLICY_NONE and self.redis.count() >= PROXY_NUMBER_MAX
+
+    def wait(self, cycle_min=CYCLE_GETTER_MIN, cycle_max=CYCLE_GETTER):
+        """
+        wait before next run, from cycle_min seconds if pool is empty up to cycle_max seconds once it's full
+        :return: seconds waited
+        """
+        cycle_min = min(cycle_min, cycle_max)
+        fill = min(self.redis.count() / PROXY_NUMBER_MAX, 1) if PROXY_NUMBER_MAX > 0 else 1
+        interval = cycle_min + (cycle_max - cycle_min) * fill
+        logger.debug('pool is {:.0%} full, get proxies in {:.0f}s', fill, interval)
+        time.sleep(interval)
+        return interval
+
+    def evict(self, count):
+        """
+        evict proxies from pool and sub-pools of testers
+        :param count: number of proxies to evict
+        :return: number of evicted proxies
+        """
+        evicted = self.redis.evict(count)
+        if evicted:
+            [self.redis.remove(evicted, tester.key) for tester in self.testers]
+            metrics.inc('proxypool_pool_evicted_total', len(evicted), policy=EVICTION_POLICY)
+        return len(evicted)
+
+    def produce(self, crawler, queue, stop, resume):
+        """
+        run crawler and push proxies into ingest queue,
+        blocks while queue is full or crawlers are paused by writer
+        :param crawler: crawler
+        :param queue: ingest queue
+        :param stop: event set when crawling should stop
+        :param resume: event cleared while crawlers are paused
+        :return: number of proxies crawled
+        """
+        name = crawler.__class__.__name__
+        logger.info('crawler {} to get proxy', crawler)
+        count = 0
+        try:
+            for proxy in crawler.crawl():
+                while not stop.is_set():
+                    if not resume.wait(.1):
+                        continue
+                    try:
+                        queue.put((name, proxy), timeout=.1)
+                        break
+                    except Full:
+                        continue
+                if stop.is_set():
+                    logger.info('ingest stopped, stop crawler {}', name)
+                    break
+                count += 1
+            logger.info('crawler {} got {} proxies', name, count)
+        except Exception as e:
+            logger.error(f'爬虫 {name} 运行失败，跳过该爬虫: {e}')
+        finally:
+            metrics.inc('proxypool_getter_proxies_total', count, crawler=name)
+        return count
+
+    @staticmethod
+    def drain(queue, timeout=.1):
+        """
+        get a batch of proxies from ingest queue
+        :return: list of crawler name and proxy, empty if nothing arrived within timeout
+        """
+        batch = []
+        try:
+            batch.append(queue.get(timeout=timeout))
+            while len(batch) < INGEST_BATCH_SIZE:
+                batch.append(queue.get_nowait())
+        except Empty:
+            pass
+        return batch
+
+    def write(self, queue, producers, stop, resume):
+        """
+        drain ingest queue into redis in batched pipelines until every crawler is done,
+        capacity of pool is rechecked as it runs out, proxies are evicted by EVICTION_POLICY to make room,
+        or crawlers are stopped once pool is full if there is no eviction policy, crawlers are paused while redis is slow
+        :return: number of added proxies
+        """
+        room = PROXY_NUMBER_MAX - self.redis.count()
+        added = 0
+        while True:
+            self.progress()
+            batch = self.drain(queue)
+            if not batch:
+                # producers may put their last proxies between drain and this check, so queue is checked after them
+                if all(producer.done() for producer in producers) and queue.empty():
+                    return added
+                continue
+            if stopping.is_set() and not stop.is_set():
+                logger.info('shutting down, stop crawlers and write {} proxies left', queue.qsize() + len(batch))
+                stop.set()
+            elif stop.is_set() and not stopping.is_set():
+                # discard what crawlers pushed before they noticed
+                continue
+            if EVICTION_POLICY == EVICTION_POLICY_NONE:
+                # room is negative if pool was overfilled meanwhile, nothing is written then
+                batch = batch[:max(room, 0)]
+                if not batch:
+                    continue
+            sources, proxies = zip(*batch)
+            start = time.perf_counter()
+            count = self.redis.add_many(proxies, sources=sources, enqueue=ENABLE_INGEST_STREAM)
+            [self.redis.add_many(proxies, redis_key=tester.key) for tester in self.testers]
+            if count and not ENABLE_INGEST_STREAM:
+                # wake up tester to test new proxies, testers consuming ingest stream are woken up by it
+                self.redis.notify_ingested(count)
+            added += count
+            room -= count
+            if room <= 0:
+                # tester may have removed proxies meanwhile
+                room = PROXY_NUMBER_MAX - self.redis.count()
+            if room < 0 and EVICTION_POLICY != EVICTION_POLICY_NONE:
+                room += self.evict(-room)
+            elif room <= 0 and EVICTION_POLICY == EVICTION_POLICY_NONE:
+                logger.info('pool is full after adding {} proxies, stop crawlers', added)
+                stop.set()
+            elapsed = time.perf_counter() - start
+            if elapsed > INGEST_SLOW_SECONDS and not stop.is_set():
+                logger.warning('writing {} proxies took {:.2f}s, pause crawlers', len(batch), elapsed)
+                resume.clear()
+                time.sleep(elapsed)
+                resume.set()
+            metrics.flush(self.redis, force=False)
 
     @logger.catch
     def run(self):
@@ -89,17 +218,45 @@ class Getter(object):
         """
         if self.is_full():
             return
-        
+        with busy():
+            self.crawl()
+
+    def crawl(self):
+        """
+        run crawlers and write proxies they got, shutdown waits for it
+        """
+        # hosts skipped last cycle are tried again
+        opened = breaker.reset()
+        if opened:
+            logger.info('reset circuit breakers of {}', opened)
         crawlers = self._load_crawlers()
-        for crawler in crawlers:
-            logger.info(f'crawler {crawler} to get proxy')
-            try:
-                for proxy in crawler.crawl():
-                    self.redis.add(proxy)
-                    [self.redis.add(proxy, redis_key=tester.key) for tester in self.testers]
-            except Exception as e:
-                logger.error(f'爬虫 {crawler.__class__.__name__} 运行失败，跳过该爬虫: {e}')
-                continue
+        # pool is created every cycle, so workers parse with the reloaded crawlers
+        pool = ProcessPoolExecutor(max_workers=PARSER_POOL_SIZE, mp_context=parser_context()) \
+            if PARSER_POOL_SIZE > 0 else None
+        executor = ThreadPoolExecutor(max_workers=GETTER_WORKERS)
+        queue = Queue(maxsize=INGEST_QUEUE_SIZE)
+        stop, resume = threading.Event(), threading.Event()
+        resume.set()
+        try:
+            producers = []
+            for crawler in crawlers:
+                # paginated crawlers stop once a page has no proxy new to pool
+                crawler.exists = self.redis.exists_many
+                crawler.pool = pool
+                producers.append(executor.submit(self.produce, crawler, queue, stop, resume))
+            added = self.write(queue, producers, stop, resume)
+            logger.info('added {} new proxies', added)
+            # fetched pages are remembered once their proxies are written, crawlers stopped by a full pool
+            # or by shutdown left some out, and writer dropped those crawlers pushed meanwhile
+            if not stop.is_set():
+                fetch_cache.commit()
+        finally:
+            fetch_cache.rollback()
+            # let crawlers exit if writer failed
+            stop.set()
+            executor.shutdown()
+            pool and pool.shutdown()
+        metrics.flush(self.redis)
 
 
 if __name__ == '__main__':
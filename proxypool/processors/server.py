@@ -1,11 +1,20 @@
-from flask import Flask, g, request, render_template, jsonify
+from flask import Flask, g, request, render_template, jsonify, Response
 from typing import TYPE_CHECKING
 from proxypool.exceptions import PoolEmptyException
-from proxypool.storages.redis import RedisClient
+from proxypool.storages import create_client
+from proxypool.storages.base import BaseStorage, country_key, protocol_key
 from proxypool.setting import API_HOST, API_PORT, API_THREADED, API_KEY, IS_DEV, PROXY_RAND_KEY_DEGRADED
 from proxypool.setting import REDIS_HOST, REDIS_PORT, ENABLE_GETTER, ENABLE_TESTER, CYCLE_GETTER, CYCLE_TESTER, ENABLE_SERVER
+from proxypool.setting import REDIS_KEY, PROXY_SCORE_MIN, PROXY_SCORE_INIT, PROXY_SCORE_MAX
+from proxypool.setting import LEASE_TTL, LEASE_TTL_MAX, TEST_DONT_SET_MAX_SCORE, TEST_PROTOCOLS
+from proxypool.testers import __all__ as testers_cls
+from proxypool.utils.metrics import metrics
+from proxypool.utils.heartbeat import health
+from proxypool.utils.proxy import is_valid_proxy, convert_proxy_or_proxies
+from proxypool.utils.protocol import HTTP
 import functools
 import datetime
+import time
 import os
 import importlib
 import pkgutil
@@ -46,7 +55,7 @@ def auth_required(func):
         else:
             return {"message": "Please provide an API key in header"}, 400
         # Check if API key is correct and valid
-        if request.method == "GET" and api_key == API_KEY:
+        if request.method in ("GET", "POST") and api_key == API_KEY:
             return func(*args, **kwargs)
         else:
             return {"message": "The provided API key is not valid"}, 403
@@ -54,16 +63,47 @@ def auth_required(func):
     return decorator
 
 
-def get_conn() -> RedisClient:  # type: ignore
+def get_conn() -> BaseStorage:  # type: ignore
     """
     get redis client object
     :return:
     """
     if not hasattr(g, 'redis'):
-        g.redis = RedisClient()
+        g.redis = create_client()
     return g.redis  # type: ignore
 
 
+# endpoints of proxy api, whose requests are measured
+API_ENDPOINTS = ('get_proxy', 'get_proxy_all', 'get_count', 'lease_proxy', 'release_proxy', 'report_proxy')
+
+
+def metric_key(key):
+    """
+    label of redis key in metrics, keys of query args which are no pool are labeled other,
+    so they don't add samples without bound
+    """
+    return key if key == REDIS_KEY or any(tester_cls.key == key for tester_cls in testers_cls) else 'other'
+
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    """
+    measure requests of proxy api, labeled by endpoint and redis key
+    """
+    if request.endpoint in API_ENDPOINTS:
+        key = metric_key(request.values.get('key') or REDIS_KEY)  # type: ignore
+        metrics.inc('proxypool_server_requests_total', endpoint=request.path, key=key)
+        metrics.observe('proxypool_server_request_seconds', time.perf_counter() - g.start,
+                        endpoint=request.path, key=key)
+        metrics.flush(get_conn(), force=False)
+    return response
+
+
 @app.route('/')
 @auth_required
 def index():
@@ -75,16 +115,65 @@ def index():
     return render_template('index.html', count=conn.count())
 
 
+def meta_condition(args):
+    """
+    condition on metadata of proxy from query args, like source=Daili66Crawler&max_latency=500
+    :return: callable receiving ProxyMeta, None if no filter or country or protocol alone, which are indexed
+    """
+    source = args.get('source')
+    max_latency = args.get('max_latency', type=int)
+    country = args.get('country', '').upper()
+    protocol = args.get('protocol', '').lower()
+    if not source and max_latency is None and not (country and protocol):
+        return None
+    return lambda meta: (not source or meta.source == source) and \
+        (max_latency is None or 0 < meta.latency <= max_latency) and (not country or meta.country == country) and \
+        (not protocol or protocol in meta.protocol.split(','))
+
+
+def format_timestamp(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else '-'
+
+
+def proxy_item(proxy_str, score, meta):
+    """
+    proxy with score and metadata for admin views
+    """
+    item = {
+        'proxy': proxy_str,
+        'score': int(score) if isinstance(score, (int, float)) else 0,
+        'last_checked': format_timestamp(meta.last_checked if meta else 0),
+    }
+    if meta:
+        item.update(source=meta.source, first_seen=format_timestamp(meta.first_seen), success=meta.success,
+                    fail=meta.fail, protocol=meta.protocol, latency=meta.latency, country=meta.country,
+                    asn=meta.asn)
+    return item
+
+
 @app.route('/random')
 @auth_required
 def get_proxy():
     """
     get a random proxy, can query the specific sub-pool according the (redis) key
     if PROXY_RAND_KEY_DEGRADED is set to True, will get a universal random proxy if no proxy found in the sub-pool
+    can be filtered by metadata of universal pool with source, max_latency (in milliseconds), country and protocol,
+    country or protocol alone is answered by its index of proxies tested valid,
+    protocols besides http are only recorded once probed by TEST_PROTOCOLS, others are rejected
     :return: get a random proxy
     """
     key = request.args.get('key')  # type: ignore
     conn = get_conn()
+    country = request.args.get('country', '').upper()  # type: ignore
+    protocol = request.args.get('protocol', '').lower()  # type: ignore
+    if protocol and protocol != HTTP and protocol not in TEST_PROTOCOLS:
+        return {"message": f"protocol {protocol} is not probed, add it to TEST_PROTOCOLS "
+                           f"(now {','.join(TEST_PROTOCOLS) or 'empty'}) to record and index it"}, 400
+    condition = meta_condition(request.args)
+    if (country or protocol) and not condition:
+        return conn.random_in_index(country_key(country) if country else protocol_key(protocol)).string()
+    if condition:
+        return conn.random_by_meta(condition).string()
     # return conn.random(key).string() if key else conn.random().string()
     if key:
         try:
@@ -125,6 +214,131 @@ def get_count():
     key = request.args.get('key')  # type: ignore
     return str(conn.count(key)) if key else str(conn.count())
     
+
+@app.route('/lease', methods=['POST'])
+@auth_required
+def lease_proxy():
+    """
+    lease a proxy for a session of ttl seconds, so it's not handed to another lease meanwhile as long as
+    unleased proxies are left, can query the specific sub-pool according the (redis) key,
+    if PROXY_RAND_KEY_DEGRADED is set to True, will lease a proxy of universal pool if the sub-pool is empty,
+    mutating endpoints only take POST, so caches and crawlers don't trigger them
+    :return: proxy, key of its pool, ttl, expiry and if it's shared as every proxy of pool is leased
+    """
+    key = request.values.get('key') or REDIS_KEY  # type: ignore
+    ttl = min(max(request.values.get('ttl', LEASE_TTL, type=int), 1), LEASE_TTL_MAX)  # type: ignore
+    conn = get_conn()
+    try:
+        proxy, shared = conn.lease(ttl, key)
+    except PoolEmptyException:
+        if key == REDIS_KEY or not PROXY_RAND_KEY_DEGRADED:
+            raise
+        key = REDIS_KEY
+        proxy, shared = conn.lease(ttl, key)
+    metrics.inc('proxypool_server_leases_total', key=metric_key(key), shared=str(shared).lower())
+    return jsonify({'proxy': proxy.string(), 'key': key, 'ttl': ttl, 'expires_at': int(time.time() + ttl),
+                    'shared': shared})
+
+
+def feedback(conn, proxy, key, ok):
+    """
+    apply result of a request through proxy reported by client to its score, a failure costs a point like a failed
+    check of tester, a success restores a point up to one below max score, so only checks of tester put a proxy
+    among those with max score preferred by `/random` and `/lease`, scores of sub-pools follow settings of their tester
+    :return: if proxy is in the pool
+    """
+    if not conn.exists(proxy, key):
+        return False
+    tester = next((tester_cls for tester_cls in testers_cls if tester_cls.key == key), None)
+    metrics.inc('proxypool_server_reports_total', key=metric_key(key), ok=str(ok).lower())
+    if not ok:
+        conn.decrease(proxy, key, tester.proxy_score_min if tester else PROXY_SCORE_MIN)
+    elif not (tester.test_dont_set_max_score if tester else TEST_DONT_SET_MAX_SCORE):
+        conn.increase(proxy, key, (tester.proxy_score_max if tester else PROXY_SCORE_MAX) - 1)
+    return True
+
+
+def proxy_arg():
+    """
+    proxy of form or query args, None if missing or invalid
+    """
+    proxy = request.values.get('proxy', '')  # type: ignore
+    return convert_proxy_or_proxies(proxy) if is_valid_proxy(proxy) else None
+
+
+@app.route('/release', methods=['POST'])
+@auth_required
+def release_proxy():
+    """
+    release lease of proxy before it expires, with result of the session as ok=1 or ok=0 optionally,
+    which is applied to its score like `/report`
+    :return: if proxy was leased, and if it's in the pool if a result is reported
+    """
+    key = request.values.get('key') or REDIS_KEY  # type: ignore
+    proxy = proxy_arg()
+    if not proxy:
+        return {"message": "Please provide a valid proxy, like 8.8.8.8:8888"}, 400
+    conn = get_conn()
+    result = {'proxy': proxy.string(), 'key': key, 'released': conn.release(proxy, key)}
+    if 'ok' in request.values:  # type: ignore
+        result['found'] = feedback(conn, proxy, key, request.values.get('ok', type=int) == 1)  # type: ignore
+    return jsonify(result)
+
+
+@app.route('/report', methods=['POST'])
+@auth_required
+def report_proxy():
+    """
+    report result of a request through proxy, ok=0 decreases its score, ok=1 increases it up to one below max score,
+    so failures seen by clients count before the next sweep of tester, lease is kept
+    :return: if proxy is in the pool, status 404 if not
+    """
+    key = request.values.get('key') or REDIS_KEY  # type: ignore
+    proxy = proxy_arg()
+    ok = request.values.get('ok', type=int)  # type: ignore
+    if not proxy or ok not in (0, 1):
+        return {"message": "Please provide a valid proxy, like 8.8.8.8:8888, and ok=1 or ok=0"}, 400
+    found = feedback(get_conn(), proxy, key, ok == 1)
+    return jsonify({'proxy': proxy.string(), 'key': key, 'found': found}), 200 if found else 404
+
+
+@app.route('/metrics')
+def get_metrics():
+    """
+    get metrics of getter, tester and server in prometheus text format
+    :return: metrics
+    """
+    conn = get_conn()
+    metrics.flush(conn)
+    # pool size per score band is counted at scrape time
+    bands = {
+        'low': (PROXY_SCORE_MIN, f'({PROXY_SCORE_INIT}'),
+        'init': (PROXY_SCORE_INIT, PROXY_SCORE_INIT),
+        'mid': (f'({PROXY_SCORE_INIT}', f'({PROXY_SCORE_MAX}'),
+        'max': (PROXY_SCORE_MAX, PROXY_SCORE_MAX),
+    }
+    keys = [REDIS_KEY] + [tester_cls.key for tester_cls in testers_cls]
+    gauges = {}
+    for key in keys:
+        for band, count in zip(bands, conn.count_bands(list(bands.values()), key)):
+            gauges[f'proxypool_pool_proxies{{band="{band}",key="{key}"}}'] = count
+        gauges[f'proxypool_pool_leased{{key="{key}"}}'] = conn.count_leased(key)
+    return Response(metrics.render(conn, gauges), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/health')
+def get_health():
+    """
+    get liveness, last cycle duration and lag of tester, getter and server by their heartbeats
+    :return: health, status 503 if any enabled process is dead
+    """
+    roles = [role for role, enabled in (('tester', ENABLE_TESTER), ('getter', ENABLE_GETTER),
+                                        ('server', ENABLE_SERVER)) if enabled]
+    processes = health(get_conn().heartbeats(), roles)
+    healthy = all(process['alive'] for process in processes.values())
+    return jsonify({'healthy': healthy, 'processes': processes}), 200 if healthy else 503
+
+
 # 管理面板路由
 @app.route('/admin')
 def admin_dashboard():
@@ -133,26 +347,11 @@ def admin_dashboard():
     :return: 管理面板首页
     """
     conn = get_conn()
-    proxies = conn.all()
-    proxies_list = []
-    
-    # 获取最新20条代理
-    for proxy in proxies[:20]:
-        # 获取代理分数
-        proxy_str = str(proxy)
-        try:
-            redis_key = list(conn.db.keys('proxies:*'))[0] if conn.db.keys('proxies:*') else None  # type: ignore
-            if redis_key:
-                score = conn.db.zscore(redis_key, proxy_str) or 0  # type: ignore
-            else:
-                score = 0
-        except Exception:
-            score = 0
-        proxies_list.append({
-            'proxy': proxy_str,
-            'score': int(score) if isinstance(score, (int, float)) else 0,
-            'last_checked': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
+    # 获取最新20条代理及其分数和元数据
+    proxies_with_scores = conn.ranked(0, 20, reverse=False)
+    metas = conn.metas([proxy_str for proxy_str, _ in proxies_with_scores])
+    proxies_list = [proxy_item(proxy_str, score, meta)
+                    for (proxy_str, score), meta in zip(proxies_with_scores, metas)]
     
     # 获取爬虫数量
     crawler_count = 0
@@ -195,8 +394,7 @@ def admin_plugins():
     管理面板插件页面
     :return: 管理面板插件页面
     """
-    import importlib.util
-    import inspect
+    import ast
     
     plugins = []
     crawler_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'crawlers', 'public')
@@ -209,23 +407,20 @@ def admin_plugins():
             
             file_path = os.path.join(crawler_path, filename)
             try:
-                # 动态导入爬虫模块
-                spec = importlib.util.spec_from_file_location(filename[:-3], file_path)
-                if spec is None or spec.loader is None:  # type: ignore
-                    continue
-                module = importlib.util.module_from_spec(spec)  # type: ignore
-                spec.loader.exec_module(module)  # type: ignore
+                # 只解析源码，不导入爬虫模块，Server 进程不加载爬虫的依赖
+                with open(file_path, encoding='utf-8') as f:
+                    tree = ast.parse(f.read(), filename=file_path)
                 
                 # 查找爬虫类（通常继承自 BaseCrawler）
-                for name, obj in inspect.getmembers(module):
-                    if inspect.isclass(obj) and hasattr(obj, '__module__') and obj.__module__ == module.__name__:
+                for node in tree.body:
+                    if isinstance(node, ast.ClassDef):
                         # 获取类的 docstring
-                        docstring = inspect.getdoc(obj) or 'N/A'
+                        docstring = ast.get_docstring(node) or 'N/A'
                         # 只取第一行作为描述
                         description = docstring.split('\n')[0] if docstring else 'N/A'
                         
                         plugins.append({
-                            'name': name,
+                            'name': node.name,
                             'type': 'public',
                             'description': description,
                             'file': filename
@@ -264,12 +459,9 @@ def api_stats():
     avg_score = 0
     if proxies:
         try:
-            redis_keys = conn.db.keys('proxies:*')  # type: ignore
-            redis_key = list(redis_keys)[0] if redis_keys else None  # type: ignore
-            if redis_key:
-                scores = conn.db.zrange(redis_key, 0, -1, withscores=True)  # type: ignore
-                if scores and isinstance(scores, list):
-                    avg_score = int(sum(score[1] for score in scores) / len(scores))
+            scores = conn.ranked(0, -1, reverse=False)
+            if scores and isinstance(scores, list):
+                avg_score = int(sum(score[1] for score in scores) / len(scores))
         except Exception:
             avg_score = 0
     
@@ -297,37 +489,12 @@ def api_proxies():
     offset = request.args.get('offset', 0, type=int)  # type: ignore
     
     try:
-        redis_key = list(conn.db.keys('proxies:*'))[0] if conn.db.keys('proxies:*') else None  # type: ignore
-        
-        if redis_key:
-            # 从 Redis 按分数批量获取代理（按分数由高到低）
-            all_proxies_with_scores = conn.db.zrevrange(redis_key, 0, -1, withscores=True)  # type: ignore
-            total = len(all_proxies_with_scores) if all_proxies_with_scores else 0  # type: ignore
-            
-            # 分页处理
-            paginated_proxies = (all_proxies_with_scores or [])[offset:offset + limit]  # type: ignore
-            
-            proxies_data = []
-            for proxy_str, score in paginated_proxies:
-                proxies_data.append({
-                    'proxy': proxy_str,
-                    'score': int(score) if isinstance(score, (int, float)) else 0,
-                    'last_checked': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                })
-        else:
-            # 没有 Redis key，推退到 conn.all()
-            all_proxies = conn.all()
-            total = len(all_proxies)
-            paginated_proxies = all_proxies[offset:offset + limit]
-            
-            proxies_data = []
-            for proxy in paginated_proxies:
-                proxy_str = str(proxy)
-                proxies_data.append({
-                    'proxy': proxy_str,
-                    'score': 0,
-                    'last_checked': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                })
+        # 从 Redis 按分数分页获取代理（按分数由高到低）及其元数据
+        total = conn.count()
+        paginated_proxies = conn.ranked(offset, limit)
+        metas = conn.metas([proxy_str for proxy_str, _ in paginated_proxies])
+        proxies_data = [proxy_item(proxy_str, score, meta)
+                        for (proxy_str, score), meta in zip(paginated_proxies, metas)]
     except Exception as e:
         # 错误处理，返回空列表
         print(f'Error fetching proxies: {e}')
@@ -1,13 +1,23 @@
 import asyncio
+import os
+import socket
+import time
+from collections import Counter
 import aiohttp
 from loguru import logger
 from proxypool.schemas import Proxy
-from proxypool.storages.redis import RedisClient
+from proxypool.storages import create_client
 from proxypool.setting import TEST_TIMEOUT, TEST_BATCH, TEST_URL, TEST_VALID_STATUS, TEST_ANONYMOUS, \
-    TEST_DONT_SET_MAX_SCORE
-from aiohttp import ClientProxyConnectionError, ServerDisconnectedError, ClientOSError, ClientHttpProxyError
+    TEST_ANONYMOUS_URL, TEST_DONT_SET_MAX_SCORE, LOG_PER_PROXY, TEST_PROTOCOLS, PROXY_SCORE_INIT, CYCLE_TESTER, \
+    CYCLE_TESTER_MIN, ENABLE_INGEST_STREAM, TEST_CACHE_TTL, REDIS_KEY, PROXY_SCORE_MAX, PROXY_SCORE_MIN
+from aiohttp import ClientProxyConnectionError, ServerDisconnectedError, ClientOSError, ClientHttpProxyError, \
+    ClientResponseError
 from asyncio import TimeoutError
 from proxypool.testers import __all__ as testers_cls
+from proxypool.utils.metrics import metrics
+from proxypool.utils.protocol import probe, HTTP
+from proxypool.utils.proxy import convert_proxy_or_proxies
+from proxypool.utils.shutdown import busy, stopping
 
 EXCEPTIONS = (
     ClientProxyConnectionError,
@@ -16,6 +26,8 @@ EXCEPTIONS = (
     ServerDisconnectedError,
     ClientOSError,
     ClientHttpProxyError,
+    # malformed responses of broken proxies
+    ClientResponseError,
     AssertionError
 )
 
@@ -29,86 +41,255 @@ class Tester(object):
         """
         init redis
         """
-        self.redis = RedisClient()
-        self.loop = asyncio.get_event_loop()
+        self.redis = create_client()
+        self.loop = asyncio.new_event_loop()
         self.testers_cls = testers_cls
         self.testers = [tester_cls() for tester_cls in self.testers_cls]
+        self.results = Counter()
+        # results of current batch for metadata, proxy string: (valid, latency in ms, protocols)
+        self.checks = {}
+        # consumer of ingest stream, entries claimed by a crashed tester are claimed again by others
+        self.consumer = f'{socket.gethostname()}-{os.getpid()}'
+        # cached verdicts of current batch fetched in one go, and fresh ones to cache after it, key: verdict
+        self.verdicts, self.fresh = {}, {}
+        # scores of proxies with cached verdicts of current batch, key: score
+        self.scores = {}
+        # hits and misses of verdict cache in current sweep, or in current cycle of consuming ingest stream
+        self.cache = Counter()
+        # called as batches are tested, set to Heartbeat.progress by scheduler, so a hung loop is told
+        self.progress = lambda: None
+
+    @staticmethod
+    def verdict_key(proxy: Proxy, target):
+        """
+        key of cached verdict of proxy for test target, TEST_URL or key of sub-pool of a tester
+        """
+        return f'{proxy.string()}:{target}'
+
+    def cached(self, proxy: Proxy, target):
+        """
+        get cached verdict of proxy for test target, counted as hit or miss
+        :return: verdict, None if not cached
+        """
+        if not TEST_CACHE_TTL:
+            return None
+        verdict = self.verdicts.get(self.verdict_key(proxy, target))
+        result = 'hit' if verdict else 'miss'
+        self.cache[result] += 1
+        metrics.inc('proxypool_tester_cache_total', result=result)
+        return verdict
+
+    def remember(self, proxy: Proxy, target, verdict):
+        """
+        cache verdict of proxy for test target once current batch is done
+        """
+        if TEST_CACHE_TTL:
+            self.fresh[self.verdict_key(proxy, target)] = verdict
+
+    def hit_rate(self):
+        """
+        hit rate of verdict cache in current sweep or cycle of consuming, 0 if nothing was looked up
+        """
+        total = sum(self.cache.values())
+        return self.cache['hit'] / total if total else 0
+
+    async def test_http(self, session, proxy: Proxy):
+        """
+        test proxy as http proxy with TEST_URL, and its anonymity if TEST_ANONYMOUS is set
+        :param session: aiohttp session
+        :param proxy: Proxy object
+        :return: result, valid, invalid, timeout or error, latency in milliseconds
+            and if proxy answered, which is False if the test raised
+        """
+        try:
+            # if TEST_ANONYMOUS is True, make sure that
+            # the proxy has the effect of hiding the real IP
+            # logger.debug(f'TEST_ANONYMOUS {TEST_ANONYMOUS}')
+            if TEST_ANONYMOUS:
+                url = TEST_ANONYMOUS_URL
+                async with session.get(url, timeout=TEST_TIMEOUT) as response:
+                    if response.status == 200 and 'application/json' in response.headers.get('content-type', ''):
+                        resp_json = await response.json()
+                        origin_ip = resp_json.get('origin')
+                    # logger.debug(f'origin ip is {origin_ip}')
+                async with session.get(url, proxy=f'http://{proxy.string()}', timeout=TEST_TIMEOUT) as response:
+                    if response.status == 200 and 'application/json' in response.headers.get('content-type', ''):
+                        resp_json = await response.json()
+                        anonymous_ip = resp_json.get('origin')
+                    if LOG_PER_PROXY:
+                        logger.debug('anonymous ip is {}', anonymous_ip)
+                assert origin_ip != anonymous_ip
+                assert proxy.host == anonymous_ip
+            start = time.perf_counter()
+            async with session.get(TEST_URL, proxy=f'http://{proxy.string()}', timeout=TEST_TIMEOUT,
+                                   allow_redirects=False) as response:
+                if response.status in TEST_VALID_STATUS:
+                    return 'valid', int((time.perf_counter() - start) * 1000), True
+                return 'invalid', 0, True
+        except EXCEPTIONS as e:
+            # failed anonymous check raises AssertionError
+            result = 'timeout' if isinstance(e, TimeoutError) else \
+                'invalid' if isinstance(e, AssertionError) else 'error'
+            return result, 0, False
+
+    async def check(self, session, proxy: Proxy):
+        """
+        check proxy as http proxy and by handshakes of TEST_PROTOCOLS concurrently, and cache its verdict,
+        score follows the http check and its anonymity check alone, as proxies are handed out as http proxies,
+        probed protocols are only recorded in metadata and indexes by protocol
+        :param session: aiohttp session
+        :param proxy: Proxy object
+        :return: if proxy answered
+        """
+        (result, latency, answered), *probes = await asyncio.gather(
+            self.test_http(session, proxy),
+            *[probe(protocol, proxy, TEST_URL, TEST_TIMEOUT) for protocol in TEST_PROTOCOLS])
+        protocols = ([HTTP] if result == 'valid' else []) + [
+            protocol for protocol, (is_supported, _) in zip(TEST_PROTOCOLS, probes) if is_supported]
+        self.record(result, proxy, latency, protocols)
+        if result == 'valid':
+            score = PROXY_SCORE_MAX
+            if not TEST_DONT_SET_MAX_SCORE:
+                self.redis.max(proxy)
+            if LOG_PER_PROXY:
+                logger.debug('proxy {} is valid for {}, {}', proxy, protocols,
+                             'remain current score' if TEST_DONT_SET_MAX_SCORE else 'set max score')
+        else:
+            score = self.redis.decrease(proxy)
+            if LOG_PER_PROXY:
+                logger.debug('proxy {} is invalid, decrease score', proxy)
+        self.remember(proxy, TEST_URL, f'{result}|{answered:d}|{score}')
+        return answered
+
+    def settle(self, proxy: Proxy, target, valid, score, redis_key=REDIS_KEY, proxy_score_max=PROXY_SCORE_MAX,
+               proxy_score_min=PROXY_SCORE_MIN, dont_set_max_score=TEST_DONT_SET_MAX_SCORE):
+        """
+        apply cached verdict of proxy instead of testing it again, score is only moved if proxy is not at the score
+        the verdict left it at, so a failure costs one point however often its verdict is reused,
+        reused verdicts are neither recorded in metadata nor counted as checks
+        :param target: TEST_URL or key of sub-pool of a tester
+        :param valid: if cached verdict is valid
+        :param score: score of proxy after the check of cached verdict
+        """
+        current = self.scores.get(self.verdict_key(proxy, target))
+        if current is None:
+            return
+        if valid:
+            if not dont_set_max_score and current < proxy_score_max:
+                self.redis.max(proxy, redis_key, proxy_score_max)
+        elif current > score:
+            self.redis.decrease(proxy, redis_key, proxy_score_min)
+        if LOG_PER_PROXY:
+            logger.debug('key[{}] proxy {} reuses cached verdict {}', redis_key, proxy, 'valid' if valid else 'invalid')
+
+    def pending(self, proxy: Proxy):
+        """
+        apply cached verdicts of sub-pools holding proxy
+        :return: testers of sub-pools holding proxy without a cached verdict
+        """
+        testers = []
+        for tester in self.testers:
+            if not self.redis.exists(proxy, tester.key):
+                continue
+            cached = self.cached(proxy, tester.key)
+            if not cached:
+                testers.append(tester)
+                continue
+            is_valid, score = cached.split('|')
+            self.settle(proxy, tester.key, is_valid == '1', float(score), tester.key, tester.proxy_score_max,
+                        tester.proxy_score_min, tester.test_dont_set_max_score)
+        return testers
 
     async def test(self, proxy: Proxy):
         """
-        test single proxy
+        test single proxy, verdicts cached within TEST_CACHE_TTL seconds are applied instead of testing again,
+        a session is only opened if some verdict is not cached
         :param proxy: Proxy object
         :return:
         """
+        if LOG_PER_PROXY:
+            logger.debug('testing {}', proxy)
+        cached = self.cached(proxy, TEST_URL)
+        if cached:
+            result, answered, score = cached.split('|')
+            self.settle(proxy, TEST_URL, result == 'valid', float(score))
+            # sub-pools of a proxy not answering lost score when its verdict was cached
+            if answered != '1':
+                return
+            testers = self.pending(proxy)
+            if not testers:
+                return
         async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
+            if not cached:
+                if not await self.check(session, proxy):
+                    [self.redis.decrease(proxy, tester.key, tester.proxy_score_min)
+                     for tester in self.testers]
+                    return
+                testers = self.pending(proxy)
+            # if independent tester class found, create new set of storage and do the extra test
             try:
-                logger.debug(f'testing {proxy.string()}')
-                # if TEST_ANONYMOUS is True, make sure that
-                # the proxy has the effect of hiding the real IP
-                # logger.debug(f'TEST_ANONYMOUS {TEST_ANONYMOUS}')
-                if TEST_ANONYMOUS:
-                    url = 'https://httpbin.org/ip'
-                    async with session.get(url, timeout=TEST_TIMEOUT) as response:
-                        if response.status == 200 and 'application/json' in response.headers.get('content-type', ''):
-                            resp_json = await response.json()
-                            origin_ip = resp_json.get('origin')
-                        # logger.debug(f'origin ip is {origin_ip}')
-                    async with session.get(url, proxy=f'http://{proxy.string()}', timeout=TEST_TIMEOUT) as response:
-                        if response.status == 200 and 'application/json' in response.headers.get('content-type', ''):
-                            resp_json = await response.json()
-                            anonymous_ip = resp_json.get('origin')
-                        logger.debug(f'anonymous ip is {anonymous_ip}')
-                    assert origin_ip != anonymous_ip
-                    assert proxy.host == anonymous_ip
-                async with session.get(TEST_URL, proxy=f'http://{proxy.string()}', timeout=TEST_TIMEOUT,
-                                       allow_redirects=False) as response:
-                    if response.status in TEST_VALID_STATUS:
-                        if TEST_DONT_SET_MAX_SCORE:
-                            logger.debug(
-                                f'proxy {proxy.string()} is valid, remain current score')
-                        else:
-                            self.redis.max(proxy)
-                            logger.debug(
-                                f'proxy {proxy.string()} is valid, set max score')
-                    else:
-                        self.redis.decrease(proxy)
-                        logger.debug(
-                            f'proxy {proxy.string()} is invalid, decrease score')
-                # if independent tester class found, create new set of storage and do the extra test
-                for tester in self.testers:
+                for tester in testers:
                     key = tester.key
-                    if self.redis.exists(proxy, key):
-                        test_url = tester.test_url
-                        headers = tester.headers()
-                        cookies = tester.cookies()
-                        async with session.get(test_url, proxy=f'http://{proxy.string()}',
-                                               timeout=TEST_TIMEOUT,
-                                               headers=headers,
-                                               cookies=cookies,
-                                               allow_redirects=False) as response:
-                            resp_text = await response.text()
-                            is_valid = await tester.parse(resp_text, test_url, proxy.string())
-                            if is_valid:
-                                if tester.test_dont_set_max_score:
-                                    logger.info(
-                                        f'key[{key}] proxy {proxy.string()} is valid, remain current score')
-                                else:
-                                    self.redis.max(
-                                        proxy, key, tester.proxy_score_max)
-                                    logger.info(
-                                        f'key[{key}] proxy {proxy.string()} is valid, set max score')
-                            else:
-                                self.redis.decrease(
-                                    proxy, tester.key, tester.proxy_score_min)
-                                logger.info(
-                                    f'key[{key}] proxy {proxy.string()} is invalid, decrease score')
-
+                    is_valid = await tester.check(session, proxy)
+                    if is_valid:
+                        score = tester.proxy_score_max
+                        if not tester.test_dont_set_max_score:
+                            self.redis.max(
+                                proxy, key, tester.proxy_score_max)
+                        if LOG_PER_PROXY:
+                            logger.debug('key[{}] proxy {} is valid, {}', key, proxy,
+                                         'remain current score' if tester.test_dont_set_max_score
+                                         else 'set max score')
+                    else:
+                        score = self.redis.decrease(
+                            proxy, tester.key, tester.proxy_score_min)
+                        if LOG_PER_PROXY:
+                            logger.debug('key[{}] proxy {} is invalid, decrease score', key, proxy)
+                    self.remember(proxy, key, f'{is_valid:d}|{score}')
             except EXCEPTIONS:
-                self.redis.decrease(proxy)
                 [self.redis.decrease(proxy, tester.key, tester.proxy_score_min)
                  for tester in self.testers]
-                logger.debug(
-                    f'proxy {proxy.string()} is invalid, decrease score')
+                if LOG_PER_PROXY:
+                    logger.debug('proxy {} is invalid for testers, decrease score', proxy)
+
+    def record(self, result, proxy, latency=0, protocols=()):
+        """
+        count result of a check, results are logged and written to metadata once per batch instead of once per proxy
+        :param result: valid, invalid, timeout or error
+        :param proxy: proxy checked
+        :param latency: latency of valid check in milliseconds
+        :param protocols: supported protocols, probed ones are recorded even if http check failed
+        """
+        self.results[result] += 1
+        self.checks[proxy.string()] = (result == 'valid', latency, ','.join(protocols))
+        metrics.inc('proxypool_tester_checks_total', result=result)
+
+    def test_batch(self, proxies):
+        """
+        test batch of proxies concurrently, and write their metadata in one go, shutdown waits for it,
+        cached verdicts of the batch are fetched and fresh ones cached in one round trip each
+        :param proxies: list of Proxy
+        """
+        with busy():
+            # a proxy is tested once per batch, even if the stream delivered it twice
+            proxies = list({proxy.string(): proxy for proxy in proxies}.values())
+            if TEST_CACHE_TTL:
+                keys = [self.verdict_key(proxy, target) for proxy in proxies
+                        for target in [TEST_URL] + [tester.key for tester in self.testers]]
+                self.verdicts = {key: verdict for key, verdict in zip(keys, self.redis.verdicts(keys)) if verdict}
+                # scores of proxies with cached verdicts, one round trip per pool, so reused ones only move if needed
+                for target, redis_key in [(TEST_URL, REDIS_KEY)] + [(tester.key, tester.key) for tester in self.testers]:
+                    hits = [proxy for proxy in proxies if self.verdict_key(proxy, target) in self.verdicts]
+                    if hits:
+                        self.scores.update({self.verdict_key(proxy, target): score for proxy, score in
+                                            zip(hits, self.redis.scores(hits, redis_key))})
+            tasks = [self.loop.create_task(
+                self.test(proxy)) for proxy in proxies]
+            self.loop.run_until_complete(asyncio.wait(tasks))
+            self.redis.update_metas(self.checks)
+            self.redis.cache_verdicts(self.fresh, TEST_CACHE_TTL)
+            self.checks, self.verdicts, self.fresh, self.scores = {}, {}, {}, {}
+        self.progress()
 
     @logger.catch
     def run(self):
@@ -119,18 +300,84 @@ class Tester(object):
         # event loop of aiohttp
         logger.info('stating tester...')
         count = self.redis.count()
-        logger.debug(f'{count} proxies to test')
+        logger.debug('{} proxies to test', count)
+        self.results, self.cache = Counter(), Counter()
         cursor = 0
+        start = time.perf_counter()
         while True:
-            logger.debug(
-                f'testing proxies use cursor {cursor}, count {TEST_BATCH}')
             cursor, proxies = self.redis.batch(cursor, count=TEST_BATCH)
             if proxies:
-                tasks = [self.loop.create_task(
-                    self.test(proxy)) for proxy in proxies]
-                self.loop.run_until_complete(asyncio.wait(tasks))
+                self.test_batch(proxies)
+                logger.debug('tested batch of {} proxies, next cursor {}, results {}',
+                             len(proxies), cursor, dict(self.results))
+            metrics.flush(self.redis, force=False)
+            if stopping.is_set():
+                logger.info('shutting down, stop sweep at cursor {}', cursor)
+                break
             if not cursor:
                 break
+        elapsed = time.perf_counter() - start
+        metrics.observe('proxypool_tester_sweep_seconds', elapsed)
+        metrics.flush(self.redis)
+        logger.info('tested {} proxies in {:.1f}s, results {}, verdict cache hits {} of {} ({:.0%})',
+                    sum(self.results.values()), elapsed, dict(self.results), self.cache['hit'],
+                    sum(self.cache.values()), self.hit_rate())
+
+    def backlog(self):
+        """
+        number of proxies never tested, which still have init score,
+        unknown if valid proxies keep their score
+        """
+        if TEST_DONT_SET_MAX_SCORE:
+            return 0
+        return self.redis.count_bands([(PROXY_SCORE_INIT, PROXY_SCORE_INIT)])[0]
+
+    @logger.catch
+    def consume(self, timeout):
+        """
+        test proxies of ingest stream as they are ingested, entries are acked once tested,
+        so entries of a crashed tester are delivered again, at least once
+        :param timeout: seconds to consume
+        :return: number of tested proxies
+        """
+        deadline = time.time() + timeout
+        tested = 0
+        self.results, self.cache = Counter(), Counter()
+        while time.time() < deadline and not stopping.is_set():
+            self.progress()
+            entries = self.redis.claim_ingested(self.consumer, TEST_BATCH, block=min(1, deadline - time.time()))
+            if not entries:
+                continue
+            proxies = convert_proxy_or_proxies([member for _, member in entries])
+            # proxies evicted or removed since they were ingested are skipped
+            proxies = [proxy for proxy, exists in zip(proxies, self.redis.exists_many(proxies)) if exists]
+            if proxies:
+                self.test_batch(proxies)
+            self.redis.ack_ingested([entry_id for entry_id, _ in entries])
+            tested += len(proxies)
+            logger.debug('tested {} ingested proxies, results {}, verdict cache hit rate {:.0%}',
+                         len(proxies), dict(self.results), self.hit_rate())
+            metrics.flush(self.redis, force=False)
+        return tested
+
+    def wait(self, cycle_min=CYCLE_TESTER_MIN, cycle_max=CYCLE_TESTER):
+        """
+        wait before next sweep, if ENABLE_INGEST_STREAM is set, new proxies are tested from the stream meanwhile
+        and next sweep starts after cycle_max seconds, else at least cycle_min seconds, next sweep starts then if getter ingested
+        new proxies or untested ones are left, else as soon as getter ingests new ones, at most cycle_max seconds
+        :return: number of proxies ingested meanwhile
+        """
+        if ENABLE_INGEST_STREAM:
+            return self.consume(cycle_max)
+        cycle_min = min(cycle_min, cycle_max)
+        # subscribes on first call, and collects events published during last sweep
+        ingested = self.redis.wait_ingested(0)
+        time.sleep(cycle_min)
+        ingested += self.redis.wait_ingested(0)
+        if not ingested and not self.backlog():
+            ingested = self.redis.wait_ingested(cycle_max - cycle_min)
+        logger.debug('{} proxies ingested since last sweep', ingested)
+        return ingested
 
 
 def run_tester():
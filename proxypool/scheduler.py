@@ -1,23 +1,93 @@
-import time
+import gc
+import importlib
 import multiprocessing
-from proxypool.processors.server import app
-from proxypool.processors.getter import Getter
-from proxypool.processors.tester import Tester
+import signal
+import threading
+import time
 from proxypool.setting import APP_PROD_METHOD_GEVENT, APP_PROD_METHOD_MEINHELD, APP_PROD_METHOD_TORNADO, CYCLE_GETTER, CYCLE_TESTER, API_HOST, \
     API_THREADED, API_PORT, ENABLE_SERVER, IS_PROD, APP_PROD_METHOD, \
-    ENABLE_GETTER, ENABLE_TESTER, IS_WINDOWS
+    ENABLE_GETTER, ENABLE_TESTER, IS_WINDOWS, STORAGE, STORAGE_EMBEDDED, HEARTBEAT_TIMEOUT, SUPERVISOR_BACKOFF_MIN, \
+    SUPERVISOR_BACKOFF_MAX, SHUTDOWN_TIMEOUT, ENABLE_PRELOAD
+from proxypool.storages import create_client
+from proxypool.utils import shutdown
+from proxypool.utils.heartbeat import Heartbeat, stalled
+from proxypool.utils.metrics import metrics
+from proxypool.utils import geoip
 from loguru import logger
 
 
 if IS_WINDOWS:
     multiprocessing.freeze_support()
 
-tester_process, getter_process, server_process = None, None, None
+# seconds between checks of supervisor
+SUPERVISOR_INTERVAL = 1
+
+# modules of every role imported by scheduler before forking if ENABLE_PRELOAD is set
+PRELOADS = {
+    'tester': ('proxypool.processors.tester',),
+    'getter': ('proxypool.processors.getter', 'proxypool.crawlers'),
+    'server': ('proxypool.processors.server',),
+}
+
+
+class Child(object):
+    """
+    process of tester, getter or server supervised by scheduler, or thread of it if storage is embedded
+    """
+
+    def __init__(self, role, target):
+        self.role = role
+        self.target = target
+        self.process = None
+        self.started_at = 0
+        self.restarts = 0
+        self.backoff = 0
+        self.restart_at = 0
+        # set once child exited cleanly, it's not restarted
+        self.done = False
+        # exit code of thread, recorded by Scheduler.guard
+        self.thread_exitcode = None
+
+    @property
+    def is_thread(self):
+        return isinstance(self.process, threading.Thread)
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def exitcode(self):
+        """
+        exit code of exited child, 0 if it exited cleanly, None if it's alive
+        """
+        if self.is_thread:
+            return self.thread_exitcode
+        return self.process.exitcode if self.process is not None else None
+
+    def terminate(self):
+        """
+        ask process to stop gracefully by SIGTERM, threads can't be stopped, they stop with loops of tester and getter
+        """
+        if self.is_alive() and not self.is_thread:
+            self.process.terminate()
+
+    def join(self, timeout):
+        """
+        wait for process to exit, kill it if it doesn't exit within timeout
+        """
+        if not self.is_alive() or self.is_thread:
+            return
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logger.warning('{} did not exit in time, kill it', self.role)
+            self.process.kill()
+            self.process.join()
 
 
 class Scheduler():
     """
-    scheduler
+    scheduler, supervises tester, getter and server, restarts them with backoff once they crash, stop beating
+    or stop making progress
     """
 
     def run_tester(self, cycle=CYCLE_TESTER):
@@ -27,13 +97,21 @@ class Scheduler():
         if not ENABLE_TESTER:
             logger.info('tester not enabled, exit')
             return
+        # processors are imported by their own process only, so it doesn't load dependencies of the others
+        from proxypool.processors.tester import Tester
         tester = Tester()
+        heartbeat = Heartbeat(tester.redis, 'tester', cycle).start()
+        tester.progress = heartbeat.progress
         loop = 0
-        while True:
+        while not shutdown.stopping.is_set():
             logger.debug(f'tester loop {loop} start...')
-            tester.run()
+            with heartbeat.cycle():
+                tester.run()
             loop += 1
-            time.sleep(cycle)
+            if shutdown.stopping.is_set():
+                break
+            tester.wait(cycle_max=cycle)
+        metrics.flush(tester.redis)
 
     def run_getter(self, cycle=CYCLE_GETTER):
         """
@@ -42,13 +120,20 @@ class Scheduler():
         if not ENABLE_GETTER:
             logger.info('getter not enabled, exit')
             return
+        from proxypool.processors.getter import Getter
         getter = Getter()
+        heartbeat = Heartbeat(getter.redis, 'getter', cycle).start()
+        getter.progress = heartbeat.progress
         loop = 0
-        while True:
+        while not shutdown.stopping.is_set():
             logger.debug(f'getter loop {loop} start...')
-            getter.run()
+            with heartbeat.cycle():
+                getter.run()
             loop += 1
-            time.sleep(cycle)
+            if shutdown.stopping.is_set():
+                break
+            getter.wait(cycle_max=cycle)
+        metrics.flush(getter.redis)
 
     def run_server(self):
         """
@@ -57,6 +142,8 @@ class Scheduler():
         if not ENABLE_SERVER:
             logger.info('server not enabled, exit')
             return
+        from proxypool.processors.server import app
+        Heartbeat(create_client(), 'server').start()
         if IS_PROD:
             if APP_PROD_METHOD == APP_PROD_METHOD_GEVENT:
                 try:
@@ -94,47 +181,148 @@ class Scheduler():
         else:
             app.run(host=API_HOST, port=API_PORT, threaded=API_THREADED, use_reloader=False)
 
+    @staticmethod
+    def spawn(child: Child):
+        """
+        create process of target of child, or thread of it if storage is embedded, which lives in this process
+        """
+        if STORAGE == STORAGE_EMBEDDED:
+            return threading.Thread(target=Scheduler.guard, args=(child,), daemon=True)
+        return multiprocessing.Process(target=Scheduler.bootstrap, args=(child.target,))
+
+    @staticmethod
+    def guard(child: Child):
+        """
+        entry of thread of child, its exit code is recorded like a process, 1 if it raised
+        """
+        try:
+            child.target()
+            child.thread_exitcode = 0
+        except Exception:
+            logger.exception('{} crashed', child.role)
+            child.thread_exitcode = 1
+
+    @staticmethod
+    def bootstrap(target):
+        """
+        entry of child process, shutdown is driven by SIGTERM of scheduler
+        """
+        shutdown.install()
+        target()
+
+    @staticmethod
+    def preload(children):
+        """
+        import modules of enabled roles and open geoip databases once before forking, crawlers are discovered
+        for their dependencies, only if children are forked processes, spawned ones import everything again
+        """
+        if not ENABLE_PRELOAD or STORAGE == STORAGE_EMBEDDED or multiprocessing.get_start_method() != 'fork':
+            return
+        start = time.perf_counter()
+        for child in children:
+            for name in PRELOADS[child.role]:
+                module = importlib.import_module(name)
+                getattr(module, 'discover', lambda: None)()
+        geoip.preload()
+        logger.info('preloaded {} in {:.2f}s', [child.role for child in children], time.perf_counter() - start)
+
+    def start(self, child: Child):
+        child.thread_exitcode = None
+        child.process = self.spawn(child)
+        child.process.start()
+        child.started_at = time.time()
+        logger.info(f'starting {child.role}, pid {getattr(child.process, "pid", None)}...')
+
+    def supervise(self, child: Child, heartbeats):
+        """
+        restart child once it crashes, or kill and restart it if it stops beating or making progress,
+        child exited cleanly is not restarted, restarts are delayed by backoff doubled on every crash,
+        reset once child runs longer than max backoff
+        :param heartbeats: last heartbeats of all roles
+        """
+        now = time.time()
+        if child.done:
+            return
+        if child.is_alive():
+            if child.is_thread:
+                return
+            status = heartbeats.get(child.role) or {}
+            # heartbeat of process before restart doesn't count
+            if status.get('pid') != child.process.pid:
+                status = {'beat_at': child.started_at, 'state': 'starting'}
+            if now - status['beat_at'] >= HEARTBEAT_TIMEOUT:
+                logger.error('{} did not beat for {:.0f}s, kill it', child.role, now - status['beat_at'])
+            elif stalled(status, now):
+                logger.error('{} made no progress for {:.0f}s, kill it', child.role, stalled(status, now))
+            else:
+                return
+            child.join(0)
+        elif not child.restart_at and child.exitcode == 0:
+            logger.info('{} exited cleanly, not restarting it', child.role)
+            child.done = True
+            return
+        if not child.restart_at:
+            uptime = now - child.started_at
+            child.backoff = SUPERVISOR_BACKOFF_MIN if uptime > SUPERVISOR_BACKOFF_MAX or not child.backoff \
+                else min(child.backoff * 2, SUPERVISOR_BACKOFF_MAX)
+            child.restart_at = now + child.backoff
+            logger.error('{} exited with code {} after {:.0f}s, restart it in {:.1f}s', child.role,
+                         getattr(child.process, 'exitcode', None), uptime, child.backoff)
+        if now >= child.restart_at:
+            child.restart_at = 0
+            child.restarts += 1
+            self.start(child)
+
+    @staticmethod
+    def stop(children):
+        """
+        stop children gracefully, in-flight test batches and ingest pipelines are finished before they exit
+        """
+        shutdown.stopping.set()
+        if STORAGE == STORAGE_EMBEDDED:
+            # threads of embedded storage are daemons, they stop with this process once idle
+            if not shutdown.wait_idle(SHUTDOWN_TIMEOUT):
+                logger.warning('tester or getter did not finish in {}s', SHUTDOWN_TIMEOUT)
+            return
+        for child in children:
+            child.terminate()
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        for child in children:
+            child.join(max(deadline - time.time(), 0))
+
     def run(self):
-        global tester_process, getter_process, server_process
+        roles = [('tester', ENABLE_TESTER, self.run_tester), ('getter', ENABLE_GETTER, self.run_getter),
+                 ('server', ENABLE_SERVER, self.run_server)]
+        # children are not kept on scheduler, whose bound methods are pickled as targets on windows
+        children = [Child(role, target) for role, enabled, target in roles if enabled]
+        storage = create_client()
+        self.preload(children)
+        if STORAGE != STORAGE_EMBEDDED:
+            # objects preloaded so far are never freed, keep gc of children from touching them, which would copy
+            # their shared pages, frozen once before the first fork, objects of restarts are collected as usual
+            gc.freeze()
+        # stop gracefully on SIGTERM as well as ctrl-c
+        signal.signal(signal.SIGTERM, lambda *_: shutdown.stopping.set())
         try:
             logger.info('starting proxypool...')
-            if ENABLE_TESTER:
-                tester_process = multiprocessing.Process(
-                    target=self.run_tester)
-                logger.info(f'starting tester, pid {tester_process.pid}...')
-                tester_process.start()
-
-            if ENABLE_GETTER:
-                getter_process = multiprocessing.Process(
-                    target=self.run_getter)
-                logger.info(f'starting getter, pid {getter_process.pid}...')
-                getter_process.start()
-
-            if ENABLE_SERVER:
-                server_process = multiprocessing.Process(
-                    target=self.run_server)
-                logger.info(f'starting server, pid {server_process.pid}...')
-                server_process.start()
-
-            tester_process and tester_process.join()
-            getter_process and getter_process.join()
-            server_process and server_process.join()
+            for child in children:
+                self.start(child)
+            while not shutdown.stopping.wait(SUPERVISOR_INTERVAL):
+                try:
+                    heartbeats = storage.heartbeats()
+                except Exception:
+                    logger.exception('failed to read heartbeats')
+                    heartbeats = {}
+                for child in children:
+                    self.supervise(child, heartbeats)
+            logger.info('received terminate signal')
         except KeyboardInterrupt:
             logger.info('received keyboard interrupt signal')
-            tester_process and tester_process.terminate()
-            getter_process and getter_process.terminate()
-            server_process and server_process.terminate()
         finally:
-            # must call join method before calling is_alive
-            tester_process and tester_process.join()
-            getter_process and getter_process.join()
-            server_process and server_process.join()
-            logger.info(
-                f'tester is {"alive" if tester_process.is_alive() else "dead"}')
-            logger.info(
-                f'getter is {"alive" if getter_process.is_alive() else "dead"}')
-            logger.info(
-                f'server is {"alive" if server_process.is_alive() else "dead"}')
+            self.stop(children)
+            for child in children:
+                logger.info(f'{child.role} is {"alive" if child.is_alive() else "dead"}, '
+                            f'restarted {child.restarts} times')
             logger.info('proxy terminated')
 
 
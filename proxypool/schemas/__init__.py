@@ -1 +1,2 @@
-from .proxy import Proxy
\ No newline at end of file
+from .proxy import Proxy
+from .meta import ProxyMeta
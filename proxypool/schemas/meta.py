@@ -0,0 +1,50 @@
+from attr import attrs, attr
+
+
+# separator of packed fields, never appears in crawler names, protocols or country codes
+SEPARATOR = '|'
+
+
+@attrs(slots=True)
+class ProxyMeta(object):
+    """
+    metadata of proxy, packed into one field of the metadata hash of pool
+    """
+    # name of crawler which found the proxy
+    source = attr(type=str, default='')
+    # timestamps in seconds
+    first_seen = attr(type=int, default=0)
+    last_checked = attr(type=int, default=0)
+    # counts of valid and invalid checks
+    success = attr(type=int, default=0)
+    fail = attr(type=int, default=0)
+    protocol = attr(type=str, default='')
+    # latency of last valid check in milliseconds
+    latency = attr(type=int, default=0)
+    country = attr(type=str, default='')
+    # autonomous system number
+    asn = attr(type=str, default='')
+
+    def pack(self):
+        """
+        pack to string, like Daili66Crawler|1700000000|1700000100|3|1|http|250|US|15169
+        :return: str
+        """
+        return SEPARATOR.join((self.source, str(self.first_seen), str(self.last_checked), str(self.success),
+                               str(self.fail), self.protocol, str(self.latency), self.country, self.asn))
+
+    @classmethod
+    def unpack(cls, value):
+        """
+        unpack from string, fields missing at the end keep their defaults
+        :param value: packed string
+        :return: ProxyMeta
+        """
+        fields = value.split(SEPARATOR)
+        meta = cls()
+        for (name, type_), field in zip(FIELDS, fields):
+            setattr(meta, name, type_(field) if field else type_())
+        return meta
+
+
+FIELDS = [(field.name, field.type) for field in ProxyMeta.__attrs_attrs__]
@@ -1,21 +1,25 @@
 from attr import attrs, attr
 
 
-@attrs
+@attrs(slots=True)
 class Proxy(object):
     """
     proxy schema
     """
     host = attr(type=str, default=None)
     port = attr(type=int, default=None)
-    
+
     def __str__(self):
         """
         to string, for print
         :return:
         """
+        # ipv6 host must be wrapped with brackets, like [::1]:8080
+        if self.host and ':' in self.host.rpartition('@')[2]:
+            auth, at, ip = self.host.rpartition('@')
+            return f'{auth}{at}[{ip}]:{self.port}'
         return f'{self.host}:{self.port}'
-    
+
     def string(self):
         """
         to string
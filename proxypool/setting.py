@@ -52,6 +52,19 @@ REDIS_CONNECTION_STRING = env.str(
 REDIS_KEY = env.str('PROXYPOOL_REDIS_KEY', env.str(
     'REDIS_KEY', 'proxies:universal'))
 
+# connection strings of redis nodes to shard universal pool over by hash of host:port,
+# like redis://10.0.0.1:6379/0,redis://10.0.0.2:6379/0, redis of above is used if not set
+REDIS_SHARDS = env.list('REDIS_SHARDS', [])
+
+# storage of proxies, redis or embedded, embedded keeps the pool in memory of one process,
+# getter, tester and server then run as threads of it, and snapshots it into sqlite database of EMBEDDED_PATH
+STORAGE_REDIS, STORAGE_EMBEDDED = 'redis', 'embedded'
+STORAGE = env.str('STORAGE', STORAGE_REDIS).lower()
+# set empty to keep embedded storage in memory only
+EMBEDDED_PATH = env.str('EMBEDDED_PATH', join(ROOT_DIR, 'data', 'proxypool.db'))
+# seconds between snapshots of embedded storage
+EMBEDDED_SNAPSHOT_INTERVAL = env.int('EMBEDDED_SNAPSHOT_INTERVAL', 60)
+
 # definition of proxy scores
 PROXY_SCORE_MAX = env.int('PROXY_SCORE_MAX', 100)
 PROXY_SCORE_MIN = env.int('PROXY_SCORE_MIN', 0)
@@ -60,14 +73,82 @@ PROXY_SCORE_INIT = env.int('PROXY_SCORE_INIT', 10)
 PROXY_RAND_KEY_DEGRADED = env.bool('TEST_ANONYMOUS', True)
 
 # definition of proxy number
-PROXY_NUMBER_MAX = 50000
+PROXY_NUMBER_MAX = env.int('PROXY_NUMBER_MAX', 50000)
 PROXY_NUMBER_MIN = 0
 
-# definition of tester cycle, it will test every CYCLE_TESTER second
+# definition of eviction policy once pool reaches PROXY_NUMBER_MAX
+# none: stop getting proxies, lowest_score: evict proxies of lowest score,
+# oldest_unverified: evict proxies never tested valid in order of age, lru: evict proxies least recently tested valid,
+# new proxies have init score below every verified one, so lowest_score mostly evicts proxies just added and untested
+EVICTION_POLICY_NONE = 'none'
+EVICTION_POLICY_LOWEST_SCORE = 'lowest_score'
+EVICTION_POLICY_OLDEST_UNVERIFIED = 'oldest_unverified'
+EVICTION_POLICY_LRU = 'lru'
+EVICTION_POLICY = env.str('EVICTION_POLICY', EVICTION_POLICY_NONE)
+# sorted set of eviction candidates of oldest_unverified and lru policy, scored by timestamp
+EVICTION_KEY = env.str('EVICTION_KEY', f'{REDIS_KEY}:eviction')
+
+# store metadata of proxies of universal pool, like source, timestamps, check counts and latency
+ENABLE_META = env.bool('ENABLE_META', True)
+# hash of metadata, one packed field per proxy
+META_KEY = env.str('META_KEY', f'{REDIS_KEY}:meta')
+
+# tag proxies with country and asn, proxies tested valid are indexed by country
+ENABLE_GEOIP = env.bool('ENABLE_GEOIP', True)
+# path of maxmind country or city database, GeoLite2 City packaged by maxminddb_geolite2 if not set
+GEOIP_DB = env.str('GEOIP_DB', None)
+# path of maxmind asn database, asn is not tagged if not set
+GEOIP_ASN_DB = env.str('GEOIP_ASN_DB', None)
+# number of recent lookups cached
+GEOIP_CACHE_SIZE = env.int('GEOIP_CACHE_SIZE', 65536)
+
+# definition of tester cycle, it will test every CYCLE_TESTER second at most,
+# and every CYCLE_TESTER_MIN second while getter ingests new proxies or untested proxies are left
 CYCLE_TESTER = env.int('CYCLE_TESTER', 20)
-# definition of getter cycle, it will get proxy every CYCLE_GETTER second
+CYCLE_TESTER_MIN = env.int('CYCLE_TESTER_MIN', 5)
+# definition of getter cycle, it will get proxy every CYCLE_GETTER_MIN second if pool is empty,
+# up to every CYCLE_GETTER second as pool fills
 CYCLE_GETTER = env.int('CYCLE_GETTER', 100)
+CYCLE_GETTER_MIN = env.int('CYCLE_GETTER_MIN', 30)
+# channel of events of getter ingesting new proxies
+EVENTS_CHANNEL = env.str('EVENTS_CHANNEL', f'{REDIS_KEY}:events')
+# queue new proxies in a redis stream, tester workers of a consumer group test them as they are ingested,
+# and full sweeps only run every CYCLE_TESTER second, needs redis 6.2 or later
+ENABLE_INGEST_STREAM = env.bool('ENABLE_INGEST_STREAM', False)
+INGEST_STREAM_KEY = env.str('INGEST_STREAM_KEY', f'{REDIS_KEY}:ingest')
+INGEST_STREAM_GROUP = env.str('INGEST_STREAM_GROUP', 'tester')
+INGEST_STREAM_MAXLEN = env.int('INGEST_STREAM_MAXLEN', 100000)
+# entries not acked for this many seconds, like those of a crashed tester, are claimed by other testers
+# with XAUTOCLAIM, which needs redis 6.2 or later
+INGEST_CLAIM_IDLE = env.int('INGEST_CLAIM_IDLE', 120)
 GET_TIMEOUT = env.int('GET_TIMEOUT', 10)
+# failed fetches of crawlers are retried FETCH_RETRIES times after exponential backoff with full jitter,
+# from FETCH_BACKOFF_BASE seconds up to FETCH_BACKOFF_MAX seconds
+FETCH_RETRIES = env.int('FETCH_RETRIES', 2)
+FETCH_BACKOFF_BASE = env.float('FETCH_BACKOFF_BASE', .5)
+FETCH_BACKOFF_MAX = env.float('FETCH_BACKOFF_MAX', 8)
+# host failing FETCH_BREAKER_THRESHOLD fetches in a row is skipped for the rest of the getter cycle
+FETCH_BREAKER_THRESHOLD = env.int('FETCH_BREAKER_THRESHOLD', 3)
+# seconds between requests of crawlers to the same host at least
+CRAWL_DELAY = env.float('CRAWL_DELAY', .5)
+# header sets generated by fake_headers once per getter process and rotated over requests of crawlers
+HEADER_POOL_SIZE = env.int('HEADER_POOL_SIZE', 64)
+# send conditional requests with etag and last-modified of last fetch,
+# pages not modified since last fetch are neither parsed nor ingested
+ENABLE_FETCH_CACHE = env.bool('ENABLE_FETCH_CACHE', True)
+# seconds after which a cached page is fetched and ingested unconditionally again
+FETCH_CACHE_MAX_AGE = env.int('FETCH_CACHE_MAX_AGE', 3600)
+# stop crawling pages of a paginated source once a page contributes no proxy new to pool
+ENABLE_INCREMENTAL_CRAWL = env.bool('ENABLE_INCREMENTAL_CRAWL', True)
+# processes to parse crawled pages in, so parsing runs off the fetch path, 0 to parse in getter process
+PARSER_POOL_SIZE = env.int('PARSER_POOL_SIZE', 2)
+# crawlers run concurrently in threads and push proxies into a bounded queue,
+# which is drained into redis in batched pipelines
+GETTER_WORKERS = env.int('GETTER_WORKERS', 4)
+INGEST_QUEUE_SIZE = env.int('INGEST_QUEUE_SIZE', 2000)
+INGEST_BATCH_SIZE = env.int('INGEST_BATCH_SIZE', 200)
+# crawlers are paused while a batch write takes longer than this, in seconds
+INGEST_SLOW_SECONDS = env.float('INGEST_SLOW_SECONDS', 0.5)
 
 # definition of tester
 TEST_URL = env.str('TEST_URL', 'http://www.baidu.com')
@@ -75,12 +156,22 @@ TEST_TIMEOUT = env.int('TEST_TIMEOUT', 10)
 TEST_BATCH = env.int('TEST_BATCH', 20)
 # only save anonymous proxy
 TEST_ANONYMOUS = env.bool('TEST_ANONYMOUS', True)
+# url used to check anonymous, must return json like {"origin": "<ip>"} as httpbin does
+TEST_ANONYMOUS_URL = env.str('TEST_ANONYMOUS_URL', 'https://httpbin.org/ip')
 # TEST_HEADERS = env.json('TEST_HEADERS', {
 #     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/54.0.2840.71 Safari/537.36',
 # })
 TEST_VALID_STATUS = env.list('TEST_VALID_STATUS', [200, 206, 302])
 # whether to set max score when one proxy is tested valid
 TEST_DONT_SET_MAX_SCORE = env.bool('TEST_DONT_SET_MAX_SCORE', False)
+# protocols probed by handshake besides http in the same pass, https means CONNECT tunnel, like https,socks4,socks5,
+# supported ones are recorded in metadata and indexes by protocol, score follows the http check alone
+TEST_PROTOCOLS = [protocol.lower() for protocol in env.list('TEST_PROTOCOLS', [])]
+# verdicts of tests are cached for TEST_CACHE_TTL seconds by host:port and test target, shared by testers,
+# so a proxy tested again meanwhile, like one re-added by getter, reuses the verdict instead, which only moves its score
+# back to the one the verdict left, 0 to disable
+TEST_CACHE_TTL = env.int('TEST_CACHE_TTL', 15)
+TEST_CACHE_KEY = env.str('TEST_CACHE_KEY', f'{REDIS_KEY}:verdict')
 
 # definition of api
 API_HOST = env.str('API_HOST', '0.0.0.0')
@@ -90,12 +181,41 @@ API_THREADED = env.bool('API_THREADED', True)
 # need a header of `API-KEY` in get request to pass the authenticate
 # API_KEY='', do not need `API-KEY` header
 API_KEY = env.str('API_KEY', '')
+# proxies handed out by `/lease` are leased for ttl seconds, LEASE_TTL by default and LEASE_TTL_MAX at most,
+# leases of a pool are kept in a sorted set of LEASE_KEY:<key of pool> by expiry
+LEASE_KEY = env.str('LEASE_KEY', f'{REDIS_KEY}:lease')
+LEASE_TTL = env.int('LEASE_TTL', 60)
+LEASE_TTL_MAX = env.int('LEASE_TTL_MAX', 3600)
 
 # flags of enable
 ENABLE_TESTER = env.bool('ENABLE_TESTER', True)
 ENABLE_GETTER = env.bool('ENABLE_GETTER', True)
 ENABLE_SERVER = env.bool('ENABLE_SERVER', True)
 
+# tester, getter and server beat into a redis hash every HEARTBEAT_INTERVAL second, exposed by `/health`,
+# one not beating for HEARTBEAT_TIMEOUT seconds is dead and restarted by scheduler
+HEARTBEAT_KEY = env.str('HEARTBEAT_KEY', f'{REDIS_KEY}:heartbeats')
+HEARTBEAT_INTERVAL = env.int('HEARTBEAT_INTERVAL', 5)
+HEARTBEAT_TIMEOUT = env.int('HEARTBEAT_TIMEOUT', 60)
+# heartbeats come from a background thread, so loops of tester and getter report progress as they go,
+# one cycling without progress or overdue for its next cycle for PROGRESS_TIMEOUT seconds is hung and restarted
+PROGRESS_TIMEOUT = env.int('PROGRESS_TIMEOUT', 300)
+# crashed processes are restarted after SUPERVISOR_BACKOFF_MIN seconds, doubled on every crash up to
+# SUPERVISOR_BACKOFF_MAX seconds, and reset once a process runs longer than SUPERVISOR_BACKOFF_MAX seconds
+SUPERVISOR_BACKOFF_MIN = env.float('SUPERVISOR_BACKOFF_MIN', 1)
+SUPERVISOR_BACKOFF_MAX = env.float('SUPERVISOR_BACKOFF_MAX', 60)
+# import modules of enabled processors and open geoip databases in scheduler before forking them,
+# so their pages are shared copy-on-write instead of loaded by every process, only if processes are forked
+ENABLE_PRELOAD = env.bool('ENABLE_PRELOAD', True)
+# seconds to wait on shutdown for in-flight test batches and ingest pipelines to finish before killing processes
+SHUTDOWN_TIMEOUT = env.int('SHUTDOWN_TIMEOUT', 30)
+
+# metrics of all processes are aggregated in a redis hash, and exposed by `/metrics`
+ENABLE_METRICS = env.bool('ENABLE_METRICS', True)
+METRICS_KEY = env.str('METRICS_KEY', f'{REDIS_KEY}:metrics')
+# seconds between flushes of metrics of one process into redis
+METRICS_FLUSH_INTERVAL = env.int('METRICS_FLUSH_INTERVAL', 5)
+
 
 ENABLE_LOG_FILE = env.bool('ENABLE_LOG_FILE', True)
 ENABLE_LOG_RUNTIME_FILE = env.bool('ENABLE_LOG_RUNTIME_FILE', True)
@@ -111,13 +231,20 @@ LOG_LEVEL_MAP = {
 LOG_LEVEL = LOG_LEVEL_MAP.get(APP_ENV)
 LOG_ROTATION = env.str('LOG_ROTATION', '500MB')
 LOG_RETENTION = env.str('LOG_RETENTION', '1 week')
+# write log files in a background thread, so event loop of tester never blocks on file io
+LOG_ENQUEUE = env.bool('LOG_ENQUEUE', True)
+# write log files as json lines
+LOG_SERIALIZE = env.bool('LOG_SERIALIZE', False)
+# log every fetched, tested and scored proxy, otherwise only summaries of every page, batch and cycle are logged
+LOG_PER_PROXY = env.bool('LOG_PER_PROXY', False)
 
 if ENABLE_LOG_FILE:
     if ENABLE_LOG_RUNTIME_FILE:
         logger.add(env.str('LOG_RUNTIME_FILE', join(LOG_DIR, 'runtime.log')),
-                   level=LOG_LEVEL, rotation=LOG_ROTATION, retention=LOG_RETENTION)
+                   level=LOG_LEVEL, rotation=LOG_ROTATION, retention=LOG_RETENTION,
+                   enqueue=LOG_ENQUEUE, serialize=LOG_SERIALIZE)
     if ENABLE_LOG_ERROR_FILE:
         logger.add(env.str('LOG_ERROR_FILE', join(LOG_DIR, 'error.log')),
-                   level='ERROR', rotation=LOG_ROTATION)
+                   level='ERROR', rotation=LOG_ROTATION, enqueue=LOG_ENQUEUE, serialize=LOG_SERIALIZE)
 else:
     shutil.rmtree(LOG_DIR, ignore_errors=True)
@@ -0,0 +1,23 @@
+from proxypool.setting import REDIS_SHARDS, STORAGE, STORAGE_EMBEDDED
+
+# embedded storage is shared by getter, tester and server threads of the process
+_embedded = None
+
+
+def create_client(**kwargs):
+    """
+    create storage client of settings, embedded storage if STORAGE is embedded,
+    else redis client, sharded over REDIS_SHARDS if set
+    :return: storage implementing BaseStorage, IngestStream, VerdictCache, ProcessStatus and MetricsStore
+    """
+    global _embedded
+    if STORAGE == STORAGE_EMBEDDED:
+        if _embedded is None:
+            from proxypool.storages.embedded import EmbeddedClient
+            _embedded = EmbeddedClient(**kwargs)
+        return _embedded
+    if REDIS_SHARDS:
+        from proxypool.storages.sharded import ShardedRedisClient
+        return ShardedRedisClient(**kwargs)
+    from proxypool.storages.redis import RedisClient
+    return RedisClient(**kwargs)
@@ -0,0 +1,386 @@
+import time
+from abc import ABC, abstractmethod
+from random import shuffle
+from typing import List, Optional
+from proxypool.schemas.proxy import Proxy
+from proxypool.schemas.meta import ProxyMeta
+from proxypool.setting import REDIS_KEY, PROXY_SCORE_MAX, PROXY_SCORE_MIN, PROXY_SCORE_INIT, EVICTION_POLICY, \
+    EVICTION_POLICY_OLDEST_UNVERIFIED, EVICTION_POLICY_LRU, LEASE_KEY
+from proxypool.utils.proxy import convert_proxy_or_proxies
+from proxypool.utils.geoip import lookup_host
+
+# eviction policies which track timestamps of proxies in EVICTION_KEY
+TRACKED_EVICTION_POLICIES = (EVICTION_POLICY_OLDEST_UNVERIFIED, EVICTION_POLICY_LRU)
+
+# proxies of a page read by a lease, pages are read in order of score until an unleased proxy is found
+LEASE_RANKED = 100
+
+
+def country_key(country):
+    """
+    key of set of proxies of country tested valid
+    """
+    return f'{REDIS_KEY}:country:{country}'
+
+
+def protocol_key(protocol):
+    """
+    key of set of proxies supporting protocol, like https
+    """
+    return f'{REDIS_KEY}:protocol:{protocol}'
+
+
+def lease_key(redis_key=REDIS_KEY):
+    """
+    key of sorted set of proxies of pool leased by `/lease`, scored by expiry of lease
+    """
+    return f'{LEASE_KEY}:{redis_key}'
+
+
+def index_keys(meta: ProxyMeta) -> List[str]:
+    """
+    keys of sets indexing proxy by its metadata, proxy is in them as long as its last check is valid
+    """
+    keys = [country_key(meta.country)] if meta.country else []
+    return keys + [protocol_key(protocol) for protocol in meta.protocol.split(',') if protocol]
+
+
+def new_meta(proxy: Proxy, source='', now=None) -> ProxyMeta:
+    """
+    metadata of proxy seen for the first time, tagged with country and asn
+    """
+    country, asn = lookup_host(proxy.host) if proxy else ('', '')
+    return ProxyMeta(source=source, first_seen=now or int(time.time()), country=country, asn=asn)
+
+
+def apply_checks(checks, values, scores):
+    """
+    apply results of a batch of checks to metadata, shared by storages
+    :param checks: dict of proxy string to (valid, latency in ms, supported protocols joined by comma),
+        valid is the result of http check
+    :param values: packed metadata of checked proxies, None if missing
+    :param scores: scores of checked proxies in universal pool, None if removed meanwhile
+    :return: packed metadata to set, proxies whose metadata to delete,
+        (key, proxy) to remove from indexes and (key, proxy) to add to indexes
+    """
+    now = int(time.time())
+    mapping, removed, stale, fresh = {}, [], [], []
+    for member, value, score in zip(checks, values, scores):
+        meta = ProxyMeta.unpack(value) if value else None
+        if score is None:
+            if meta:
+                removed.append(member)
+                stale += [(key, member) for key in index_keys(meta)]
+            continue
+        if not meta:
+            meta = new_meta(convert_proxy_or_proxies(member), now=now)
+        old_keys = set(index_keys(meta))
+        valid, latency, protocol = checks[member]
+        meta.last_checked = now
+        meta.protocol = protocol
+        if valid:
+            meta.success += 1
+            meta.latency = latency
+        else:
+            meta.fail += 1
+        # proxy leaves indexes of protocols it no longer supports, and index of its country when invalid,
+        # protocols probed by handshake are indexed even if http check failed
+        keys = set(index_keys(meta)) if valid else {protocol_key(name) for name in protocol.split(',') if name}
+        stale += [(key, member) for key in old_keys - keys]
+        fresh += [(key, member) for key in keys]
+        mapping[member] = meta.pack()
+    return mapping, removed, stale, fresh
+
+
+def lease_candidates(page, expiries, now):
+    """
+    order candidates of a lease among a page of proxies, shared by storages
+    :param page: list of (proxy string, score) in order of score
+    :param expiries: expiry of lease of every proxy of page, None if not leased
+    :param now: leases expired by now are free
+    :return: unleased proxies, shuffled among those of the same score, and the leased one whose lease expires first,
+        None if no proxy of page is leased
+    """
+    tiers, leased = {}, []
+    for (member, score), expiry in zip(page, expiries):
+        if expiry is None or expiry <= now:
+            tiers.setdefault(score, []).append(member)
+        else:
+            leased.append((expiry, member))
+    unleased = []
+    for score in sorted(tiers, reverse=True):
+        shuffle(tiers[score])
+        unleased += tiers[score]
+    return unleased, min(leased)[1] if leased else None
+
+
+class BaseStorage(ABC):
+    """
+    base storage of proxypool, the universal pool and sub-pools of testers are sorted by score,
+    implemented by RedisClient and EmbeddedClient along with IngestStream, VerdictCache, ProcessStatus and MetricsStore,
+    a storage missing any method fails on instantiation
+    """
+
+    @abstractmethod
+    def add(self, proxy: Proxy, score=PROXY_SCORE_INIT, redis_key=REDIS_KEY) -> int:
+        """
+        add proxy and set it to init score
+        """
+
+    @abstractmethod
+    def add_many(self, proxies: List[Proxy], score=PROXY_SCORE_INIT, redis_key=REDIS_KEY, sources=None,
+                 enqueue=False) -> int:
+        """
+        add proxies which don't exist yet and set them to init score
+        :param enqueue: append added proxies to ingest stream
+        :return: number of added proxies
+        """
+
+    @abstractmethod
+    def random(self, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN, proxy_score_max=PROXY_SCORE_MAX) -> Proxy:
+        """
+        get random proxy, proxies with max score first, raise PoolEmptyException if there is none
+        """
+
+    @abstractmethod
+    def decrease(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN) -> int:
+        """
+        decrease score of proxy, if small than PROXY_SCORE_MIN, delete it
+        :return: new score
+        """
+
+    @abstractmethod
+    def exists(self, proxy: Proxy, redis_key=REDIS_KEY) -> bool:
+        """
+        if proxy exists
+        """
+
+    @abstractmethod
+    def max(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_max=PROXY_SCORE_MAX) -> int:
+        """
+        set proxy to max score
+        """
+
+    @abstractmethod
+    def increase(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_max=PROXY_SCORE_MAX) -> Optional[float]:
+        """
+        increase score of proxy by 1 up to proxy_score_max, higher scores are kept, proxies not in pool are not added
+        :return: new score, None if proxy is not in pool
+        """
+
+    @abstractmethod
+    def evict(self, count, policy=EVICTION_POLICY, redis_key=REDIS_KEY) -> List[Proxy]:
+        """
+        evict proxies in bulk to make room for new ones
+        :return: list of evicted proxies
+        """
+
+    @abstractmethod
+    def remove(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> int:
+        """
+        remove proxies, like evicted ones from sub-pools of testers
+        :return: number of removed proxies
+        """
+
+    @abstractmethod
+    def exists_many(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> List[bool]:
+        """
+        if proxies exist
+        """
+
+    @abstractmethod
+    def scores(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> List[Optional[float]]:
+        """
+        get scores of proxies, None if proxy is not in redis_key
+        """
+
+    @abstractmethod
+    def metas(self, proxies: List[Proxy]) -> List[ProxyMeta]:
+        """
+        get metadata of proxies of universal pool, None if proxy has no metadata
+        """
+
+    @abstractmethod
+    def update_metas(self, checks):
+        """
+        update metadata and indexes with results of a batch of checks, see apply_checks
+        """
+
+    @abstractmethod
+    def random_in_index(self, key) -> Proxy:
+        """
+        get random proxy of index, like country_key('US')
+        """
+
+    @abstractmethod
+    def random_by_meta(self, condition, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN,
+                       proxy_score_max=PROXY_SCORE_MAX, sample=100) -> Proxy:
+        """
+        get random proxy whose metadata matches condition
+        """
+
+    @abstractmethod
+    def count(self, redis_key=REDIS_KEY) -> int:
+        """
+        get count of proxies
+        """
+
+    @abstractmethod
+    def lease(self, ttl, redis_key=REDIS_KEY):
+        """
+        lease proxy for ttl seconds, pages of LEASE_RANKED proxies are read in order of score until one has an unleased
+        proxy, those of the highest score first, a proxy is only shared once every proxy of the pool is leased,
+        the one of the top page whose lease expires first
+        :return: proxy, and if it's shared with another lease, raise PoolEmptyException if there is none
+        """
+
+    @abstractmethod
+    def release(self, proxy: Proxy, redis_key=REDIS_KEY) -> bool:
+        """
+        release lease of proxy before it expires
+        :return: if proxy was leased
+        """
+
+    @abstractmethod
+    def count_leased(self, redis_key=REDIS_KEY) -> int:
+        """
+        get count of proxies leased and not expired
+        """
+
+    @abstractmethod
+    def count_bands(self, bands, redis_key=REDIS_KEY) -> List[int]:
+        """
+        get count of proxies of every score band, bounds are like redis zcount, `(` for exclusive
+        """
+
+    @abstractmethod
+    def ranked(self, offset, limit, reverse=True, redis_key=REDIS_KEY):
+        """
+        get list of (proxy string, score) ordered by score, limit -1 for all
+        """
+
+    @abstractmethod
+    def all(self, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN, proxy_score_max=PROXY_SCORE_MAX) -> List[Proxy]:
+        """
+        get proxies of score between proxy_score_min and proxy_score_max
+        """
+
+    @abstractmethod
+    def batch(self, cursor, count, redis_key=REDIS_KEY):
+        """
+        get batch of proxies, start with cursor 0
+        :return: next cursor, 0 when all are scanned, and list of proxies
+        """
+
+
+class IngestStream(ABC):
+    """
+    events and stream of proxies ingested by getter, consumed by testers
+    """
+
+    @abstractmethod
+    def notify_ingested(self, count):
+        """
+        publish event of proxies ingested by getter
+        """
+
+    @abstractmethod
+    def wait_ingested(self, timeout):
+        """
+        wait for events of ingested proxies, events published since last call are collected as well
+        :param timeout: seconds to wait at most, 0 to collect published events only
+        :return: number of ingested proxies
+        """
+
+    @abstractmethod
+    def enqueue_ingested(self, members):
+        """
+        append proxies to ingest stream
+        :param members: list of proxy string
+        """
+
+    @abstractmethod
+    def claim_ingested(self, consumer, count, block=0):
+        """
+        claim entries of ingest stream for consumer, entries not acked for INGEST_CLAIM_IDLE seconds first,
+        so entries of crashed consumers are delivered again, then new ones
+        :param consumer: name of consumer
+        :param count: max number of entries
+        :param block: seconds to wait for new entries
+        :return: list of (entry id, proxy string)
+        """
+
+    @abstractmethod
+    def ack_ingested(self, ids):
+        """
+        ack entries of ingest stream tested by consumer
+        """
+
+
+class VerdictCache(ABC):
+    """
+    verdicts of tests cached for TEST_CACHE_TTL seconds, shared by testers
+    """
+
+    @abstractmethod
+    def verdicts(self, keys):
+        """
+        get cached verdicts of tests
+        :param keys: list of key of proxy and test target
+        :return: list of verdict, None if not cached or expired
+        """
+
+    @abstractmethod
+    def cache_verdicts(self, verdicts, ttl):
+        """
+        cache verdicts of tests
+        :param verdicts: dict of key of proxy and test target to verdict
+        :param ttl: seconds verdicts expire in
+        """
+
+
+class ProcessStatus(ABC):
+    """
+    heartbeats of processes and names of loaded crawlers, read by scheduler and /health
+    """
+
+    @abstractmethod
+    def beat(self, role, status):
+        """
+        write heartbeat of process
+        :param role: tester, getter or server
+        :param status: dict of status, see Heartbeat
+        """
+
+    @abstractmethod
+    def heartbeats(self):
+        """
+        get last heartbeats
+        :return: dict of role to status
+        """
+
+    @abstractmethod
+    def set_crawlers(self, names):
+        """
+        replace names of loaded crawlers
+        """
+
+
+class MetricsStore(ABC):
+    """
+    metrics aggregated from every process
+    """
+
+    @abstractmethod
+    def flush_metrics(self, key, values):
+        """
+        add deltas of metrics into hash of key
+        :param values: dict of sample to delta
+        """
+
+    @abstractmethod
+    def read_metrics(self, key):
+        """
+        get aggregated metrics
+        :return: dict of sample to value
+        """
@@ -0,0 +1,636 @@
+import atexit
+import functools
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from bisect import bisect_left, insort
+from random import choice, randrange, sample as random_sample
+from typing import List, Optional
+from loguru import logger
+from proxypool.exceptions import PoolEmptyException
+from proxypool.schemas.proxy import Proxy
+from proxypool.schemas.meta import ProxyMeta
+from proxypool.setting import REDIS_KEY, PROXY_SCORE_MAX, PROXY_SCORE_MIN, PROXY_SCORE_INIT, LOG_PER_PROXY, \
+    EVICTION_POLICY, EVICTION_POLICY_LRU, EVICTION_KEY, ENABLE_META, META_KEY, EMBEDDED_PATH, \
+    EMBEDDED_SNAPSHOT_INTERVAL, INGEST_STREAM_MAXLEN, INGEST_CLAIM_IDLE, HEARTBEAT_KEY
+from proxypool.storages.base import BaseStorage, IngestStream, VerdictCache, ProcessStatus, MetricsStore, \
+    TRACKED_EVICTION_POLICIES, index_keys, new_meta, apply_checks, lease_key, lease_candidates, LEASE_RANKED
+from proxypool.utils.proxy import is_valid_proxy, convert_proxy_or_proxies
+
+# scans of batch kept at the same time, older ones abandoned halfway are dropped
+MAX_SCANS = 8
+
+
+class _Top(object):
+    """
+    compares greater than any member, to bisect after all members of a score
+    """
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+TOP = _Top()
+
+
+def parse_bound(value):
+    """
+    parse score bound like redis, `(` prefix for exclusive, -inf and +inf
+    :return: score, exclusive
+    """
+    if isinstance(value, str):
+        return float(value.lstrip('(')), value.startswith('(')
+    return float(value), False
+
+
+def locked(func):
+    """
+    run method of storage holding its lock, getter, tester and server share it in threads
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+class SortedSet(object):
+    """
+    sorted set like redis, members are kept in a list sorted by (score, member)
+    """
+
+    def __init__(self):
+        self.scores = {}
+        self.items = []
+
+    def __len__(self):
+        return len(self.scores)
+
+    def score(self, member):
+        return self.scores.get(member)
+
+    def add(self, member, score, nx=False):
+        """
+        add member or update its score
+        :param nx: only add new member
+        :return: 1 if member is new
+        """
+        old = self.scores.get(member)
+        if old is not None:
+            if nx or old == score:
+                return 0
+            del self.items[bisect_left(self.items, (old, member))]
+        self.scores[member] = score
+        insort(self.items, (score, member))
+        return int(old is None)
+
+    def incr(self, member, amount):
+        score = self.scores.get(member, 0) + amount
+        self.add(member, score)
+        return score
+
+    def remove(self, member):
+        score = self.scores.pop(member, None)
+        if score is None:
+            return 0
+        del self.items[bisect_left(self.items, (score, member))]
+        return 1
+
+    def range(self, start, stop, reverse=False):
+        """
+        members and scores by rank like zrange, stop is inclusive, negative index counts from the end
+        :return: list of (member, score)
+        """
+        size = len(self.items)
+        start = max(start + size if start < 0 else start, 0)
+        stop = min(stop + size if stop < 0 else stop, size - 1)
+        if start > stop:
+            return []
+        if reverse:
+            return [(member, score) for score, member in reversed(self.items[size - 1 - stop:size - start])]
+        return [(member, score) for score, member in self.items[start:stop + 1]]
+
+    def bounds(self, score_min, score_max):
+        """
+        slice of items with score between bounds
+        :return: start, stop
+        """
+        low, low_exclusive = parse_bound(score_min)
+        high, high_exclusive = parse_bound(score_max)
+        start = bisect_left(self.items, (low, TOP) if low_exclusive else (low,))
+        stop = bisect_left(self.items, (high,) if high_exclusive else (high, TOP))
+        return start, max(start, stop)
+
+    def count(self, score_min, score_max):
+        start, stop = self.bounds(score_min, score_max)
+        return stop - start
+
+    def range_by_score(self, score_min, score_max):
+        start, stop = self.bounds(score_min, score_max)
+        return [member for _, member in self.items[start:stop]]
+
+    def choice(self, score_min, score_max):
+        """
+        random member with score between bounds, None if there is none
+        """
+        start, stop = self.bounds(score_min, score_max)
+        return self.items[randrange(start, stop)][1] if stop > start else None
+
+
+class RandomSet(object):
+    """
+    set with random choice in constant time, members are kept in a list and their positions in a dict
+    """
+
+    def __init__(self, members=()):
+        self.members = []
+        self.positions = {}
+        for member in members:
+            self.add(member)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def add(self, member):
+        if member not in self.positions:
+            self.positions[member] = len(self.members)
+            self.members.append(member)
+
+    def discard(self, member):
+        position = self.positions.pop(member, None)
+        if position is None:
+            return
+        last = self.members.pop()
+        if position < len(self.members):
+            self.members[position] = last
+            self.positions[last] = position
+
+    def choice(self):
+        return choice(self.members) if self.members else None
+
+
+class EmbeddedClient(BaseStorage, IngestStream, VerdictCache, ProcessStatus, MetricsStore):
+    """
+    embedded storage of one process, sorted sets, hashes and sets of the same keys as redis are kept in memory
+    and snapshot into a sqlite database periodically, getter, tester and server share it as threads
+    """
+
+    def __init__(self, path=EMBEDDED_PATH, interval=EMBEDDED_SNAPSHOT_INTERVAL):
+        """
+        init embedded storage, load last snapshot and start snapshotting
+        :param path: path of sqlite database, in memory only if empty
+        :param interval: seconds between snapshots
+        """
+        self.path = path
+        self.interval = interval
+        self.lock = threading.RLock()
+        self.zsets, self.hashes, self.sets = {}, {}, {}
+        self.scans, self.scan_ids = {}, itertools.count(1)
+        # number of proxies ingested since last wait_ingested
+        self.ingested, self.event = 0, threading.Condition(self.lock)
+        # ingest stream of entry id to proxy, and pending entries of id to (proxy, consumer, delivered at),
+        # consumers are threads of one process, so the stream is not snapshotted
+        self.stream, self.pending, self.entry_ids = OrderedDict(), OrderedDict(), itertools.count(1)
+        # cached verdicts of tests, key to (verdict, expires at), ordered by expiry as all share one ttl,
+        # not snapshotted as they expire in seconds
+        self.verdict_cache = OrderedDict()
+        if path:
+            self.load()
+            threading.Thread(target=self.snapshot_forever, daemon=True).start()
+            atexit.register(self.snapshot)
+
+    def connect(self):
+        """
+        connect to snapshot database in wal mode, so snapshots don't block readers of it
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS zsets (key TEXT, member TEXT, score REAL)')
+        db.execute('CREATE TABLE IF NOT EXISTS hashes (key TEXT, field TEXT, value TEXT)')
+        db.execute('CREATE TABLE IF NOT EXISTS sets (key TEXT, member TEXT)')
+        return db
+
+    @locked
+    def load(self):
+        """
+        load last snapshot
+        """
+        db = self.connect()
+        try:
+            for key, member, score in db.execute('SELECT key, member, score FROM zsets ORDER BY key, score, member'):
+                zset = self.zset(key)
+                zset.scores[member] = score
+                zset.items.append((score, member))
+            for key, field, value in db.execute('SELECT key, field, value FROM hashes'):
+                self.hash(key)[field] = value
+            for key, member in db.execute('SELECT key, member FROM sets'):
+                self.set(key).add(member)
+        finally:
+            db.close()
+        logger.info('loaded {} proxies from {}', len(self.zset(REDIS_KEY)), self.path)
+
+    def snapshot(self):
+        """
+        write all data into snapshot database in one transaction, data is copied holding the lock
+        and written without it
+        """
+        with self.lock:
+            zsets = [(key, member, score) for key, zset in self.zsets.items() for member, score in zset.scores.items()]
+            hashes = [(key, field, value) for key, fields in self.hashes.items() for field, value in fields.items()]
+            sets = [(key, member) for key, members in self.sets.items() for member in members]
+        start = time.perf_counter()
+        db = self.connect()
+        try:
+            with db:
+                for table in ('zsets', 'hashes', 'sets'):
+                    db.execute(f'DELETE FROM {table}')
+                db.executemany('INSERT INTO zsets VALUES (?, ?, ?)', zsets)
+                db.executemany('INSERT INTO hashes VALUES (?, ?, ?)', hashes)
+                db.executemany('INSERT INTO sets VALUES (?, ?)', sets)
+        finally:
+            db.close()
+        logger.debug('snapshot {} members into {} in {:.3f}s', len(zsets), self.path, time.perf_counter() - start)
+
+    def snapshot_forever(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.snapshot()
+            except sqlite3.Error:
+                logger.exception('failed to snapshot embedded storage')
+
+    @locked
+    def clear(self):
+        """
+        delete all data, like flushdb of redis
+        """
+        self.zsets, self.hashes, self.sets, self.scans = {}, {}, {}, {}
+        self.stream, self.pending, self.verdict_cache = OrderedDict(), OrderedDict(), OrderedDict()
+
+    def zset(self, key) -> SortedSet:
+        return self.zsets.setdefault(key, SortedSet())
+
+    def hash(self, key) -> dict:
+        return self.hashes.setdefault(key, {})
+
+    def set(self, key) -> RandomSet:
+        return self.sets.setdefault(key, RandomSet())
+
+    @staticmethod
+    def is_tracked(redis_key):
+        """
+        if timestamps of proxies of redis_key are tracked for eviction, only the universal pool is capped
+        """
+        return EVICTION_POLICY in TRACKED_EVICTION_POLICIES and redis_key == REDIS_KEY
+
+    def discard(self, members):
+        """
+        delete metadata of removed proxies and remove them from indexes
+        """
+        metas = self.hash(META_KEY)
+        for member in members:
+            value = metas.pop(member, None)
+            for key in index_keys(ProxyMeta.unpack(value)) if value else []:
+                self.set(key).discard(member)
+
+    @locked
+    def add(self, proxy: Proxy, score=PROXY_SCORE_INIT, redis_key=REDIS_KEY) -> int:
+        if not is_valid_proxy(proxy.string()):
+            if LOG_PER_PROXY:
+                logger.debug('invalid proxy {}, throw it', proxy)
+            return 0
+        added = self.zset(redis_key).add(proxy.string(), score, nx=True)
+        if added and self.is_tracked(redis_key):
+            self.zset(EVICTION_KEY).add(proxy.string(), time.time(), nx=True)
+        return added
+
+    @locked
+    def add_many(self, proxies: List[Proxy], score=PROXY_SCORE_INIT, redis_key=REDIS_KEY, sources=None,
+                 enqueue=False) -> int:
+        sources = sources or [''] * len(proxies)
+        zset, metas = self.zset(redis_key), self.hash(META_KEY)
+        is_meta = ENABLE_META and redis_key == REDIS_KEY
+        now = int(time.time())
+        added = []
+        for proxy, source in zip(proxies, sources):
+            member = proxy.string()
+            if not is_valid_proxy(member) or not zset.add(member, score, nx=True):
+                continue
+            added.append(member)
+            if self.is_tracked(redis_key):
+                self.zset(EVICTION_KEY).add(member, now, nx=True)
+            if is_meta and member not in metas:
+                metas[member] = new_meta(proxy, source, now).pack()
+        if enqueue:
+            self.enqueue_ingested(added)
+        return len(added)
+
+    @locked
+    def random(self, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN, proxy_score_max=PROXY_SCORE_MAX) -> Proxy:
+        """
+        get random proxy like RedisClient, proxies with max score first, else by rank
+        """
+        zset = self.zset(redis_key)
+        member = zset.choice(proxy_score_max, proxy_score_max)
+        if member is None:
+            members = zset.range(proxy_score_min, proxy_score_max, reverse=True)
+            member = choice(members)[0] if members else None
+        if member is None:
+            raise PoolEmptyException
+        return convert_proxy_or_proxies(member)
+
+    @locked
+    def decrease(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN) -> int:
+        zset = self.zset(redis_key)
+        score = zset.incr(proxy.string(), -1)
+        if LOG_PER_PROXY:
+            logger.debug('{} score decrease 1, current {}', proxy, score)
+        if score <= proxy_score_min:
+            if LOG_PER_PROXY:
+                logger.debug('{} current score {}, remove', proxy, score)
+            zset.remove(proxy.string())
+            self.zset(lease_key(redis_key)).remove(proxy.string())
+            if self.is_tracked(redis_key):
+                self.zset(EVICTION_KEY).remove(proxy.string())
+            # removed proxy is never tested again, so its metadata and indexes are cleaned right away
+            if ENABLE_META and redis_key == REDIS_KEY:
+                self.discard([proxy.string()])
+        return score
+
+    @locked
+    def exists(self, proxy: Proxy, redis_key=REDIS_KEY) -> bool:
+        return self.zset(redis_key).score(proxy.string()) is not None
+
+    @locked
+    def max(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_max=PROXY_SCORE_MAX) -> int:
+        if LOG_PER_PROXY:
+            logger.debug('{} is valid, set to {}', proxy, proxy_score_max)
+        if self.is_tracked(redis_key):
+            if EVICTION_POLICY == EVICTION_POLICY_LRU:
+                self.zset(EVICTION_KEY).add(proxy.string(), time.time())
+            else:
+                # verified proxies are no candidates of oldest_unverified
+                self.zset(EVICTION_KEY).remove(proxy.string())
+        return self.zset(redis_key).add(proxy.string(), proxy_score_max)
+
+    @locked
+    def increase(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_max=PROXY_SCORE_MAX) -> Optional[float]:
+        zset = self.zset(redis_key)
+        score = zset.score(proxy.string())
+        if score is None or score >= proxy_score_max:
+            return score
+        zset.add(proxy.string(), score + 1)
+        return score + 1
+
+    @locked
+    def evict(self, count, policy=EVICTION_POLICY, redis_key=REDIS_KEY) -> List[Proxy]:
+        zset, eviction = self.zset(redis_key), self.zset(EVICTION_KEY)
+        evicted = []
+        if policy in TRACKED_EVICTION_POLICIES and self.is_tracked(redis_key):
+            evicted += [member for member, _ in eviction.range(0, count - 1)]
+            for member in evicted:
+                zset.remove(member)
+        if len(evicted) < count:
+            # lowest score first
+            members = [member for member, _ in zset.range(0, count - len(evicted) - 1)]
+            for member in members:
+                zset.remove(member)
+            evicted += members
+        for member in evicted:
+            eviction.remove(member)
+        if evicted and ENABLE_META and redis_key == REDIS_KEY:
+            self.discard(evicted)
+        logger.info('evicted {} proxies by {} policy', len(evicted), policy)
+        return convert_proxy_or_proxies(evicted) or []
+
+    @locked
+    def remove(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> int:
+        zset = self.zset(redis_key)
+        return sum(zset.remove(proxy.string()) for proxy in proxies)
+
+    @locked
+    def exists_many(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> List[bool]:
+        zset = self.zset(redis_key)
+        return [zset.score(proxy.string()) is not None for proxy in proxies]
+
+    @locked
+    def scores(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> List[Optional[float]]:
+        zset = self.zset(redis_key)
+        return [zset.score(proxy.string()) for proxy in proxies]
+
+    @locked
+    def metas(self, proxies: List[Proxy]) -> List[ProxyMeta]:
+        metas = self.hash(META_KEY)
+        values = [metas.get(str(proxy)) for proxy in proxies]
+        return [ProxyMeta.unpack(value) if value else None for value in values]
+
+    @locked
+    def update_metas(self, checks):
+        if not checks or not ENABLE_META:
+            return
+        metas, zset = self.hash(META_KEY), self.zset(REDIS_KEY)
+        mapping, removed, stale, fresh = apply_checks(
+            checks, [metas.get(member) for member in checks], [zset.score(member) for member in checks])
+        for key, member in stale:
+            self.set(key).discard(member)
+        for key, member in fresh:
+            self.set(key).add(member)
+        for member in removed:
+            metas.pop(member, None)
+        metas.update(mapping)
+
+    @locked
+    def random_in_index(self, key) -> Proxy:
+        member = self.set(key).choice()
+        if member:
+            return convert_proxy_or_proxies(member)
+        raise PoolEmptyException
+
+    @locked
+    def random_by_meta(self, condition, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN,
+                       proxy_score_max=PROXY_SCORE_MAX, sample=100) -> Proxy:
+        zset, metas = self.zset(redis_key), self.hash(META_KEY)
+        for members in (zset.range_by_score(proxy_score_max, proxy_score_max),
+                        [member for member, _ in zset.range(proxy_score_min, proxy_score_max, reverse=True)]):
+            if len(members) > sample:
+                members = random_sample(members, sample)
+            matched = [member for member in members
+                       if metas.get(member) and condition(ProxyMeta.unpack(metas[member]))]
+            if matched:
+                return convert_proxy_or_proxies(choice(matched))
+        raise PoolEmptyException
+
+    @locked
+    def count(self, redis_key=REDIS_KEY) -> int:
+        return len(self.zset(redis_key))
+
+    @locked
+    def lease(self, ttl, redis_key=REDIS_KEY):
+        zset, leases = self.zset(redis_key), self.zset(lease_key(redis_key))
+        now = time.time()
+        # leases are sorted by expiry, so expired ones are at the head
+        while leases.items and leases.items[0][0] <= now:
+            leases.remove(leases.items[0][1])
+        shared = None
+        for offset in range(0, len(zset), LEASE_RANKED):
+            page = zset.range(offset, offset + LEASE_RANKED - 1, reverse=True)
+            unleased, soonest = lease_candidates(page, [leases.score(member) for member, _ in page], now)
+            if unleased:
+                leases.add(unleased[0], now + ttl)
+                return convert_proxy_or_proxies(unleased[0]), False
+            shared = shared or soonest
+            # later pages are only read while some proxy of pool is not leased
+            if len(leases) >= len(zset):
+                break
+        if shared is None:
+            raise PoolEmptyException
+        leases.add(shared, max(leases.score(shared), now + ttl))
+        return convert_proxy_or_proxies(shared), True
+
+    @locked
+    def release(self, proxy: Proxy, redis_key=REDIS_KEY) -> bool:
+        return bool(self.zset(lease_key(redis_key)).remove(proxy.string()))
+
+    @locked
+    def count_leased(self, redis_key=REDIS_KEY) -> int:
+        return self.zset(lease_key(redis_key)).count(time.time(), '+inf')
+
+    @locked
+    def count_bands(self, bands, redis_key=REDIS_KEY) -> List[int]:
+        zset = self.zset(redis_key)
+        return [zset.count(score_min, score_max) for score_min, score_max in bands]
+
+    @locked
+    def ranked(self, offset, limit, reverse=True, redis_key=REDIS_KEY):
+        stop = offset + limit - 1 if limit >= 0 else -1
+        return self.zset(redis_key).range(offset, stop, reverse)
+
+    @locked
+    def all(self, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN, proxy_score_max=PROXY_SCORE_MAX) -> List[Proxy]:
+        return convert_proxy_or_proxies(self.zset(redis_key).range_by_score(proxy_score_min, proxy_score_max))
+
+    @locked
+    def batch(self, cursor, count, redis_key=REDIS_KEY):
+        """
+        get batch of proxies, members are listed when the scan starts,
+        so proxies whose scores change meanwhile are neither skipped nor returned twice
+        :param cursor: tuple of id of scan and offset, 0 to start a scan
+        :return: next cursor, 0 when all are scanned, and list of proxies
+        """
+        zset = self.zset(redis_key)
+        if not cursor:
+            cursor = (next(self.scan_ids), 0)
+            self.scans[cursor[0]] = list(zset.scores)
+            while len(self.scans) > MAX_SCANS:
+                self.scans.pop(next(iter(self.scans)))
+        scan, offset = cursor
+        members = self.scans.get(scan, [])
+        proxies = convert_proxy_or_proxies([member for member in members[offset:offset + count]
+                                            if zset.score(member) is not None])
+        if offset + count < len(members):
+            return (scan, offset + count), proxies
+        self.scans.pop(scan, None)
+        return 0, proxies
+
+    @locked
+    def notify_ingested(self, count):
+        self.ingested += count
+        self.event.notify_all()
+
+    @locked
+    def wait_ingested(self, timeout):
+        if not self.ingested and timeout > 0:
+            self.event.wait(timeout)
+        count, self.ingested = self.ingested, 0
+        return count
+
+    @locked
+    def enqueue_ingested(self, members):
+        for member in members:
+            self.stream[f'{next(self.entry_ids)}-0'] = member
+        # trim oldest entries like maxlen of xadd, pending ones are kept
+        while len(self.stream) > INGEST_STREAM_MAXLEN:
+            self.stream.popitem(last=False)
+        if members:
+            self.event.notify_all()
+
+    @locked
+    def claim_ingested(self, consumer, count, block=0):
+        """
+        claim entries like RedisClient, entries pending longer than INGEST_CLAIM_IDLE first, then new ones
+        """
+        now = time.time()
+        claimed = []
+        for entry_id, (member, _, delivered_at) in list(self.pending.items()):
+            if len(claimed) >= count or now - delivered_at < INGEST_CLAIM_IDLE:
+                break
+            claimed.append((entry_id, member))
+        if not claimed:
+            if not self.stream and block > 0:
+                self.event.wait(block)
+            while self.stream and len(claimed) < count:
+                claimed.append(self.stream.popitem(last=False))
+        for entry_id, member in claimed:
+            # pending entries are ordered by delivery, so idle ones are at the head
+            self.pending.pop(entry_id, None)
+            self.pending[entry_id] = (member, consumer, now)
+        return claimed
+
+    @locked
+    def ack_ingested(self, ids):
+        for entry_id in ids:
+            self.pending.pop(entry_id, None)
+
+    @locked
+    def verdicts(self, keys):
+        now = time.time()
+        results = []
+        for key in keys:
+            verdict, expires_at = self.verdict_cache.get(key, (None, 0))
+            results.append(verdict if expires_at > now else None)
+        return results
+
+    @locked
+    def cache_verdicts(self, verdicts, ttl):
+        now = time.time()
+        for key, verdict in verdicts.items():
+            self.verdict_cache.pop(key, None)
+            self.verdict_cache[key] = (verdict, now + ttl)
+        # expired verdicts are at the head
+        while self.verdict_cache and next(iter(self.verdict_cache.values()))[1] <= now:
+            self.verdict_cache.popitem(last=False)
+
+    @locked
+    def beat(self, role, status):
+        self.hash(HEARTBEAT_KEY)[role] = json.dumps(status)
+
+    @locked
+    def heartbeats(self):
+        return {role: json.loads(status) for role, status in self.hash(HEARTBEAT_KEY).items()}
+
+    @locked
+    def set_crawlers(self, names):
+        self.sets['crawlers'] = RandomSet(names)
+
+    @locked
+    def flush_metrics(self, key, values):
+        samples = self.hash(key)
+        for sample, value in values.items():
+            # values loaded from snapshot are text
+            samples[sample] = float(samples.get(sample, 0)) + value
+
+    @locked
+    def read_metrics(self, key):
+        return dict(self.hash(key))
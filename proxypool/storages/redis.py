@@ -1,19 +1,41 @@
 import redis
 from proxypool.exceptions import PoolEmptyException
 from proxypool.schemas.proxy import Proxy
+from proxypool.schemas.meta import ProxyMeta
 from proxypool.setting import REDIS_CONNECTION_STRING, REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, REDIS_DB, REDIS_KEY, PROXY_SCORE_MAX, PROXY_SCORE_MIN, \
-    PROXY_SCORE_INIT
-from random import choice
-from typing import List
+    PROXY_SCORE_INIT, LOG_PER_PROXY, EVICTION_POLICY, EVICTION_POLICY_LRU, \
+    EVICTION_KEY, ENABLE_META, META_KEY, EVENTS_CHANNEL, INGEST_STREAM_KEY, INGEST_STREAM_GROUP, \
+    INGEST_STREAM_MAXLEN, INGEST_CLAIM_IDLE, HEARTBEAT_KEY, TEST_CACHE_KEY
+from random import choice, sample as random_sample
+import json
+import time
+from typing import List, Optional
 from loguru import logger
 from proxypool.utils.proxy import is_valid_proxy, convert_proxy_or_proxies
+from proxypool.utils.metrics import metrics
+from proxypool.storages.base import BaseStorage, IngestStream, VerdictCache, ProcessStatus, MetricsStore, \
+    TRACKED_EVICTION_POLICIES, index_keys, new_meta, apply_checks, lease_key, lease_candidates, LEASE_RANKED
 
 
 REDIS_CLIENT_VERSION = redis.__version__
 IS_REDIS_VERSION_2 = REDIS_CLIENT_VERSION.startswith('2.')
 
 
-class RedisClient(object):
+def mapping_of(proxies: List[Proxy], score, sources=None):
+    """
+    valid proxies to add with their scores and crawler names
+    :return: dict of proxy string to score, dict of proxy string to crawler name
+    """
+    sources = sources or [''] * len(proxies)
+    mapping, metas = {}, {}
+    for proxy, source in zip(proxies, sources):
+        if is_valid_proxy(proxy.string()):
+            mapping[proxy.string()] = score
+            metas[proxy.string()] = source
+    return mapping, metas
+
+
+class RedisClient(BaseStorage, IngestStream, VerdictCache, ProcessStatus, MetricsStore):
     """
     redis connection client of proxypool
     """
@@ -33,7 +55,11 @@ class RedisClient(object):
         else:
             self.db = redis.StrictRedis(
                 host=host, port=port, password=password, db=db, decode_responses=True, **kwargs)
+        # subscription of events, messages are buffered by connection until read
+        self.events = None
+        self.group_created = False
 
+    @metrics.timed('proxypool_redis_command_seconds', command='add')
     def add(self, proxy: Proxy, score=PROXY_SCORE_INIT, redis_key=REDIS_KEY) -> int:
         """
         add proxy and set it to init score
@@ -41,14 +67,78 @@ class RedisClient(object):
         :param score: int score
         :return: result
         """
-        if not is_valid_proxy(f'{proxy.host}:{proxy.port}'):
-            logger.info(f'invalid proxy {proxy}, throw it')
+        if not is_valid_proxy(proxy.string()):
+            if LOG_PER_PROXY:
+                logger.debug('invalid proxy {}, throw it', proxy)
             return
         if not self.exists(proxy, redis_key):
             if IS_REDIS_VERSION_2:
                 return self.db.zadd(redis_key, score, proxy.string())
+            if self.is_tracked(redis_key):
+                self.db.zadd(EVICTION_KEY, {proxy.string(): time.time()}, nx=True)
             return self.db.zadd(redis_key, {proxy.string(): score})
 
+    @metrics.timed('proxypool_redis_command_seconds', command='add_many')
+    def add_many(self, proxies: List[Proxy], score=PROXY_SCORE_INIT, redis_key=REDIS_KEY, sources=None,
+                 enqueue=False) -> int:
+        """
+        add proxies which don't exist yet and set them to init score, in one round trip
+        :param proxies: list of proxy
+        :param score: int score
+        :param sources: list of crawler name of every proxy, stored as metadata
+        :param enqueue: append added proxies to ingest stream, costs another round trip
+        :return: number of added proxies
+        """
+        if enqueue:
+            added = self.add_new(proxies, score, redis_key, sources)
+            self.enqueue_ingested(added)
+            return len(added)
+        mapping, metas = mapping_of(proxies, score, sources)
+        if not mapping:
+            return 0
+        if IS_REDIS_VERSION_2:
+            return sum(1 for proxy in proxies if self.add(proxy, score, redis_key))
+        if not self.is_tracked(redis_key) and not (ENABLE_META and redis_key == REDIS_KEY):
+            return self.db.zadd(redis_key, mapping, nx=True)
+        pipe = self.db.pipeline(transaction=False)
+        pipe.zadd(redis_key, mapping, nx=True)
+        self.track(pipe, proxies, mapping, metas, redis_key)
+        return pipe.execute()[0]
+
+    def add_new(self, proxies: List[Proxy], score=PROXY_SCORE_INIT, redis_key=REDIS_KEY, sources=None) -> List[str]:
+        """
+        add proxies like add_many and tell which ones were added by zadd nx of every member, in one round trip,
+        proxies added by another getter at the same time are told apart by redis
+        :return: list of added proxy string
+        """
+        mapping, metas = mapping_of(proxies, score, sources)
+        if not mapping:
+            return []
+        if IS_REDIS_VERSION_2:
+            return [proxy.string() for proxy in proxies if self.add(proxy, score, redis_key)]
+        pipe = self.db.pipeline(transaction=False)
+        for member in mapping:
+            pipe.zadd(redis_key, {member: score}, nx=True)
+        self.track(pipe, proxies, mapping, metas, redis_key)
+        results = pipe.execute()
+        return [member for member, result in zip(mapping, results) if result]
+
+    def track(self, pipe, proxies, mapping, metas, redis_key=REDIS_KEY):
+        """
+        queue eviction tracking and metadata of added proxies on pipe
+        :param mapping: dict of proxy string to score
+        :param metas: dict of proxy string to crawler name
+        """
+        now = int(time.time())
+        if self.is_tracked(redis_key):
+            pipe.zadd(EVICTION_KEY, {member: now for member in mapping}, nx=True)
+        if ENABLE_META and redis_key == REDIS_KEY:
+            for proxy in proxies:
+                member = proxy.string()
+                if member in metas:
+                    pipe.hsetnx(META_KEY, member, new_meta(proxy, metas[member], now).pack())
+
+    @metrics.timed('proxypool_redis_command_seconds', command='random')
     def random(self, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN, proxy_score_max=PROXY_SCORE_MAX) -> Proxy:
         """
         get random proxy
@@ -70,6 +160,7 @@ class RedisClient(object):
         # else raise error
         raise PoolEmptyException
 
+    @metrics.timed('proxypool_redis_command_seconds', command='decrease')
     def decrease(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN) -> int:
         """
         decrease score of proxy, if small than PROXY_SCORE_MIN, delete it
@@ -81,11 +172,23 @@ class RedisClient(object):
         else:
             self.db.zincrby(redis_key, -1, proxy.string())
         score = self.db.zscore(redis_key, proxy.string())
-        logger.info(f'{proxy.string()} score decrease 1, current {score}')
+        if LOG_PER_PROXY:
+            logger.debug('{} score decrease 1, current {}', proxy, score)
         if score <= proxy_score_min:
-            logger.info(f'{proxy.string()} current score {score}, remove')
-            self.db.zrem(redis_key, proxy.string())
+            if LOG_PER_PROXY:
+                logger.debug('{} current score {}, remove', proxy, score)
+            pipe = self.db.pipeline(transaction=False)
+            pipe.zrem(redis_key, proxy.string())
+            pipe.zrem(lease_key(redis_key), proxy.string())
+            if self.is_tracked(redis_key):
+                pipe.zrem(EVICTION_KEY, proxy.string())
+            pipe.execute()
+            # removed proxy is never tested again, so its metadata and indexes are cleaned right away
+            if ENABLE_META and redis_key == REDIS_KEY:
+                self.discard([proxy.string()])
+        return score
 
+    @metrics.timed('proxypool_redis_command_seconds', command='exists')
     def exists(self, proxy: Proxy, redis_key=REDIS_KEY) -> bool:
         """
         if proxy exists
@@ -94,17 +197,201 @@ class RedisClient(object):
         """
         return not self.db.zscore(redis_key, proxy.string()) is None
 
+    @metrics.timed('proxypool_redis_command_seconds', command='max')
     def max(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_max=PROXY_SCORE_MAX) -> int:
         """
         set proxy to max score
         :param proxy: proxy
         :return: new score
         """
-        logger.info(f'{proxy.string()} is valid, set to {proxy_score_max}')
+        if LOG_PER_PROXY:
+            logger.debug('{} is valid, set to {}', proxy, proxy_score_max)
+        if self.is_tracked(redis_key):
+            if EVICTION_POLICY == EVICTION_POLICY_LRU:
+                self.db.zadd(EVICTION_KEY, {proxy.string(): time.time()})
+            else:
+                # verified proxies are no candidates of oldest_unverified
+                self.db.zrem(EVICTION_KEY, proxy.string())
         if IS_REDIS_VERSION_2:
             return self.db.zadd(redis_key, proxy_score_max, proxy.string())
         return self.db.zadd(redis_key, {proxy.string(): proxy_score_max})
 
+    @metrics.timed('proxypool_redis_command_seconds', command='increase')
+    def increase(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_max=PROXY_SCORE_MAX) -> Optional[float]:
+        """
+        increase score of proxy by 1 up to proxy_score_max, higher scores are kept, proxies not in pool are not added
+        :param proxy: proxy
+        :return: new score, None if proxy is not in pool
+        """
+        score = self.db.zscore(redis_key, proxy.string())
+        if score is None or score >= proxy_score_max:
+            return score
+        if IS_REDIS_VERSION_2:
+            self.db.zincrby(redis_key, proxy.string(), 1)
+        else:
+            self.db.zadd(redis_key, {proxy.string(): score + 1}, xx=True)
+        return score + 1
+
+    @staticmethod
+    def is_tracked(redis_key):
+        """
+        if timestamps of proxies of redis_key are tracked for eviction, only the universal pool is capped
+        """
+        return EVICTION_POLICY in TRACKED_EVICTION_POLICIES and redis_key == REDIS_KEY and not IS_REDIS_VERSION_2
+
+    @metrics.timed('proxypool_redis_command_seconds', command='evict')
+    def evict(self, count, policy=EVICTION_POLICY, redis_key=REDIS_KEY) -> List[Proxy]:
+        """
+        evict proxies in bulk to make room for new ones,
+        proxies not tracked by oldest_unverified or lru policy are evicted by lowest score
+        :param count: number of proxies to evict
+        :param policy: eviction policy
+        :return: list of evicted proxies
+        """
+        evicted = []
+        if policy in TRACKED_EVICTION_POLICIES and self.is_tracked(redis_key):
+            members = self.db.zrange(EVICTION_KEY, 0, count - 1)
+            if members:
+                pipe = self.db.pipeline(transaction=True)
+                pipe.zrem(redis_key, *members)
+                pipe.zrem(EVICTION_KEY, *members)
+                pipe.execute()
+                evicted += members
+        if len(evicted) < count:
+            # lowest score first, zrange and zremrangebyrank in one transaction evict the same members
+            pipe = self.db.pipeline(transaction=True)
+            pipe.zrange(redis_key, 0, count - len(evicted) - 1)
+            pipe.zremrangebyrank(redis_key, 0, count - len(evicted) - 1)
+            members = pipe.execute()[0]
+            if members and self.is_tracked(redis_key):
+                self.db.zrem(EVICTION_KEY, *members)
+            evicted += members
+        if evicted and ENABLE_META and redis_key == REDIS_KEY:
+            self.discard(evicted)
+        logger.info('evicted {} proxies by {} policy', len(evicted), policy)
+        return convert_proxy_or_proxies(evicted) or []
+
+    def discard(self, members):
+        """
+        delete metadata of proxies removed from universal pool and remove them from indexes
+        :param members: list of proxy string
+        """
+        pipe = self.db.pipeline(transaction=False)
+        for member, meta in zip(members, self.metas(members)):
+            for key in index_keys(meta) if meta else []:
+                pipe.srem(key, member)
+        pipe.hdel(META_KEY, *members)
+        pipe.execute()
+
+    @metrics.timed('proxypool_redis_command_seconds', command='remove')
+    def remove(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> int:
+        """
+        remove proxies, like evicted ones from sub-pools of testers
+        :param proxies: list of proxy
+        :return: number of removed proxies
+        """
+        if not proxies:
+            return 0
+        return self.db.zrem(redis_key, *[proxy.string() for proxy in proxies])
+
+    @metrics.timed('proxypool_redis_command_seconds', command='exists_many')
+    def exists_many(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> List[bool]:
+        """
+        if proxies exist, in one round trip
+        :param proxies: list of proxy
+        :return: list of bool
+        """
+        pipe = self.db.pipeline(transaction=False)
+        for proxy in proxies:
+            pipe.zscore(redis_key, proxy.string())
+        return [score is not None for score in pipe.execute()]
+
+    @metrics.timed('proxypool_redis_command_seconds', command='scores')
+    def scores(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> List[Optional[float]]:
+        """
+        get scores of proxies, in one round trip, ZMSCORE needs redis 6.2
+        :param proxies: list of proxy
+        :return: list of score, None if proxy is not in redis_key
+        """
+        pipe = self.db.pipeline(transaction=False)
+        for proxy in proxies:
+            pipe.zscore(redis_key, proxy.string())
+        return pipe.execute()
+
+    @metrics.timed('proxypool_redis_command_seconds', command='metas')
+    def metas(self, proxies: List[Proxy]) -> List[ProxyMeta]:
+        """
+        get metadata of proxies of universal pool, in one round trip
+        :param proxies: list of proxy or proxy string
+        :return: list of metadata, None if proxy has no metadata
+        """
+        if not proxies:
+            return []
+        values = self.db.hmget(META_KEY, [str(proxy) for proxy in proxies])
+        return [ProxyMeta.unpack(value) if value else None for value in values]
+
+    @metrics.timed('proxypool_redis_command_seconds', command='update_metas')
+    def update_metas(self, checks):
+        """
+        update metadata and indexes with results of a batch of checks,
+        metadata of proxies removed meanwhile is deleted, costs two round trips per batch
+        :param checks: dict of proxy string to (valid, latency in ms, supported protocols joined by comma)
+        """
+        if not checks or not ENABLE_META:
+            return
+        members = list(checks)
+        pipe = self.db.pipeline(transaction=False)
+        pipe.hmget(META_KEY, members)
+        for member in members:
+            pipe.zscore(REDIS_KEY, member)
+        values, *scores = pipe.execute()
+        mapping, removed, stale, fresh = apply_checks(checks, values, scores)
+        pipe = self.db.pipeline(transaction=False)
+        for key, member in stale:
+            pipe.srem(key, member)
+        for key, member in fresh:
+            pipe.sadd(key, member)
+        if removed:
+            pipe.hdel(META_KEY, *removed)
+        if mapping:
+            pipe.hset(META_KEY, mapping=mapping)
+        pipe.execute()
+
+    @metrics.timed('proxypool_redis_command_seconds', command='random_in_index')
+    def random_in_index(self, key) -> Proxy:
+        """
+        get random proxy of index, like country_key('US'), in one round trip
+        :param key: key of index
+        :return: proxy, like 8.8.8.8:8
+        """
+        member = self.db.srandmember(key)
+        if member:
+            return convert_proxy_or_proxies(member)
+        raise PoolEmptyException
+
+    @metrics.timed('proxypool_redis_command_seconds', command='random_by_meta')
+    def random_by_meta(self, condition, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN,
+                       proxy_score_max=PROXY_SCORE_MAX, sample=100) -> Proxy:
+        """
+        get random proxy whose metadata matches condition, candidates are chosen like random,
+        up to sample of them are checked in one round trip
+        :param condition: callable receiving ProxyMeta and returning bool
+        :param sample: max number of candidates to check
+        :return: proxy, like 8.8.8.8:8
+        """
+        for members in (self.db.zrangebyscore(redis_key, proxy_score_max, proxy_score_max),
+                        self.db.zrevrange(redis_key, proxy_score_min, proxy_score_max)):
+            if len(members) > sample:
+                members = random_sample(members, sample)
+            if not members:
+                continue
+            matched = [member for member, value in zip(members, self.db.hmget(META_KEY, members))
+                       if value and condition(ProxyMeta.unpack(value))]
+            if matched:
+                return convert_proxy_or_proxies(choice(matched))
+        raise PoolEmptyException
+
+    @metrics.timed('proxypool_redis_command_seconds', command='count')
     def count(self, redis_key=REDIS_KEY) -> int:
         """
         get count of proxies
@@ -112,6 +399,77 @@ class RedisClient(object):
         """
         return self.db.zcard(redis_key)
 
+    @metrics.timed('proxypool_redis_command_seconds', command='lease')
+    def lease(self, ttl, redis_key=REDIS_KEY):
+        """
+        lease proxy for ttl seconds, leases expired meanwhile are dropped first, pages of LEASE_RANKED proxies
+        are read in order of score with expiries of their leases only, a candidate is leased by ZADD NX,
+        so a proxy leased by another server meanwhile is skipped
+        :return: proxy, and if it's shared with another lease
+        """
+        key = lease_key(redis_key)
+        now = time.time()
+        pipe = self.db.pipeline(transaction=False)
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zcard(key)
+        _, leased = pipe.execute()
+        # later pages are only read while some proxy of pool is not leased
+        everything_leased = leased >= self.count(redis_key)
+        offset, shared = 0, None
+        while True:
+            page = self.ranked(offset, LEASE_RANKED, redis_key=redis_key)
+            if not page:
+                break
+            pipe = self.db.pipeline(transaction=False)
+            for member, _ in page:
+                pipe.zscore(key, member)
+            expiries = pipe.execute()
+            unleased, soonest = lease_candidates(page, expiries, now)
+            for member in unleased:
+                if self.db.zadd(key, {member: now + ttl}, nx=True):
+                    return convert_proxy_or_proxies(member), False
+            if shared is None and soonest:
+                shared = soonest, dict(zip((member for member, _ in page), expiries))[soonest]
+            if everything_leased:
+                break
+            offset += LEASE_RANKED
+        if shared is None:
+            raise PoolEmptyException
+        member, expiry = shared
+        self.db.zadd(key, {member: max(expiry, now + ttl)})
+        return convert_proxy_or_proxies(member), True
+
+    def release(self, proxy: Proxy, redis_key=REDIS_KEY) -> bool:
+        return bool(self.db.zrem(lease_key(redis_key), proxy.string()))
+
+    def count_leased(self, redis_key=REDIS_KEY) -> int:
+        return self.db.zcount(lease_key(redis_key), time.time(), '+inf')
+
+    @metrics.timed('proxypool_redis_command_seconds', command='count_bands')
+    def count_bands(self, bands, redis_key=REDIS_KEY) -> List[int]:
+        """
+        get count of proxies of every score band, in one round trip
+        :param bands: list of (score_min, score_max)
+        :return: list of count
+        """
+        pipe = self.db.pipeline(transaction=False)
+        for score_min, score_max in bands:
+            pipe.zcount(redis_key, score_min, score_max)
+        return pipe.execute()
+
+    @metrics.timed('proxypool_redis_command_seconds', command='ranked')
+    def ranked(self, offset, limit, reverse=True, redis_key=REDIS_KEY):
+        """
+        get proxies with scores ordered by score
+        :param offset: offset of first proxy
+        :param limit: number of proxies, -1 for all
+        :param reverse: highest score first
+        :return: list of (proxy string, score)
+        """
+        stop = offset + limit - 1 if limit >= 0 else -1
+        return (self.db.zrevrange if reverse else self.db.zrange)(redis_key, offset, stop, withscores=True)
+
+    @metrics.timed('proxypool_redis_command_seconds', command='all')
     def all(self, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN, proxy_score_max=PROXY_SCORE_MAX) -> List[Proxy]:
         """
         get all proxies
@@ -119,6 +477,7 @@ class RedisClient(object):
         """
         return convert_proxy_or_proxies(self.db.zrangebyscore(redis_key, proxy_score_min, proxy_score_max))
 
+    @metrics.timed('proxypool_redis_command_seconds', command='batch')
     def batch(self, cursor, count, redis_key=REDIS_KEY) -> List[Proxy]:
         """
         get batch of proxies
@@ -129,6 +488,133 @@ class RedisClient(object):
         cursor, proxies = self.db.zscan(redis_key, cursor, count=count)
         return cursor, convert_proxy_or_proxies([i[0] for i in proxies])
 
+    def notify_ingested(self, count):
+        """
+        publish event of proxies ingested by getter
+        :param count: number of ingested proxies
+        """
+        self.db.publish(EVENTS_CHANNEL, count)
+
+    def wait_ingested(self, timeout):
+        """
+        wait for events of ingested proxies, subscribes on first call,
+        events published since then are buffered and collected by later calls
+        :param timeout: seconds to wait at most, 0 to collect published events only
+        :return: number of ingested proxies
+        """
+        if self.events is None:
+            self.events = self.db.pubsub(ignore_subscribe_messages=True)
+            self.events.subscribe(EVENTS_CHANNEL)
+        count, deadline = 0, time.time() + timeout
+        while True:
+            # once an event arrived, only collect the buffered ones
+            message = self.events.get_message(timeout=0 if count else max(deadline - time.time(), 0))
+            if message:
+                count += int(message['data'])
+            elif count or time.time() >= deadline:
+                return count
+
+    def enqueue_ingested(self, members):
+        """
+        append proxies to ingest stream, trimmed to about INGEST_STREAM_MAXLEN entries, in one round trip
+        :param members: list of proxy string
+        """
+        if not members:
+            return
+        pipe = self.db.pipeline(transaction=False)
+        for member in members:
+            pipe.xadd(INGEST_STREAM_KEY, {'proxy': member}, maxlen=INGEST_STREAM_MAXLEN, approximate=True)
+        pipe.execute()
+
+    def claim_ingested(self, consumer, count, block=0):
+        """
+        claim entries of ingest stream for consumer of INGEST_STREAM_GROUP,
+        entries pending longer than INGEST_CLAIM_IDLE are claimed by XAUTOCLAIM first, then new ones are read
+        :param consumer: name of consumer
+        :param count: max number of entries
+        :param block: seconds to wait for new entries
+        :return: list of (entry id, proxy string)
+        """
+        if not self.group_created:
+            try:
+                self.db.xgroup_create(INGEST_STREAM_KEY, INGEST_STREAM_GROUP, id='0', mkstream=True)
+            except redis.ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+            self.group_created = True
+        # redis-py 3 has no method of XAUTOCLAIM, only ids are claimed, as redis 6.2 replies entries deleted from stream
+        # as nil without their ids, so they could never be acked, redis 7 leaves them out of the reply and of pending
+        _, ids, *_ = self.db.execute_command('XAUTOCLAIM', INGEST_STREAM_KEY, INGEST_STREAM_GROUP, consumer,
+                                             INGEST_CLAIM_IDLE * 1000, '0-0', 'COUNT', count, 'JUSTID')
+        entries = []
+        if ids:
+            pipe = self.db.pipeline(transaction=False)
+            for entry_id in ids:
+                pipe.xrange(INGEST_STREAM_KEY, entry_id, entry_id)
+            entries = [(entry_id, found[0][1] if found else None) for entry_id, found in zip(ids, pipe.execute())]
+        else:
+            streams = self.db.xreadgroup(INGEST_STREAM_GROUP, consumer, {INGEST_STREAM_KEY: '>'}, count=count,
+                                         block=int(block * 1000) or None)
+            entries = streams[0][1] if streams else []
+        # entries trimmed from stream meanwhile have no fields
+        trimmed = [entry_id for entry_id, fields in entries if not fields]
+        if trimmed:
+            self.ack_ingested(trimmed)
+        return [(entry_id, fields['proxy']) for entry_id, fields in entries if fields]
+
+    def ack_ingested(self, ids):
+        if ids:
+            self.db.xack(INGEST_STREAM_KEY, INGEST_STREAM_GROUP, *ids)
+
+    def verdicts(self, keys):
+        """
+        get cached verdicts of tests in one round trip
+        """
+        if not keys:
+            return []
+        return self.db.mget([f'{TEST_CACHE_KEY}:{key}' for key in keys])
+
+    def cache_verdicts(self, verdicts, ttl):
+        """
+        cache verdicts of tests in one round trip, every one expires by itself
+        """
+        if not verdicts:
+            return
+        pipe = self.db.pipeline(transaction=False)
+        for key, verdict in verdicts.items():
+            pipe.set(f'{TEST_CACHE_KEY}:{key}', verdict, ex=ttl)
+        pipe.execute()
+
+    def beat(self, role, status):
+        self.db.hset(HEARTBEAT_KEY, role, json.dumps(status))
+
+    def heartbeats(self):
+        return {role: json.loads(status) for role, status in self.db.hgetall(HEARTBEAT_KEY).items()}
+
+    def set_crawlers(self, names):
+        """
+        replace names of loaded crawlers in one transaction
+        :param names: list of str
+        """
+        pipe = self.db.pipeline()
+        pipe.delete('crawlers')
+        if names:
+            pipe.sadd('crawlers', *names)
+        pipe.execute()
+
+    def flush_metrics(self, key, values):
+        """
+        add deltas of metrics into hash of key, in one round trip
+        :param values: dict of sample to delta
+        """
+        pipe = self.db.pipeline(transaction=False)
+        for sample, value in values.items():
+            pipe.hincrbyfloat(key, sample, value)
+        pipe.execute()
+
+    def read_metrics(self, key):
+        return dict(self.db.hgetall(key) or {})
+
 
 if __name__ == '__main__':
     conn = RedisClient()
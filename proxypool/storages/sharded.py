@@ -0,0 +1,321 @@
+import heapq
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from random import choices
+from typing import List, Optional
+from proxypool.exceptions import PoolEmptyException
+from proxypool.schemas.proxy import Proxy
+from proxypool.setting import REDIS_SHARDS, REDIS_KEY, PROXY_SCORE_MAX, PROXY_SCORE_MIN, PROXY_SCORE_INIT, \
+    EVICTION_POLICY
+from proxypool.storages.base import lease_key
+from proxypool.storages.redis import RedisClient
+
+# seconds sizes of shards are cached for weighting random selection
+SIZES_MAX_AGE = 1
+
+
+def shard_of(member, shards):
+    """
+    index of shard of proxy, crc32 is stable across processes unlike hash
+    :param member: proxy string, like 8.8.8.8:88
+    :param shards: number of shards
+    :return: int
+    """
+    return zlib.crc32(member.encode()) % shards
+
+
+class ShardedRedisClient(RedisClient):
+    """
+    redis client sharding the universal pool over several redis nodes by hash of host:port,
+    metadata and indexes of a proxy live on its shard, sub-pools of testers, leases and metrics on the first one
+    """
+
+    def __init__(self, connection_strings=None, shards=None, **kwargs):
+        """
+        init sharded client
+        :param connection_strings: connection strings of shards, REDIS_SHARDS by default
+        :param shards: list of RedisClient, used instead of connection_strings if set
+        """
+        if shards is None:
+            shards = [RedisClient(connection_string=connection_string, **kwargs)
+                      for connection_string in connection_strings or REDIS_SHARDS]
+        if not shards:
+            raise ValueError('no shards of redis')
+        self.shards = shards
+        self.db = shards[0].db
+        self.executor = ThreadPoolExecutor(max_workers=len(shards))
+        self.sizes, self.tops, self.sized_at = [], [], 0
+        self.index_sizes = {}
+        self.events = None
+        self.group_created = False
+
+    def shard(self, member, redis_key=REDIS_KEY) -> RedisClient:
+        """
+        shard holding member of redis_key, sub-pools are not sharded
+        :param member: proxy or proxy string
+        """
+        if redis_key != REDIS_KEY:
+            return self.shards[0]
+        return self.shards[shard_of(str(member), len(self.shards))]
+
+    def group(self, members):
+        """
+        group members of universal pool by shard
+        :return: dict of shard index to list of (position, member)
+        """
+        groups = {}
+        for position, member in enumerate(members):
+            groups.setdefault(shard_of(str(member), len(self.shards)), []).append((position, member))
+        return groups
+
+    def fan_out(self, func, indexes=None):
+        """
+        call func with every shard concurrently
+        :param func: callable receiving index and RedisClient of shard
+        :param indexes: indexes of shards, all by default
+        :return: list of results in order of indexes
+        """
+        indexes = range(len(self.shards)) if indexes is None else list(indexes)
+        if len(indexes) == 1:
+            return [func(indexes[0], self.shards[indexes[0]])]
+        return list(self.executor.map(lambda index: func(index, self.shards[index]), indexes))
+
+    def weights(self, redis_key=REDIS_KEY, top=False):
+        """
+        sizes of shards, cached for SIZES_MAX_AGE seconds along with counts of proxies of max score
+        :param top: get counts of proxies of max score instead
+        """
+        if redis_key != REDIS_KEY:
+            return [1] + [0] * (len(self.shards) - 1)
+        if time.time() - self.sized_at > SIZES_MAX_AGE:
+            bands = self.fan_out(lambda _, shard: shard.count_bands(
+                [('-inf', '+inf'), (PROXY_SCORE_MAX, PROXY_SCORE_MAX)], redis_key))
+            self.sizes = [size for size, _ in bands]
+            self.tops = [count for _, count in bands]
+            self.sized_at = time.time()
+        return self.tops if top else self.sizes
+
+    def weighted(self, weights):
+        """
+        shards in random order weighted by weights, empty ones are skipped
+        :return: list of RedisClient
+        """
+        candidates = [(weight, shard) for weight, shard in zip(weights, self.shards) if weight]
+        ordered = []
+        while candidates:
+            index = choices(range(len(candidates)), weights=[weight for weight, _ in candidates])[0]
+            ordered.append(candidates.pop(index)[1])
+        return ordered
+
+    def add(self, proxy: Proxy, score=PROXY_SCORE_INIT, redis_key=REDIS_KEY) -> int:
+        return self.shard(proxy, redis_key).add(proxy, score, redis_key)
+
+    def add_many(self, proxies: List[Proxy], score=PROXY_SCORE_INIT, redis_key=REDIS_KEY, sources=None,
+                 enqueue=False) -> int:
+        """
+        add proxies to their shards, one round trip per shard,
+        added proxies are appended to the ingest stream on the first shard
+        """
+        if redis_key != REDIS_KEY:
+            return self.shards[0].add_many(proxies, score, redis_key, sources, enqueue)
+        if enqueue:
+            added = self.add_new(proxies, score, redis_key, sources)
+            self.enqueue_ingested(added)
+            return len(added)
+        sources = sources or [''] * len(proxies)
+        groups = self.group(proxy.string() for proxy in proxies)
+        return sum(self.fan_out(lambda index, shard: shard.add_many(
+            [proxies[position] for position, _ in groups[index]], score, redis_key,
+            [sources[position] for position, _ in groups[index]]), groups))
+
+    def add_new(self, proxies: List[Proxy], score=PROXY_SCORE_INIT, redis_key=REDIS_KEY, sources=None) -> List[str]:
+        """
+        add proxies to their shards and tell which ones were added by zadd nx on every shard,
+        one round trip per shard
+        """
+        if redis_key != REDIS_KEY:
+            return self.shards[0].add_new(proxies, score, redis_key, sources)
+        sources = sources or [''] * len(proxies)
+        groups = self.group(proxy.string() for proxy in proxies)
+        return [member for added in self.fan_out(lambda index, shard: shard.add_new(
+            [proxies[position] for position, _ in groups[index]], score, redis_key,
+            [sources[position] for position, _ in groups[index]]), groups) for member in added]
+
+    def random(self, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN, proxy_score_max=PROXY_SCORE_MAX) -> Proxy:
+        """
+        get random proxy of a shard chosen by weight of its size, shards holding proxies of max score first
+        like RedisClient, chosen by weight of their counts
+        """
+        shards = self.weighted(self.weights(redis_key))
+        if redis_key == REDIS_KEY and proxy_score_max == PROXY_SCORE_MAX:
+            shards = self.weighted(self.weights(redis_key, top=True)) + shards
+        for shard in shards:
+            try:
+                return shard.random(redis_key, proxy_score_min, proxy_score_max)
+            except PoolEmptyException:
+                continue
+        raise PoolEmptyException
+
+    def decrease(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN) -> int:
+        """
+        decrease score on shard of proxy, which cleans its metadata if removed, and its lease on the first shard
+        """
+        score = self.shard(proxy, redis_key).decrease(proxy, redis_key, proxy_score_min)
+        if score <= proxy_score_min:
+            self.db.zrem(lease_key(redis_key), proxy.string())
+        return score
+
+    def exists(self, proxy: Proxy, redis_key=REDIS_KEY) -> bool:
+        return self.shard(proxy, redis_key).exists(proxy, redis_key)
+
+    def increase(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_max=PROXY_SCORE_MAX) -> Optional[float]:
+        return self.shard(proxy, redis_key).increase(proxy, redis_key, proxy_score_max)
+
+    def max(self, proxy: Proxy, redis_key=REDIS_KEY, proxy_score_max=PROXY_SCORE_MAX) -> int:
+        return self.shard(proxy, redis_key).max(proxy, redis_key, proxy_score_max)
+
+    def evict(self, count, policy=EVICTION_POLICY, redis_key=REDIS_KEY) -> List[Proxy]:
+        """
+        evict proxies from shards in proportion to their sizes
+        """
+        if redis_key != REDIS_KEY:
+            return self.shards[0].evict(count, policy, redis_key)
+        # split count by fresh sizes, and refresh them again after eviction
+        self.sized_at = 0
+        sizes = self.weights(redis_key)
+        total = sum(sizes)
+        if not total:
+            return []
+        counts = [count * size // total for size in sizes]
+        # remainder is evicted from largest shards
+        for index in heapq.nlargest(count - sum(counts), range(len(sizes)), key=lambda index: sizes[index]):
+            counts[index] += 1
+        indexes = [index for index, shard_count in enumerate(counts) if shard_count]
+        self.sized_at = 0
+        return sum(self.fan_out(lambda index, shard: shard.evict(counts[index], policy, redis_key), indexes), [])
+
+    def remove(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> int:
+        if redis_key != REDIS_KEY:
+            return self.shards[0].remove(proxies, redis_key)
+        groups = self.group(proxies)
+        return sum(self.fan_out(lambda index, shard: shard.remove(
+            [proxy for _, proxy in groups[index]], redis_key), groups))
+
+    def exists_many(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> List[bool]:
+        """
+        if proxies exist, one round trip per shard
+        """
+        if redis_key != REDIS_KEY:
+            return self.shards[0].exists_many(proxies, redis_key)
+        results = [False] * len(proxies)
+        groups = self.group(proxy.string() for proxy in proxies)
+        for index, exists in zip(groups, self.fan_out(lambda index, shard: shard.exists_many(
+                [proxies[position] for position, _ in groups[index]], redis_key), groups)):
+            for (position, _), value in zip(groups[index], exists):
+                results[position] = value
+        return results
+
+    def scores(self, proxies: List[Proxy], redis_key=REDIS_KEY) -> List[Optional[float]]:
+        """
+        get scores of proxies, one round trip per shard
+        """
+        if redis_key != REDIS_KEY:
+            return self.shards[0].scores(proxies, redis_key)
+        results = [None] * len(proxies)
+        groups = self.group(proxy.string() for proxy in proxies)
+        for index, scores in zip(groups, self.fan_out(lambda index, shard: shard.scores(
+                [proxies[position] for position, _ in groups[index]], redis_key), groups)):
+            for (position, _), score in zip(groups[index], scores):
+                results[position] = score
+        return results
+
+    def metas(self, proxies: List[Proxy]):
+        """
+        get metadata of proxies from their shards
+        """
+        results = [None] * len(proxies)
+        groups = self.group(proxies)
+        for index, metas in zip(groups, self.fan_out(lambda index, shard: shard.metas(
+                [member for _, member in groups[index]]), groups)):
+            for (position, _), meta in zip(groups[index], metas):
+                results[position] = meta
+        return results
+
+    def update_metas(self, checks):
+        """
+        update metadata and indexes on shards of checked proxies
+        """
+        groups = self.group(checks)
+        self.fan_out(lambda index, shard: shard.update_metas(
+            {member: checks[member] for _, member in groups[index]}), groups)
+
+    def random_in_index(self, key) -> Proxy:
+        """
+        get random proxy of index, shard is chosen by weight of size of its index,
+        sizes are cached for SIZES_MAX_AGE seconds so it is a single srandmember mostly, empty ones are not cached
+        """
+        sizes, sized_at = self.index_sizes.get(key, ([], 0))
+        if time.time() - sized_at > SIZES_MAX_AGE or not any(sizes):
+            sizes = self.fan_out(lambda _, shard: shard.db.scard(key))
+            self.index_sizes[key] = sizes, time.time()
+        for shard in self.weighted(sizes):
+            try:
+                return shard.random_in_index(key)
+            except PoolEmptyException:
+                continue
+        raise PoolEmptyException
+
+    def random_by_meta(self, condition, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN,
+                       proxy_score_max=PROXY_SCORE_MAX, sample=100) -> Proxy:
+        """
+        get random proxy whose metadata matches condition, shards are tried in order weighted by size
+        """
+        for shard in self.weighted(self.weights(redis_key)):
+            try:
+                return shard.random_by_meta(condition, redis_key, proxy_score_min, proxy_score_max, sample)
+            except PoolEmptyException:
+                continue
+        raise PoolEmptyException
+
+    def count(self, redis_key=REDIS_KEY) -> int:
+        if redis_key != REDIS_KEY:
+            return self.shards[0].count(redis_key)
+        return sum(self.fan_out(lambda _, shard: shard.count(redis_key)))
+
+    def count_bands(self, bands, redis_key=REDIS_KEY) -> List[int]:
+        if redis_key != REDIS_KEY:
+            return self.shards[0].count_bands(bands, redis_key)
+        return [sum(counts) for counts in zip(*self.fan_out(lambda _, shard: shard.count_bands(bands, redis_key)))]
+
+    def all(self, redis_key=REDIS_KEY, proxy_score_min=PROXY_SCORE_MIN, proxy_score_max=PROXY_SCORE_MAX) -> List[Proxy]:
+        if redis_key != REDIS_KEY:
+            return self.shards[0].all(redis_key, proxy_score_min, proxy_score_max)
+        return sum((proxies or [] for proxies in self.fan_out(
+            lambda _, shard: shard.all(redis_key, proxy_score_min, proxy_score_max))), [])
+
+    def ranked(self, offset, limit, reverse=True, redis_key=REDIS_KEY):
+        """
+        merge top offset + limit of every shard
+        """
+        if redis_key != REDIS_KEY:
+            return self.shards[0].ranked(offset, limit, reverse, redis_key)
+        if limit < 0:
+            items = sum(self.fan_out(lambda _, shard: shard.ranked(0, -1, reverse, redis_key)), [])
+            return sorted(items, key=lambda item: item[1], reverse=reverse)[offset:]
+        items = heapq.merge(*self.fan_out(lambda _, shard: shard.ranked(0, offset + limit, reverse, redis_key)),
+                            key=lambda item: item[1], reverse=reverse)
+        return list(items)[offset:offset + limit]
+
+    def batch(self, cursor, count, redis_key=REDIS_KEY):
+        """
+        get batch of proxies, shards are scanned one after another,
+        cursor is a tuple of index of shard and its cursor, 0 when all are scanned
+        """
+        if redis_key != REDIS_KEY:
+            return self.shards[0].batch(cursor, count, redis_key)
+        index, shard_cursor = cursor or (0, 0)
+        shard_cursor, proxies = self.shards[index].batch(shard_cursor, count, redis_key)
+        if not shard_cursor:
+            index, shard_cursor = index + 1, 0
+        return ((index, shard_cursor) if index < len(self.shards) else 0), proxies
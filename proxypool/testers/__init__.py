@@ -1,16 +1,40 @@
-import pkgutil
-from .base import BaseTester
+import importlib
 import inspect
+import pkgutil
+
+
+# classes subclass of BaseTester, discovered on first access of __all__
+_classes = None
+
 
+def discover():
+    """
+    import tester modules and find their tester classes
+    :return: list of tester classes
+    """
+    global _classes
+    from .base import BaseTester
+    classes = []
+    for _, name, is_pkg in pkgutil.walk_packages(__path__, prefix=f'{__name__}.'):
+        if is_pkg or name == BaseTester.__module__:
+            continue
+        module = importlib.import_module(name)
+        for _, value in inspect.getmembers(module, inspect.isclass):
+            if issubclass(value, BaseTester) and value is not BaseTester and value.__module__ == name \
+                    and not getattr(value, 'ignore', False):
+                classes.append(value)
+    _classes = classes
+    return classes
 
-# load classes subclass of BaseCrawler
-classes = []
-for loader, name, is_pkg in pkgutil.walk_packages(__path__):
-    module = loader.find_module(name).load_module(name)
-    for name, value in inspect.getmembers(module):
-        globals()[name] = value
-        if inspect.isclass(value) and issubclass(value, BaseTester) and value is not BaseTester \
-                and not getattr(value, 'ignore', False):
-            classes.append(value)
-__all__ = __ALL__ = classes
 
+def __getattr__(name):
+    """
+    discover testers lazily, `from proxypool.testers import __all__` and tester classes by name still work
+    """
+    if name in ('__all__', '__ALL__'):
+        return _classes if _classes is not None else discover()
+    if not name.startswith('__'):
+        for cls in __getattr__('__all__'):
+            if cls.__name__ == name:
+                return cls
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,13 +1,23 @@
-from proxypool.setting import TEST_DONT_SET_MAX_SCORE, PROXY_SCORE_INIT, PROXY_SCORE_MAX, PROXY_SCORE_MIN
+from proxypool.setting import TEST_DONT_SET_MAX_SCORE, PROXY_SCORE_INIT, PROXY_SCORE_MAX, PROXY_SCORE_MIN, \
+    TEST_TIMEOUT
 
 
 class BaseTester(object):
+    """
+    base tester of a sub-pool, checks proxies of key against test_url,
+    override the async hooks to check status and headers, read part of the body, or request in your own way
+    """
     test_url = ""
     key = ""
     test_dont_set_max_score = TEST_DONT_SET_MAX_SCORE
     proxy_score_init = PROXY_SCORE_INIT
     proxy_score_max = PROXY_SCORE_MAX
     proxy_score_min = PROXY_SCORE_MIN
+    # method of request, HEAD to skip the body
+    method = 'GET'
+    # bytes of body read and passed to parse, None to read the whole body
+    read_limit = None
+    timeout = TEST_TIMEOUT
 
     def headers(self):
         return None
@@ -15,5 +25,35 @@ class BaseTester(object):
     def cookies(self):
         return None
 
+    async def check(self, session, proxy):
+        """
+        check proxy, override it to run your own request logic on the shared session,
+        like a CONNECT-only check with proxypool.utils.protocol.probe
+        :param session: aiohttp session shared by checks of the proxy
+        :param proxy: Proxy object
+        :return: True if proxy is valid for this tester
+        """
+        async with session.request(self.method, self.test_url, proxy=f'http://{proxy.string()}',
+                                   timeout=self.timeout, headers=self.headers(), cookies=self.cookies(),
+                                   allow_redirects=False) as response:
+            result = await self.check_response(response, proxy)
+            if result is not None:
+                return result
+            if self.read_limit is None:
+                html = await response.text()
+            else:
+                body = await response.content.read(self.read_limit)
+                html = body.decode(response.charset or 'utf-8', errors='replace')
+            return await self.parse(html, self.test_url, proxy.string())
+
+    async def check_response(self, response, proxy):
+        """
+        check status and headers before the body is read
+        :param response: aiohttp response
+        :param proxy: Proxy object
+        :return: True or False to decide without reading the body, None to read and parse it
+        """
+        return None
+
     async def parse(self, html, url, proxy, expr='{"code":0'):
         return True if expr in html else False
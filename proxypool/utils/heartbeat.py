@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from loguru import logger
+from proxypool.setting import HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, PROGRESS_TIMEOUT
+
+
+class Heartbeat(object):
+    """
+    heartbeat of tester, getter or server, beats into storage from a background thread,
+    so it keeps beating during long cycles, and stops if the process dies or the thread starting it dies,
+    a hung loop is told by progress it reports, see stalled
+    """
+
+    def __init__(self, storage, role, cycle_max=0, interval=HEARTBEAT_INTERVAL):
+        """
+        init heartbeat
+        :param storage: storage of proxypool
+        :param role: tester, getter or server
+        :param cycle_max: seconds between cycles at most, to compute lag, 0 if role has no cycles
+        :param interval: seconds between beats
+        """
+        self.storage = storage
+        self.role = role
+        self.interval = interval
+        self.owner = None
+        self.status = {
+            'pid': os.getpid(),
+            'state': 'running' if not cycle_max else 'starting',
+            'cycles': 0,
+            'cycle_max': cycle_max,
+            'cycle_started_at': None,
+            'cycle_finished_at': None,
+            'last_cycle_seconds': None,
+            'progress_at': None,
+        }
+
+    def start(self):
+        self.owner = threading.current_thread()
+        self.beat()
+        threading.Thread(target=self.beat_forever, daemon=True).start()
+        return self
+
+    @logger.catch
+    def beat(self):
+        self.status['beat_at'] = time.time()
+        self.storage.beat(self.role, dict(self.status))
+
+    def beat_forever(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.owner.is_alive():
+                return
+            self.beat()
+
+    def progress(self):
+        """
+        report progress of loop, like a tested batch, published by next beat
+        """
+        self.status['progress_at'] = time.time()
+
+    @contextmanager
+    def cycle(self):
+        """
+        track duration of a cycle of tester or getter
+        """
+        start = time.time()
+        self.status.update(state='cycling', cycle_started_at=start, progress_at=start)
+        try:
+            yield
+        finally:
+            now = time.time()
+            self.status.update(state='waiting', cycles=self.status['cycles'] + 1, cycle_finished_at=now,
+                               last_cycle_seconds=round(now - start, 3))
+            self.beat()
+
+
+def stalled(status, now=None):
+    """
+    seconds a process made no progress for, if longer than PROGRESS_TIMEOUT, a cycling process must report
+    progress, and a waiting one must start its next cycle within cycle_max
+    :param status: status of heartbeat, see Heartbeat
+    :return: seconds, 0 if it's progressing
+    """
+    now = now or time.time()
+    if status['state'] == 'cycling':
+        idle = now - max(status.get('progress_at') or 0, status['cycle_started_at'])
+    elif status['state'] == 'waiting':
+        idle = now - status['cycle_finished_at'] - status['cycle_max']
+    else:
+        return 0
+    return round(idle, 3) if idle > PROGRESS_TIMEOUT else 0
+
+
+def health(heartbeats, roles, now=None):
+    """
+    liveness of roles by their heartbeats
+    :param heartbeats: dict of role to status, see Heartbeat
+    :param roles: enabled roles
+    :return: dict of role to liveness, pid, state, cycles, duration of last and current cycle, lag and stall,
+        lag is seconds a waiting role is overdue for its next cycle, a stalled role is not alive
+    """
+    now = now or time.time()
+    result = {}
+    for role in roles:
+        status = heartbeats.get(role)
+        if not status:
+            result[role] = {'alive': False, 'state': 'unknown'}
+            continue
+        lag = now - status['cycle_finished_at'] - status['cycle_max'] if status['state'] == 'waiting' else 0
+        cycling = now - status['cycle_started_at'] if status['state'] == 'cycling' else 0
+        stalled_seconds = stalled(status, now)
+        result[role] = {
+            'alive': now - status['beat_at'] < HEARTBEAT_TIMEOUT and not stalled_seconds,
+            'pid': status['pid'],
+            'state': status['state'],
+            'cycles': status['cycles'],
+            'last_cycle_seconds': status['last_cycle_seconds'],
+            'cycling_seconds': round(cycling, 3),
+            'lag': round(max(lag, 0), 3),
+            'stalled_seconds': stalled_seconds,
+            'last_beat_seconds': round(now - status['beat_at'], 3),
+        }
+    return result
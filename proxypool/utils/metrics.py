@@ -0,0 +1,184 @@
+import functools
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from proxypool.setting import ENABLE_METRICS, METRICS_KEY, METRICS_FLUSH_INTERVAL
+
+
+# buckets of histograms in seconds
+BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+LE_PATTERN = re.compile(r'le="([^"]+)"')
+
+# definition of metrics, name: (type, help)
+DEFINITIONS = {
+    'proxypool_server_requests_total': ('counter', 'api requests by endpoint and redis key'),
+    'proxypool_server_request_seconds': ('histogram', 'api request latency by endpoint and redis key'),
+    'proxypool_server_leases_total': ('counter', 'proxies leased by redis key, and if shared as all were leased'),
+    'proxypool_server_reports_total': ('counter', 'results of requests through proxies reported by clients'),
+    'proxypool_redis_command_seconds': ('histogram', 'redis client operation latency'),
+    'proxypool_tester_checks_total': ('counter', 'proxy checks by result, valid, invalid, timeout or error'),
+    'proxypool_tester_cache_total': ('counter', 'lookups of cached verdicts of tests by result, hit or miss'),
+    'proxypool_tester_sweep_seconds': ('histogram', 'duration of a whole tester sweep'),
+    'proxypool_getter_fetch_seconds': ('histogram', 'crawler page fetch latency'),
+    'proxypool_getter_parse_seconds': ('histogram', 'crawler page parse duration'),
+    'proxypool_getter_proxies_total': ('counter', 'proxies yielded by crawler'),
+    'proxypool_getter_fetch_failures_total': ('counter', 'crawler fetches failed, or skipped by circuit breaker'),
+    'proxypool_getter_unmodified_total': ('counter', 'pages skipped by crawler as not modified since last fetch'),
+    'proxypool_pool_proxies': ('gauge', 'proxies in pool by redis key and score band'),
+    'proxypool_pool_leased': ('gauge', 'proxies leased by `/lease` and not expired by redis key'),
+    'proxypool_pool_evicted_total': ('counter', 'proxies evicted from full pool by eviction policy'),
+}
+
+
+def _escape(value):
+    """
+    escape label value like prometheus text format, backslash, double quote and line feed
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    """
+    render labels to prometheus format, like {key="proxies:universal"}
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in sorted(labels.items())) + '}'
+
+
+def _sort_key(item):
+    """
+    sort samples by labels, buckets by their upper bound
+    """
+    sample = item[0]
+    match = LE_PATTERN.search(sample)
+    return LE_PATTERN.sub('', sample), float(match.group(1)) if match else 0
+
+
+class Metrics(object):
+    """
+    in-process counters and histograms, deltas are flushed into a hash of storage periodically,
+    so getter, tester and server processes are aggregated in one place
+    """
+
+    def __init__(self, enabled=ENABLE_METRICS, key=METRICS_KEY, interval=METRICS_FLUSH_INTERVAL):
+        """
+        init metrics
+        :param enabled: if disabled, all methods do nothing
+        :param key: redis hash key to aggregate metrics
+        :param interval: seconds between flushes
+        """
+        self.enabled = enabled
+        self.key = key
+        self.interval = interval
+        self.values = {}
+        self.histograms = {}
+        self.flushed_at = time.time()
+        # crawlers of getter run in threads
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """
+        increase counter
+        """
+        if not self.enabled:
+            return
+        sample = name + _labels(labels)
+        with self.lock:
+            self.values[sample] = self.values.get(sample, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        observe value of histogram, only the bucket of value is counted here,
+        they are made cumulative when flushing
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get((name, _labels(labels)))
+            if histogram is None:
+                # counts of every bucket and +Inf, sum
+                histogram = self.histograms[(name, _labels(labels))] = [[0] * (len(BUCKETS) + 1), 0]
+            histogram[0][bisect_left(BUCKETS, value)] += 1
+            histogram[1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        observe duration of the block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        """
+        decorator to observe duration of function
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def flush(self, storage, force=True):
+        """
+        add local deltas into hash of storage
+        :param storage: storage of proxypool
+        :param force: if False, only flush when interval elapsed
+        """
+        if not self.enabled or not (self.values or self.histograms):
+            return
+        if not force and time.time() - self.flushed_at < self.interval:
+            return
+        with self.lock:
+            values, self.values = self.values, {}
+            histograms, self.histograms = self.histograms, {}
+        self.flushed_at = time.time()
+        for (name, labels), (counts, total) in histograms.items():
+            prefix = f'{name}_bucket{{{labels[1:-1]},' if labels else f'{name}_bucket{{'
+            cumulative = 0
+            for le, count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                values[f'{prefix}le="{le}"}}'] = cumulative
+            values[f'{name}_sum{labels}'] = total
+            values[f'{name}_count{labels}'] = cumulative
+        storage.flush_metrics(self.key, values)
+
+    def render(self, storage, gauges=None):
+        """
+        render aggregated metrics in prometheus text format
+        :param storage: storage of proxypool
+        :param gauges: dict of sample to value, computed at scrape time
+        :return: str
+        """
+        samples = storage.read_metrics(self.key)
+        samples.update(gauges or {})
+        families = {}
+        for sample, value in samples.items():
+            name = sample.split('{', 1)[0]
+            for suffix in ('_bucket', '_sum', '_count'):
+                if name.endswith(suffix) and name[:-len(suffix)] in DEFINITIONS:
+                    name = name[:-len(suffix)]
+            families.setdefault(name, []).append((sample, value))
+        lines = []
+        for name in sorted(families):
+            type_, help_ = DEFINITIONS.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {help_}')
+            lines.append(f'# TYPE {name} {type_}')
+            for sample, value in sorted(families[name], key=_sort_key):
+                lines.append(f'{sample} {float(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# metrics of current process
+metrics = Metrics()
@@ -0,0 +1,123 @@
+import asyncio
+import base64
+import ipaddress
+import struct
+import time
+from urllib.parse import urlsplit, unquote
+
+HTTP, HTTPS, SOCKS4, SOCKS5 = 'http', 'https', 'socks4', 'socks5'
+PROTOCOLS = (HTTP, HTTPS, SOCKS4, SOCKS5)
+
+# errors of a failed handshake, including peers which are no proxy of the protocol and close the connection
+ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError)
+
+
+def target_of(url):
+    """
+    host and port of url
+    :param url: url, like http://www.baidu.com
+    :return: host, port
+    """
+    parts = urlsplit(url)
+    return parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+
+
+def _split(proxy):
+    """
+    split host of proxy to username, password and ip
+    """
+    auth, _, ip = proxy.host.rpartition('@')
+    username, _, password = auth.partition(':')
+    return unquote(username), unquote(password), ip
+
+
+async def _connect(proxy, host, port):
+    """
+    open connection to proxy and ask it for a tunnel to host:port
+    :return: True if tunnel is established
+    """
+    username, password, ip = _split(proxy)
+    reader, writer = await asyncio.open_connection(ip, proxy.port)
+    try:
+        headers = f'CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n'
+        if username:
+            token = base64.b64encode(f'{username}:{password}'.encode()).decode()
+            headers += f'Proxy-Authorization: Basic {token}\r\n'
+        writer.write((headers + '\r\n').encode())
+        status_line = await reader.readline()
+        parts = status_line.split()
+        return len(parts) > 1 and parts[1] == b'200'
+    finally:
+        writer.close()
+
+
+async def _socks4(proxy, host, port):
+    """
+    socks4 connect, socks4a if host is a domain
+    :return: True if request is granted
+    """
+    username, _, ip = _split(proxy)
+    reader, writer = await asyncio.open_connection(ip, proxy.port)
+    try:
+        try:
+            address, domain = ipaddress.IPv4Address(host).packed, b''
+        except ValueError:
+            address, domain = b'\x00\x00\x00\x01', host.encode() + b'\x00'
+        writer.write(struct.pack('>BBH', 4, 1, port) + address + username.encode() + b'\x00' + domain)
+        reply = await reader.readexactly(8)
+        return reply[1] == 0x5a
+    finally:
+        writer.close()
+
+
+async def _socks5(proxy, host, port):
+    """
+    socks5 connect with no or username/password authentication
+    :return: True if request is granted
+    """
+    username, password, ip = _split(proxy)
+    reader, writer = await asyncio.open_connection(ip, proxy.port)
+    try:
+        methods = b'\x00\x02' if username else b'\x00'
+        writer.write(bytes([5, len(methods)]) + methods)
+        version, method = await reader.readexactly(2)
+        if version != 5:
+            return False
+        if method == 2:
+            writer.write(bytes([1, len(username)]) + username.encode() + bytes([len(password)]) + password.encode())
+            if (await reader.readexactly(2))[1] != 0:
+                return False
+        elif method != 0:
+            return False
+        writer.write(b'\x05\x01\x00\x03' + bytes([len(host)]) + host.encode() + struct.pack('>H', port))
+        reply = await reader.readexactly(2)
+        return reply[1] == 0
+    finally:
+        writer.close()
+
+
+async def probe(protocol, proxy, url, timeout):
+    """
+    probe if proxy supports protocol by a handshake to the host of url,
+    https means the proxy tunnels CONNECT requests to port 443
+    :param protocol: https, socks4 or socks5
+    :param proxy: proxy
+    :param url: test url
+    :param timeout: seconds
+    :return: if supported, latency in milliseconds
+    """
+    host, port = target_of(url)
+    if protocol == HTTPS:
+        handshake = _connect(proxy, host, 443)
+    elif protocol == SOCKS4:
+        handshake = _socks4(proxy, host, port)
+    elif protocol == SOCKS5:
+        handshake = _socks5(proxy, host, port)
+    else:
+        raise ValueError(f'unknown protocol {protocol}')
+    start = time.perf_counter()
+    try:
+        supported = await asyncio.wait_for(handshake, timeout)
+    except ERRORS:
+        supported = False
+    return supported, int((time.perf_counter() - start) * 1000)
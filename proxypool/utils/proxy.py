@@ -1,19 +1,68 @@
+import re
+from ipaddress import IPv6Address
 from proxypool.schemas import Proxy
 
 
+# ipv4 octet, 0-255, leading zeros allowed as before
+_OCTET = r'(?:25[0-5]|2[0-4][0-9]|[01]?[0-9]?[0-9])'
+IPV4_PATTERN = re.compile(rf'^(?:{_OCTET}\.){{3}}{_OCTET}$')
+# <ipv4 or [ipv6]>[:<port>], the optional <auth>@ prefix is split off before matching
+ADDRESS_PATTERN = re.compile(
+    rf'(?:(?P<ipv4>(?:{_OCTET}\.){{3}}{_OCTET})|\[(?P<ipv6>[0-9a-fA-F:.]+)\])'
+    rf'(?::(?P<port>[0-9]+))?')
+
+
+def _match_address(data):
+    """
+    split auth and match the address part of proxy string
+    :param data: proxy string
+    :return: (auth, match), match is None if invalid
+    """
+    auth = None
+    if '@' in data:
+        auth, _, data = data.rpartition('@')
+    return auth, ADDRESS_PATTERN.fullmatch(data)
+
+
+def _is_ipv6_valid(ip):
+    """
+    check this string is within ipv6 format
+    """
+    try:
+        IPv6Address(ip)
+    except ValueError:
+        return False
+    return True
+
+
+def parse_proxy(data):
+    """
+    parse string to proxy in a single pass
+    :param data: proxy string, like 8.8.8.8:88, user:pwd@8.8.8.8:88 or [::1]:88
+    :return: Proxy, None if invalid
+    """
+    auth, match = _match_address(data.strip())
+    if not match:
+        return None
+    ipv4, ipv6, port = match.groups()
+    if port is None:
+        return None
+    if ipv4 is None and not _is_ipv6_valid(ipv6):
+        return None
+    host = ipv4 or ipv6
+    return Proxy(host=host if auth is None else f'{auth}@{host}', port=int(port))
+
+
 def is_valid_proxy(data):
     """
     check this string is within proxy format
     """
-    if is_auth_proxy(data):
-        host, port = extract_auth_proxy(data)
-        return is_ip_valid(host) and is_port_valid(port)
-    elif data.__contains__(':'):
-        ip = data.split(':')[0]
-        port = data.split(':')[1]
-        return is_ip_valid(ip) and is_port_valid(port)
-    else:
+    _, match = _match_address(data)
+    if not match:
+        # bare ip without port is also valid
         return is_ip_valid(data)
+    ipv6 = match.group('ipv6')
+    return ipv6 is None or _is_ipv6_valid(ipv6)
 
 
 def is_ip_valid(ip):
@@ -21,17 +70,10 @@ def is_ip_valid(ip):
     check this string is within ip format
     """
     if is_auth_proxy(ip):
-        ip = ip.split('@')[1]
-    a = ip.split('.')
-    if len(a) != 4:
-        return False
-    for x in a:
-        if not x.isdigit():
-            return False
-        i = int(x)
-        if i < 0 or i > 255:
-            return False
-    return True
+        ip = ip.rpartition('@')[2]
+    if ':' in ip:
+        return _is_ipv6_valid(ip.strip('[]'))
+    return IPV4_PATTERN.match(ip) is not None
 
 
 def is_port_valid(port):
@@ -50,21 +92,13 @@ def convert_proxy_or_proxies(data):
     if isinstance(data, list):
         result = []
         for item in data:
+            proxy = parse_proxy(item)
             # skip invalid item
-            item = item.strip()
-            if not is_valid_proxy(item): continue
-            if is_auth_proxy(item):
-                host, port = extract_auth_proxy(item)
-            else:
-                host, port, *_ = item.split(':')
-            result.append(Proxy(host=host, port=int(port)))
+            if proxy is not None:
+                result.append(proxy)
         return result
-    if isinstance(data, str) and is_valid_proxy(data):
-        if is_auth_proxy(data):
-            host, port = extract_auth_proxy(data)
-        else:
-            host, port = data.split(':')
-        return Proxy(host=host, port=int(port))
+    if isinstance(data, str):
+        return parse_proxy(data)
 
 
 def is_auth_proxy(data: str) -> bool:
@@ -75,12 +109,12 @@ def extract_auth_proxy(data: str) -> (str, str):
     """
     extract host and port from a proxy with authentication
     """
-    auth = data.split('@')[0]
-    ip_port = data.split('@')[1]
-    ip = ip_port.split(':')[0]
-    port = ip_port.split(':')[1]
-    host = auth + '@' + ip
-    return host, port
+    proxy = parse_proxy(data)
+    if proxy is None:
+        auth, _, ip_port = data.partition('@')
+        ip, _, port = ip_port.partition(':')
+        return auth + '@' + ip, port
+    return proxy.host, str(proxy.port)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,61 @@
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from loguru import logger
+
+# set once shutdown is requested, loops of tester and getter stop at their next check
+stopping = threading.Event()
+
+_lock = threading.Lock()
+# number of blocks in flight which must finish before exit, like test batches and ingest pipelines
+_busy = 0
+
+
+@contextmanager
+def busy():
+    """
+    defer shutdown until the block finishes, so its results are written
+    """
+    global _busy
+    with _lock:
+        _busy += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _busy -= 1
+
+
+def is_busy():
+    return _busy > 0
+
+
+def handle(signum, frame):
+    """
+    handler of SIGTERM, exit right away if nothing is in flight, else let busy blocks finish and loops stop
+    """
+    logger.info('received signal {}, shutting down', signum)
+    stopping.set()
+    if not is_busy():
+        raise SystemExit(0)
+
+
+def install():
+    """
+    install handlers in process started by scheduler, SIGINT of ctrl-c reaches the whole process group,
+    so it's ignored and shutdown is driven by SIGTERM of scheduler
+    """
+    signal.signal(signal.SIGTERM, handle)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def wait_idle(timeout):
+    """
+    wait until no block is in flight, for tester and getter running as threads of this process
+    :return: True if idle within timeout
+    """
+    deadline = time.time() + timeout
+    while is_busy() and time.time() < deadline:
+        time.sleep(.1)
+    return not is_busy()